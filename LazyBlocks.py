@@ -1,38 +1,51 @@
 """LazyBlocks game implementation using Arcade library."""
 
+import argparse
 import math
-import random
-from dataclasses import dataclass
-from typing import Optional
 import arcade
 from arcade.gui import UIAnchorLayout, UIManager, UITextureButton, UIView
 import arcade.gui
-import pandas as pd
 import atexit
+import time
 import uuid
+from typing import Optional
+
+from LazyBlocks_ai import AutoPlayer
+from LazyBlocks_camera import BoardCamera
+from LazyBlocks_engine import (
+    GRID_HEIGHT,
+    GRID_SIZE,
+    GRID_WIDTH,
+    BoardGrid,
+    LazyBlocksEngine,
+    RuleSet,
+)
+from LazyBlocks_feed import StateFeed, apply_action
+from LazyBlocks_latency import LatencyTracker
+from LazyBlocks_memory import MemoryMonitor
+from LazyBlocks_metrics import METRICS_ADDRESS, GameMetrics, MetricsServer
+from LazyBlocks_scores import load_leaderboard, store_score
+from LazyBlocks_search import LookaheadPlanner
+from LazyBlocks_server import GameServer
+from LazyBlocks_snapshot import Autosaver, SnapshotError, load_snapshot_file
+from LazyBlocks_sound import SoundEngine
 
 # Constants
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 800
 
 
-PLAY_WIDTH = 300
-PLAY_HEIGHT = 600
-
-
 SCREEN_TITLE = "LazyBlocks Game"
-GRID_SIZE = 30
-GRID_WIDTH = PLAY_WIDTH // GRID_SIZE
-GRID_HEIGHT = PLAY_HEIGHT // GRID_SIZE
-SHAPES = [
-    [[1, 1, 1, 1]],  # I shape
-    [[1, 1], [1, 1]],  # O shape
-    [[0, 1, 0], [1, 1, 1]],  # T shape
-    [[0, 1, 1], [1, 1, 0]],  # S shape
-    [[1, 1, 0], [0, 1, 1]],  # Z shape
-    [[1, 0], [1, 0], [1, 1]],  # J shape
-    [[0, 1], [0, 1], [1, 1]],  # L shape
-]
+
+# Journal of the game in progress, saved every AUTOSAVE_INTERVAL seconds
+AUTOSAVE_FILE = "autosave.lzb"
+AUTOSAVE_INTERVAL = 10.0
+# Seconds between two polls of the actions of the bots, with --feed
+FEED_POLL_INTERVAL = 0.002
+# Seconds between two publications to the spectators, with --serve
+SERVER_POLL_INTERVAL = 1 / 60
+LATENCY_FILE = "latency.json"  # Export of the input latencies (F4)
+MEMORY_REPORT_FILE = "memory.json"
 
 TINY_GRID_SIZE = 20
 NEXT_PIECE_WINDOW_WIDTH = TINY_GRID_SIZE * 4
@@ -43,65 +56,45 @@ STATUS_BAR_HEIGHT = GRID_SIZE * 2
 FILLED_COLOR = arcade.color.BLACK
 BORDER_COLOR = arcade.color.WHITE
 BACKGROUND_COLOR = arcade.color.DARK_BLUE_GRAY
-EMPTY_CELL_COLOR = arcade.color.GRAY
-
-
-@dataclass
-class CellContent:
-    """Class to represent the content of a cell in the grid."""
-
-    value: int
-    color: str
-    shape_cnt: int
-    orig_shape_idx: Optional[int] = (
-        None  # Index of the orignal shape, necessary to implement the "undo" feature
-    )
+HINT_COLOR = arcade.color.WHITE
 
 
 def draw_grid(
-    grid: list[list[CellContent]],
-    grid_height: int,
-    grid_width: int,
+    grid: BoardGrid,
+    camera: BoardCamera,
+    palette: list,
     offset_x: int = 0,
     offset_y: int = 0,
 ):
-    assert grid_height > 0 and grid_width > 0
-    assert isinstance(grid, list) and all(isinstance(row, list) for row in grid)
-    assert len(grid) == grid_height
-    assert all(len(row) == grid_width for row in grid)
-
-    for y in range(grid_height):
-        for x in range(grid_width):
+    """Draw the rows of the grid that are on screen, in the colors of `palette`."""
+    assert len(grid) == camera.board_height
+
+    size = camera.cell_size
+    for y in camera.rows:
+        row = grid[y]
+        for x in range(grid.width):
+            screen_x, screen_y = camera.to_screen(x, y)
             arcade.draw_lbwh_rectangle_filled(
-                x * GRID_SIZE + offset_x,
-                y * GRID_SIZE + offset_y,
-                GRID_SIZE,
-                GRID_SIZE,
-                grid[y][x].color,
+                screen_x + offset_x,
+                screen_y + offset_y,
+                size,
+                size,
+                palette[row[x]],
             )
             arcade.draw_lbwh_rectangle_outline(
-                x * GRID_SIZE + offset_x,
-                y * GRID_SIZE + offset_y,
-                GRID_SIZE,
-                GRID_SIZE,
+                screen_x + offset_x,
+                screen_y + offset_y,
+                size,
+                size,
                 BORDER_COLOR,
             )
 
 
-class LazyBlocks(arcade.View):
-    def __init__(self):
+class LazyBlocks(arcade.View, LazyBlocksEngine):
+    def __init__(self, rules: Optional[RuleSet] = None):
         # super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
         super().__init__()
-
-        self.grid: list[list[CellContent]] = [
-            [CellContent(value=0, color=EMPTY_CELL_COLOR, shape_cnt=-1)] * GRID_WIDTH
-            for _ in range(GRID_HEIGHT)
-        ]
-        self.current_shape = None
-        self.current_position = (0, 0)
-        self.game_over = False
-        self.score = 0
-        self.current_shape_color = None
+        LazyBlocksEngine.__init__(self, rules=rules)
 
         # Initialize Arcade
         self.all_pieces_colors = [
@@ -115,13 +108,18 @@ class LazyBlocks(arcade.View):
         ]
 
         # Load the game assets
-        self.move_piece_sound = arcade.load_sound("./blocks_assets/move_piece.wav")
-        self.drop_piece_sound = arcade.load_sound("./blocks_assets/drop_piece.wav")
-        self.rotate_piece_sound = arcade.load_sound("./blocks_assets/rotate_piece.wav")
-        self.clear_row_sound = arcade.load_sound("./blocks_assets/clear_full_row.wav")
-        self.switch_pieces_sound = arcade.load_sound(
-            "./blocks_assets/switch_pieces.wav"
+        # Sound effects are played through a bounded pool of players, so holding
+        # a key down or clearing several rows at once doesn't pile up players
+        self.sounds = SoundEngine()
+        self.sounds.register(
+            "move", "./blocks_assets/move_piece.wav", voices=1, min_interval=0.08
         )
+        self.sounds.register("drop", "./blocks_assets/drop_piece.wav", voices=2)
+        self.sounds.register(
+            "rotate", "./blocks_assets/rotate_piece.wav", voices=1, min_interval=0.08
+        )
+        self.sounds.register("clear_row", "./blocks_assets/clear_full_row.wav")
+        self.sounds.register("switch", "./blocks_assets/switch_pieces.wav")
 
         # Setup the background color to yellow
         arcade.set_background_color(BACKGROUND_COLOR)
@@ -132,27 +130,46 @@ class LazyBlocks(arcade.View):
         self.up_key_pressed = False
         self.space_key_pressed = False
         self.swap_pieces_pressed = False
-        self.current_shape_color = None
         self.is_there_row_to_clear = False
-        self.helper_piece_idx = None
-        self.helper_piece_shape = None
-        self.shapes_cnt = -1
+
+        # Heuristic bot, toggled with the B key
+        self.auto_player = AutoPlayer()
+        self.autoplay = False
+        # Lookahead planner, used for the hints (H key)
+        self.planner = LookaheadPlanner()
+        self.hint = None
 
         self.game_id = None
+        self.autosaver = Autosaver(AUTOSAVE_FILE, interval=AUTOSAVE_INTERVAL)
+        # Shared memory feed for bots in other processes, see start_feed
+        self.feed = None
+        # Spectator and remote-control server, see start_server
+        self.server = None
+        # Key press to frame latencies, shown with F3 and exported with F4
+        self.latency = LatencyTracker()
+        self.sounds.listener = self.latency.sound_started
+        self.show_latency = False
+        # Allocation and RSS tracking, see track_memory
+        self.memory = None
+        # Counters of the game, served to local scrapers by start_metrics
+        self.metrics = GameMetrics()
+        self.metrics_server = None
+        self.latency_text = arcade.Text(
+            "",
+            x=10,
+            y=SCREEN_HEIGHT - STATUS_BAR_HEIGHT - 10,
+            color=arcade.color.WHITE,
+            font_size=11,
+            font_name=("Courier New", "DejaVu Sans Mono"),
+            anchor_y="top",
+            multiline=True,
+            width=SCREEN_WIDTH,
+        )
 
         self.setup()
 
     def setup(self):
         """Set up the game and initialize variables."""
-        # Reset the game state
-        self.grid: list[list[CellContent]] = [
-            [CellContent(value=0, color=EMPTY_CELL_COLOR, shape_cnt=-1)] * GRID_WIDTH
-            for _ in range(GRID_HEIGHT)
-        ]
-        self.current_shape = None
-        self.current_position = (0, 0)
-        self.game_over = False
-        self.score = 0
         self.left_key_pressed = False
         self.right_key_pressed = False
         self.down_key_pressed = False
@@ -160,21 +177,18 @@ class LazyBlocks(arcade.View):
         self.up_key_pressed = False
         self.space_key_pressed = False
         self.swap_pieces_pressed = False
-        self.current_shape_color = None
-        self.next_shape = None
         self.is_there_row_to_clear = False
-        self.current_shape_idx = None
-        self.next_shape_idx = None
-        self.helper_piece_idx = None
-        self.shapes_cnt = -1
         # 'Next piece' grid setup
         self.next_piece_grid = [
             [0] * (NEXT_PIECE_WINDOW_WIDTH // GRID_SIZE)
             for _ in range(NEXT_PIECE_WINDOW_HEIGHT // GRID_SIZE)
         ]
 
-        # Spawn the first shape
-        self.spawn_new_shape()
+        # Reset the game state and spawn the first shape
+        self.reset_state()
+        # Rows on screen, scrolled to follow the current piece and the top of
+        # the stack on tall boards
+        self.camera = BoardCamera(self.grid_width, self.grid_height)
 
         # Score text setup, at the top of the screen
         self.score_text = arcade.Text(
@@ -187,90 +201,104 @@ class LazyBlocks(arcade.View):
 
         # Assign a random game ID (UUID4)
         self.game_id = str(uuid.uuid4())
-
-    def spawn_new_shape(self):
-        """Spawn a new shape at the top of the grid."""
-        global SHAPES
-        self.current_shape_idx = (
-            random.randint(0, len(SHAPES) - 1)
-            if self.next_shape_idx is None
-            else self.next_shape_idx
-        )
-        self.current_shape = SHAPES[self.current_shape_idx]
-
-        # Generate the helper shape
-        self.helper_piece_idx = random.randint(0, len(SHAPES) - 1)
-        self.helper_piece_shape = SHAPES[self.helper_piece_idx]
-
-        # Generate the next shape
-        self.next_shape_idx = random.randint(0, len(SHAPES) - 1)
-        self.next_shape = SHAPES[self.next_shape_idx]
-
-        self.current_position = (
-            GRID_WIDTH // 2 - len(self.current_shape[0]) // 2,
-            GRID_HEIGHT - 1,
-            # GRID_HEIGHT - len(self.current_shape) - 1,
-            # GRID_HEIGHT - 2,
-        )
-        self.current_shape_color = self.all_pieces_colors[self.current_shape_idx]
-        if not self.can_be_placed(self.current_shape, self.current_position):
-            self.game_over = True
-            print(" ---- Game Over! Your score:", self.score)
-
-        assert isinstance(self.current_shape_idx, int)
-        assert isinstance(self.next_shape_idx, int)
-
-    def swap_current_and_helper(self):
+        # A new game starts a new autosave journal
+        self.autosaver.reset()
+
+    def resume(self, path: str = AUTOSAVE_FILE):
+        """Continue the game saved in an autosave or snapshot file."""
+        snapshot = load_snapshot_file(path)
+        snapshot.restore(self)
+        if snapshot.extra:
+            self.game_id = snapshot.extra.decode()
+        self.camera = BoardCamera(self.grid_width, self.grid_height)
+        self.hint = None
+
+    def autosave(self):
+        """Save the game now, e.g. on exit."""
+        self.autosaver.save(self, self.game_id.encode())
+
+    def start_feed(self, name: str):
         """
-        Swap the current and the helper shapes
+        Publish the game in the shared memory block `name`, and play the
+        actions bots send through it (see LazyBlocks_feed). The actions are
+        polled every FEED_POLL_INTERVAL, not only at the game updates.
         """
-        (
-            self.current_shape_idx,
-            self.current_shape,
-            self.helper_piece_idx,
-            self.helper_piece_shape,
-        ) = (
-            self.helper_piece_idx,
-            self.helper_piece_shape,
-            self.current_shape_idx,
-            self.current_shape,
-        )
+        self.feed = StateFeed(name, self.grid_width, self.grid_height)
+        self.feed.publish(self)
+        arcade.schedule(self.poll_feed, FEED_POLL_INTERVAL)
+        atexit.register(self.feed.close)
+
+    def poll_feed(self, delta_time):
+        """Play the actions of the bots, and publish the state if it changed."""
+        actions = self.feed.actions()
+        self.metrics.queue_depth = len(actions)
+        for action in actions:
+            apply_action(self, action)
+        self.sounds.flush()
+        self.feed.publish(self)
+
+    def start_server(self, address: str, control_token: Optional[str] = None):
+        """
+        Stream the game to spectators on `address` (host:port, or the path of
+        a Unix socket), and play the actions of the client holding the control
+        token (see LazyBlocks_server).
+        """
+        self.server = GameServer(address, control_token)
+        self.server.start(self)
+        arcade.schedule(self.poll_server, SERVER_POLL_INTERVAL)
+        atexit.register(self.server.close)
+        print(f"Serving on {address}, control token {self.server.control_token}")
+
+    def poll_server(self, delta_time):
+        """Play the actions of the controller, and publish the state if it changed."""
+        actions = self.server.actions()
+        self.metrics.queue_depth = len(actions)
+        for action in actions:
+            apply_action(self, action)
+        self.sounds.flush()
+        self.server.publish(self)
+
+    def track_memory(self, report_path: str = MEMORY_REPORT_FILE):
+        """
+        Sample the allocations and the RSS of the game every few seconds, warn
+        about steady growth, and write the report on exit (see LazyBlocks_memory).
+        """
+        self.memory = MemoryMonitor()
+        self.memory.start()
+        arcade.schedule(self.sample_memory, self.memory.interval)
+        atexit.register(self.memory.export, report_path)
 
-        # Update the colors
-        # TODO: Find a consistent way to do this
-        self.current_shape_color = self.all_pieces_colors[self.current_shape_idx]
+    def sample_memory(self, delta_time):
+        self.memory.sample()
 
-        # Put the shape in the starting position
-        self.current_position = (
-            GRID_WIDTH // 2 - len(self.current_shape[0]) // 2,
-            GRID_HEIGHT - 1,
-        )
+    def start_metrics(self, address: str = METRICS_ADDRESS):
+        """Serve the metrics of the game in the OpenMetrics format on host:port."""
+        self.metrics_server = MetricsServer(self.metrics, self, address)
+        self.metrics_server.start()
+        atexit.register(self.metrics_server.close)
+        print(f"Metrics on http://{self.metrics_server.address}/metrics")
 
-    def can_be_placed(self, shape: list[list[int]], position: list[int]):
-        """Check if the shape can be placed at the given position."""
-        for y, row in enumerate(shape):
-            for x, cell in enumerate(row):
-                if cell:
-                    grid_x = position[0] + x
-                    grid_y = position[1] - y
-                    if (
-                        grid_x < 0
-                        or grid_x >= GRID_WIDTH
-                        or grid_y < 0
-                        or grid_y >= GRID_HEIGHT
-                        or self.grid[grid_y][grid_x].value != 0
-                    ):
-                        return False
-        return True
+    def spawn_new_shape(self):
+        """Spawn a new shape at the top of the grid."""
+        super().spawn_new_shape()
+        self.hint = None
+        if self.game_over:
+            print(" ---- Game Over! Your score:", self.score)
 
     def on_draw(self):
+        frame_start = self.latency.clock()
         # Clear the screen
         self.clear()
 
         ############################################
         # Draw the main grid
         ############################################
-        draw_grid(self.grid, GRID_HEIGHT, GRID_WIDTH, offset_x=0, offset_y=0)
+        if self.current_shape:
+            top = self.current_position[1]
+            self.camera.follow(
+                top - len(self.current_shape) + 1, top, self.stack_height
+            )
+        draw_grid(self.grid, self.camera, self.palette, offset_x=0, offset_y=0)
         ############################################
         # Draw the current shape, on the main grid
         ############################################
@@ -279,22 +307,41 @@ class LazyBlocks(arcade.View):
                 for x, cell in enumerate(row):
                     if cell:
                         arcade.draw_lbwh_rectangle_filled(
-                            (self.current_position[0] + x) * GRID_SIZE,
-                            (self.current_position[1] - y) * GRID_SIZE,
-                            GRID_SIZE,
-                            GRID_SIZE,
+                            *self.camera.to_screen(
+                                self.current_position[0] + x,
+                                self.current_position[1] - y,
+                            ),
+                            self.camera.cell_size,
+                            self.camera.cell_size,
                             self.current_shape_color,
                         )
 
                         # Draw outline for the blocks of the current shape
                         arcade.draw_lbwh_rectangle_outline(
-                            (self.current_position[0] + x) * GRID_SIZE,
-                            (self.current_position[1] - y) * GRID_SIZE,
-                            GRID_SIZE,
-                            GRID_SIZE,
+                            *self.camera.to_screen(
+                                self.current_position[0] + x,
+                                self.current_position[1] - y,
+                            ),
+                            self.camera.cell_size,
+                            self.camera.cell_size,
                             BORDER_COLOR,
                         )
         ############################################
+        # Draw the hint, as outlined cells on the main grid
+        ############################################
+        if self.hint is not None:
+            hint_x, hint_y = self.hint.placement.position
+            for y, row in enumerate(self.hint.placement.profile.shape):
+                for x, cell in enumerate(row):
+                    if cell:
+                        arcade.draw_lbwh_rectangle_outline(
+                            *self.camera.to_screen(hint_x + x, hint_y - y),
+                            self.camera.cell_size,
+                            self.camera.cell_size,
+                            HINT_COLOR,
+                            border_width=3,
+                        )
+        ############################################
         # Draw the next piece on the right side of the screen
         ############################################
         if self.next_shape:
@@ -392,55 +439,56 @@ class LazyBlocks(arcade.View):
             self.score_text.color = arcade.color.WHITE
         self.score_text.draw()
 
+        if self.show_latency:
+            self.latency_text.text = "\n".join(self.latency.report_lines())
+            self.latency_text.draw()
+        self.latency.frame_drawn(frame_start)
+        self.metrics.frame_done(frame_start)
+        if self.memory is not None:
+            self.memory.frame()
+
     def on_update(self, delta_time):
+        update_start = time.perf_counter()
+        self.update_game(delta_time)
+        self.metrics.update_done(update_start)
+
+    def update_game(self, delta_time):
         """Update the game state."""
+        self.autosaver.tick(self, self.game_id.encode())
         if self.game_over:
             return
 
+        if self.autoplay:
+            # Let the bot place the current piece through the engine methods
+            self.auto_player.play_piece(self)
+            self.sounds.flush()
+            return
+
         placement_took_place = False
         piece_rotated = False
 
         # Handle key presses for moving the shape
-        if self.left_key_pressed and self.can_be_placed(
-            self.current_shape, (self.current_position[0] - 1, self.current_position[1])
-        ):
-            self.current_position = (
-                self.current_position[0] - 1,
-                self.current_position[1],
-            )
+        if self.left_key_pressed and self.move_current_shape(-1, 0):
             placement_took_place = True
-        if self.right_key_pressed and self.can_be_placed(
-            self.current_shape, (self.current_position[0] + 1, self.current_position[1])
-        ):
-            self.current_position = (
-                self.current_position[0] + 1,
-                self.current_position[1],
-            )
+        if self.right_key_pressed and self.move_current_shape(1, 0):
             placement_took_place = True
-        if self.down_key_pressed and self.can_be_placed(
-            self.current_shape, (self.current_position[0], self.current_position[1] - 1)
-        ):
-            self.current_position = (
-                self.current_position[0],
-                self.current_position[1] - 1,
-            )
+        if self.down_key_pressed and self.move_current_shape(0, -1):
             placement_took_place = True
 
-        if self.rot_key_pressed:
-            # Rotate the shape
-            rotated_shape = [list(row) for row in zip(*self.current_shape[::-1])]
-            if self.can_be_placed(rotated_shape, self.current_position):
-                self.current_shape = rotated_shape
-                piece_rotated = True
+        if self.rot_key_pressed and self.rotate_current_shape():
+            piece_rotated = True
 
-        if self.space_key_pressed:
-            piece_dropped = True
+        if placement_took_place:
+            self.latency.applied("move")
+        if piece_rotated:
+            self.latency.applied("rotate")
 
         # Sound effects
         if placement_took_place:
-            arcade.play_sound(self.move_piece_sound)
+            self.sounds.play("move")
         elif piece_rotated:
-            arcade.play_sound(self.rotate_piece_sound)
+            self.sounds.play("rotate")
+        self.sounds.flush()
 
     def on_key_press(self, key, modifiers):
         """Handle key presses for moving and rotating the shape."""
@@ -449,30 +497,43 @@ class LazyBlocks(arcade.View):
             """Reset the game."""
             self.setup()
             print("Game reset!")
+        elif key == arcade.key.F3:
+            self.show_latency = not self.show_latency
+        elif key == arcade.key.F4:
+            self.latency.export(LATENCY_FILE)
+            print("Input latencies written to", LATENCY_FILE)
 
         if self.game_over:
             return
 
         if key == arcade.key.LEFT:
             self.left_key_pressed = True
+            self.latency.key_pressed("move", key)
         elif key == arcade.key.RIGHT:
             self.right_key_pressed = True
+            self.latency.key_pressed("move", key)
         elif key == arcade.key.DOWN:
             self.down_key_pressed = True
+            self.latency.key_pressed("move", key)
             # print("down key pressed")
         elif key == arcade.key.UP:
             # self.up_key_pressed = True
             self.rot_key_pressed = True
+            self.latency.key_pressed("rotate", key)
         elif key == arcade.key.A:
             self.rot_key_pressed = True
+            self.latency.key_pressed("rotate", key)
         elif key == arcade.key.SPACE:
             self.space_key_pressed = True
+            self.latency.key_pressed("drop", key)
             self.place_piece_on_grid()
             # Spawn a new shape
             self.spawn_new_shape()
+            self.latency.applied("drop")
         elif key == arcade.key.TAB:
             self.swap_pieces_pressed = True
-            self.switch_pieces_sound.play()
+            self.latency.key_pressed("swap", key)
+            self.sounds.play("switch")
 
         elif key == arcade.key.ESCAPE:
             """Exit the game."""
@@ -480,95 +541,60 @@ class LazyBlocks(arcade.View):
         elif key == arcade.key.X:
             # If there is a row to clear, clear it
             self.clear_full_rows()
+        elif key == arcade.key.H:
+            # Ask the planner where to put the current piece
+            self.hint = self.planner.plan(self)
+            if self.hint is not None and self.hint.swap:
+                print("Hint: swap with the helper piece first")
+        elif key == arcade.key.B:
+            # Toggle the heuristic bot
+            self.autoplay = not self.autoplay
+            print("Autoplay", "on" if self.autoplay else "off")
 
         elif key == arcade.key.Z and modifiers and arcade.key.MOD_CTRL:
             """Undo the previous move."""
-            if self.shapes_cnt > -1:
+            self.latency.key_pressed("undo", key)
+            if self.can_undo():
                 self.undo_prev_move()
                 # Spawn a new shape
                 self.spawn_new_shape()
+                self.latency.applied("undo")
                 print("Undo last move")
             else:
                 print("There is nothing I can undo")
 
-    def undo_prev_move(self):
-        """
-        Starting from the current self.shapes_cnt, keep removing pieces, until either there is no more piece to move, or there is a diff of more than 1 with the last piece
-        Then set the next piece to that shape index, and issue a spawn new piece
-        """
-        # if self.shapes_cnt < 0:
-        #     print("No pieces to undo")
-        #     return
-
-        for row_idx, row in enumerate(self.grid):
-            for col_idx, cell in enumerate(row):
-                if cell.shape_cnt == self.shapes_cnt:
-                    print("One cell to undo")
-                    # Assign the next shape index to the current shape index
-                    self.next_shape_idx = cell.orig_shape_idx
-                    # Remove the piece from the grid
-                    self.grid[row_idx][col_idx] = CellContent(
-                        value=0, color=EMPTY_CELL_COLOR, shape_cnt=-1
-                    )
-        print("-------------------")
-        # Decrease the shapes count
-        self.shapes_cnt -= 1
+        # Play the sounds triggered by this key press
+        self.sounds.flush()
 
     def place_piece_on_grid(self):
-        # Drop the shape immediately
-        while self.can_be_placed(
-            self.current_shape,
-            (self.current_position[0], self.current_position[1] - 1),
-        ):
-            self.current_position = (
-                self.current_position[0],
-                self.current_position[1] - 1,
-            )
+        """Drop the current shape and place it on the grid."""
+        super().place_piece_on_grid()
+        self.metrics.placed()
         # Play the drop sound
-        arcade.play_sound(self.drop_piece_sound)
-        # Place the shape on the grid
-        self.shapes_cnt += 1
-        for y, row in enumerate(self.current_shape):
-            for x, cell in enumerate(row):
-                if cell:
-                    grid_x = self.current_position[0] + x
-                    grid_y = self.current_position[1] - y
-                    if grid_y >= 0:
-                        self.grid[grid_y][grid_x] = CellContent(
-                            value=1,
-                            color=self.current_shape_color,
-                            shape_cnt=self.shapes_cnt,
-                            orig_shape_idx=self.current_shape_idx,
-                        )
+        self.sounds.play("drop")
 
     def clear_full_rows(self):
         """Clear full rows and update the score."""
-        all_clear = False
-        while not all_clear:
-            all_clear = True
-            for y in range(GRID_HEIGHT):
-                if all([item.value for item in self.grid[y]]):
-                    # Clear the row
-                    del self.grid[y]
-                    self.grid.append(
-                        [
-                            CellContent(
-                                value=0,
-                                color=EMPTY_CELL_COLOR,
-                                shape_cnt=-1,
-                                orig_shape_idx=None,
-                            )
-                        ]
-                        * GRID_WIDTH
-                    )
-                    self.score += 1
-                    all_clear = False
-                    # Play the sound for clearing a row
-                    arcade.play_sound(self.clear_row_sound)
-                    # Store the scores in the CSV file
-                    self.store_scores()
-                    break
+        cleared_rows = super().clear_full_rows()
+        self.metrics.lines_cleared += cleared_rows
+        if cleared_rows:
+            # Play the sound for clearing a row
+            self.sounds.play("clear_row")
+            # Store the scores in the CSV file
+            self.store_scores()
         print("Score:", self.score)
+        return cleared_rows
+
+    def swap_current_and_helper(self):
+        """Swap the current and the helper shapes."""
+        swaps = self.swap_count
+        super().swap_current_and_helper()
+        self.metrics.swaps += self.swap_count - swaps
+
+    def undo_prev_move(self):
+        """Undo the previous move."""
+        super().undo_prev_move()
+        self.metrics.undos += 1
 
     def on_key_release(self, key, modifiers):
         """Handle key releases."""
@@ -590,38 +616,18 @@ class LazyBlocks(arcade.View):
             arcade.close_window()
         elif key == arcade.key.TAB:
             self.swap_current_and_helper()
+            self.latency.applied("swap")
+        self.latency.key_released(key)
 
     def store_scores(self):
         """
         Store the scores in a CSV file in the format:
         Date, Player, GameID, Score.
         """
-        scores_file = "scores.csv"
-        # Prepare the data to be written
-        data = {
-            "date": pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "player": "Player",  # Placeholder for player name
-            "gameid": self.game_id,
-            "score": self.score,
-        }
-        # Read the existing scores from the CSV file
-        df: pd.DataFrame = pd.DataFrame()
-        try:
-            df = pd.read_csv(scores_file)
-        except FileNotFoundError:
-            df = pd.DataFrame(columns=["date", "player", "gameid", "score"])
-
-        # Check if the game ID already exists. If it does, update the score. If it doesn't, append the new score.
-        if data["gameid"] in df["gameid"].values:
-            df.loc[df["gameid"] == data["gameid"], "score"] = data["score"]
-        else:
-            df = pd.concat(
-                [df, pd.DataFrame([data])],
-                ignore_index=True,
-            )
+        start = time.perf_counter()
+        store_score(self.game_id, self.score)
+        self.metrics.score_write_seconds.observe(time.perf_counter() - start)
 
-        # Store the updated scores back to the CSV file
-        df.to_csv(scores_file, index=False)        
 
 class Leaderboard(arcade.View):
     """View to display the leaderboard."""
@@ -645,11 +651,7 @@ class Leaderboard(arcade.View):
 
     def load_leaderboard_data(self):
         """Load the leaderboard data from the CSV file."""
-        try:
-            df = pd.read_csv("scores.csv")
-            return df.sort_values(by="score", ascending=False).head(10)
-        except FileNotFoundError:
-            return pd.DataFrame(columns=["date", "player", "gameid", "score"])
+        return load_leaderboard()
 
     def on_show_view(self):
         """This is run once when we switch to this view"""
@@ -685,7 +687,7 @@ class GameSettings(arcade.View):
         @start_new_game_btn.event("on_click")
         def on_start_new_game_btn_click(event):
             """Handle the button click event."""
-            self.game_view = LazyBlocks()
+            self.game_view = LazyBlocks(self.game_view.rules)
             game_window.show_view(self.game_view)
 
         @leaderboard_btn.event("on_click")
@@ -739,12 +741,65 @@ class GameSettings(arcade.View):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=SCREEN_TITLE)
+    parser.add_argument("--board-width", type=int, default=GRID_WIDTH)
+    parser.add_argument("--board-height", type=int, default=GRID_HEIGHT)
+    parser.add_argument(
+        "--resume",
+        nargs="?",
+        const=AUTOSAVE_FILE,
+        help="Continue a saved game (by default the last autosave)",
+    )
+    parser.add_argument(
+        "--feed",
+        metavar="NAME",
+        help="Publish the game in shared memory for bots (see LazyBlocks_feed)",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="ADDRESS",
+        help="Stream the game to spectators on host:port or a Unix socket path",
+    )
+    parser.add_argument(
+        "--control-token", help="Token of the remote controller (default: random)"
+    )
+    parser.add_argument(
+        "--track-memory",
+        nargs="?",
+        const=MEMORY_REPORT_FILE,
+        metavar="REPORT",
+        help="Track the allocations and RSS, and write a report on exit",
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="?",
+        const=METRICS_ADDRESS,
+        metavar="ADDRESS",
+        help=f"Serve OpenMetrics on host:port (default: {METRICS_ADDRESS})",
+    )
+    args = parser.parse_args()
+
     game_window = arcade.Window(
         width=SCREEN_WIDTH, height=SCREEN_HEIGHT, title=SCREEN_TITLE, resizable=True
     )
     game_window.set_update_rate(1 / 10)  # Set the update rate to 10 FPS
-    main_game_view = LazyBlocks()
+    main_game_view = LazyBlocks(
+        RuleSet(grid_width=args.board_width, grid_height=args.board_height)
+    )
     main_game_view.setup()
+    if args.resume:
+        try:
+            main_game_view.resume(args.resume)
+        except (OSError, SnapshotError) as error:
+            print(f"Cannot resume {args.resume} ({error}), starting a new game")
+    if args.feed:
+        main_game_view.start_feed(args.feed)
+    if args.serve:
+        main_game_view.start_server(args.serve, args.control_token)
+    if args.track_memory:
+        main_game_view.track_memory(args.track_memory)
+    if args.metrics:
+        main_game_view.start_metrics(args.metrics)
 
     # game_settings_view = GameSettings(game_view=main_game_view)
 
@@ -752,6 +807,7 @@ if __name__ == "__main__":
     game_window.show_view(main_game_view)
     # Register a function to store the scores when the game exits
     atexit.register(main_game_view.store_scores)
+    atexit.register(main_game_view.autosave)
 
     arcade.set_background_color(BACKGROUND_COLOR)
     arcade.run()
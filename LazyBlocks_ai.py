@@ -0,0 +1,338 @@
+"""Placement enumeration and a heuristic auto-player for LazyBlocks."""
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+import LazyBlocks_kernels
+from LazyBlocks_engine import (
+    FEATURE_HOLES,
+    GRID_HEIGHT,
+    GRID_WIDTH,
+    SHAPES,
+    BoardGrid,
+    LazyBlocksEngine,
+    rotate_shape,
+)
+
+
+@dataclass(frozen=True)
+class ShapeProfile:
+    """One distinct rotation of a shape, with the per-column data needed to drop it."""
+
+    shape_idx: int
+    rotation: int  # Number of clockwise rotations from the spawn orientation
+    shape: tuple[tuple[int, ...], ...]
+    width: int
+    height: int
+    bottom: tuple[int, ...]  # Lowest filled cell of each column, from the bottom row
+    top: tuple[int, ...]  # One above the highest filled cell of each column
+    gaps: tuple[int, ...]  # Empty cells between the bottom and top of each column
+    column_bits: tuple[int, ...]  # Filled cells of each column, bit 0 = bottom row
+    row_cells: tuple[int, ...]  # Number of filled cells of each row, from the bottom
+
+
+def build_shape_profiles(shape_idx: int) -> list[ShapeProfile]:
+    """Profiles of the distinct rotations of a shape, in rotation order."""
+    profiles = []
+    seen = set()
+    shape = SHAPES[shape_idx]
+    for rotation in range(4):
+        key = tuple(tuple(row) for row in shape)
+        if key not in seen:
+            seen.add(key)
+            height = len(shape)
+            width = len(shape[0])
+            # Flip the rows, so that index 0 is the bottom row of the shape
+            rows_from_bottom = shape[::-1]
+            column_bits = []
+            for x in range(width):
+                bits = 0
+                for y in range(height):
+                    if rows_from_bottom[y][x]:
+                        bits |= 1 << y
+                assert bits, "Shapes must not have empty columns"
+                column_bits.append(bits)
+            bottom = tuple((bits & -bits).bit_length() - 1 for bits in column_bits)
+            top = tuple(bits.bit_length() for bits in column_bits)
+            profiles.append(
+                ShapeProfile(
+                    shape_idx=shape_idx,
+                    rotation=rotation,
+                    shape=key,
+                    width=width,
+                    height=height,
+                    bottom=bottom,
+                    top=top,
+                    gaps=tuple(
+                        t - b - bits.bit_count()
+                        for t, b, bits in zip(top, bottom, column_bits)
+                    ),
+                    column_bits=tuple(column_bits),
+                    row_cells=tuple(sum(row) for row in rows_from_bottom),
+                )
+            )
+        shape = rotate_shape(shape)
+    return profiles
+
+
+SHAPE_PROFILES = [build_shape_profiles(idx) for idx in range(len(SHAPES))]
+MAX_SHAPE_HEIGHT = max(p.height for profiles in SHAPE_PROFILES for p in profiles)
+
+# Compiled placement search, None without Numba (see `LazyBlocks_kernels`)
+KERNELS = (
+    LazyBlocks_kernels.PlacementKernels(SHAPE_PROFILES)
+    if LazyBlocks_kernels.ENABLED
+    else None
+)
+
+
+@dataclass
+class BoardState:
+    """Occupancy summary of a grid: the only input the enumerator needs."""
+
+    heights: list[int]  # Height of each column (row of its top cell + 1)
+    column_masks: list[int]  # Filled cells of each column, bit y = row y
+    row_counts: list[int]  # Number of filled cells of each row
+    holes: int  # Empty cells below the top of their column
+    width: int = GRID_WIDTH
+    height: int = GRID_HEIGHT
+
+    @classmethod
+    def from_grid(cls, grid: BoardGrid) -> "BoardState":
+        width = grid.width
+        column_masks = [0] * width
+        row_counts = [0] * len(grid)
+        for y, row in enumerate(grid):
+            count = 0
+            for x, cell in enumerate(row):
+                if cell:
+                    column_masks[x] |= 1 << y
+                    count += 1
+            row_counts[y] = count
+        heights = [mask.bit_length() for mask in column_masks]
+        holes = sum(h - mask.bit_count() for h, mask in zip(heights, column_masks))
+        return cls(heights, column_masks, row_counts, holes, width, len(grid))
+
+    @classmethod
+    def from_engine(cls, engine: LazyBlocksEngine) -> "BoardState":
+        """Read the state from the engine's incrementally maintained features."""
+        features = engine.board_features
+        row_counts = [mask.bit_count() for mask in features.row_masks]
+        # Rows above the stored ones are empty: only the rows a piece can reach
+        # are listed, so that tall boards are summarized in O(stack height)
+        reach = min(features.height, max(features.heights) + MAX_SHAPE_HEIGHT)
+        row_counts.extend([0] * (reach - len(row_counts)))
+        return cls(
+            list(features.heights),
+            features.column_masks[:],
+            row_counts,
+            engine.features[FEATURE_HOLES],
+            features.width,
+            features.height,
+        )
+
+
+@dataclass(frozen=True)
+class Placement:
+    """Final resting place of a piece, as reached by a hard drop."""
+
+    profile: ShapeProfile
+    x: int
+    base: int  # Grid row of the bottom row of the shape
+    lines: int  # Number of rows completed by the placement
+
+    @property
+    def position(self) -> tuple[int, int]:
+        """The engine's `current_position` of the placed shape (top-left cell)."""
+        return (self.x, self.base + self.profile.height - 1)
+
+
+def enumerate_placements(board: BoardState, shape_idx: int) -> list[Placement]:
+    """Every legal hard-drop placement of a shape, across its distinct rotations."""
+    if KERNELS is not None and KERNELS.usable(board):
+        profiles = KERNELS.profiles
+        return [
+            Placement(profiles[number], x, base, lines)
+            for number, lines, base, x in KERNELS.placements(board, shape_idx).tolist()
+        ]
+    placements = []
+    heights = board.heights
+    row_counts = board.row_counts
+    for profile in SHAPE_PROFILES[shape_idx]:
+        bottom = profile.bottom
+        columns = range(profile.width)
+        for x in range(board.width - profile.width + 1):
+            base = max(heights[x + c] - bottom[c] for c in columns)
+            if base + profile.height > board.height:
+                continue
+            lines = 0
+            for r, cells in enumerate(profile.row_cells):
+                if row_counts[base + r] + cells == board.width:
+                    lines += 1
+            placements.append(Placement(profile, x, base, lines))
+    return placements
+
+
+def resulting_board(board: BoardState, placement: Placement) -> BoardState:
+    """The board after the placement, with its completed rows cleared."""
+    profile = placement.profile
+    masks = board.column_masks[:]
+    row_counts = board.row_counts[:]
+    for c, bits in enumerate(profile.column_bits):
+        masks[placement.x + c] |= bits << placement.base
+    for r, cells in enumerate(profile.row_cells):
+        row_counts[placement.base + r] += cells
+    full_rows = [y for y, count in enumerate(row_counts) if count == board.width]
+    for y in reversed(full_rows):
+        low = (1 << y) - 1
+        masks = [(mask & low) | ((mask >> (y + 1)) << y) for mask in masks]
+        del row_counts[y]
+        row_counts.append(0)
+    heights = [mask.bit_length() for mask in masks]
+    holes = sum(h - mask.bit_count() for h, mask in zip(heights, masks))
+    return BoardState(heights, masks, row_counts, holes, board.width, board.height)
+
+
+@dataclass
+class HeuristicWeights:
+    """Weights of the board features; the defaults are the classic hand-tuned ones."""
+
+    aggregate_height: float = -0.510066
+    holes: float = -0.35663
+    bumpiness: float = -0.184483
+    lines: float = 0.760666
+
+
+@dataclass
+class HeuristicEvaluator:
+    """Score a placement with a weighted sum of the resulting board's features."""
+
+    weights: HeuristicWeights = field(default_factory=HeuristicWeights)
+
+    def features(
+        self, board: BoardState, placement: Placement
+    ) -> tuple[int, int, int, int]:
+        """(aggregate height, holes, bumpiness, completed lines) after the placement."""
+        if placement.lines:
+            after = resulting_board(board, placement)
+            heights = after.heights
+            holes = after.holes
+        else:
+            # No row is cleared: only the columns under the piece change
+            profile = placement.profile
+            base = placement.base
+            heights = board.heights[:]
+            holes = board.holes
+            for c in range(profile.width):
+                col = placement.x + c
+                holes += base + profile.bottom[c] - heights[col] + profile.gaps[c]
+                heights[col] = base + profile.top[c]
+        bumpiness = 0
+        previous = heights[0]
+        for h in heights:
+            bumpiness += h - previous if h > previous else previous - h
+            previous = h
+        return sum(heights), holes, bumpiness, placement.lines
+
+    def evaluate(self, board: BoardState, placement: Placement) -> float:
+        aggregate_height, holes, bumpiness, lines = self.features(board, placement)
+        w = self.weights
+        return (
+            w.aggregate_height * aggregate_height
+            + w.holes * holes
+            + w.bumpiness * bumpiness
+            + w.lines * lines
+        )
+
+    def evaluate_all(
+        self, board: BoardState, placements: list[Placement]
+    ) -> list[float]:
+        if (
+            KERNELS is not None
+            and type(self) is HeuristicEvaluator
+            and placements
+            and KERNELS.usable(board)
+        ):
+            features = KERNELS.features(board, KERNELS.table(placements))
+            return KERNELS.scores(features, self.weights).tolist()
+        return [self.evaluate(board, placement) for placement in placements]
+
+
+def best_placement(
+    board: BoardState, shape_idx: int, evaluator: HeuristicEvaluator
+) -> Optional[tuple[float, Placement]]:
+    """Highest scoring placement of a shape, or None if it cannot be placed."""
+    placements = enumerate_placements(board, shape_idx)
+    if not placements:
+        return None
+    scores = evaluator.evaluate_all(board, placements)
+    best = max(range(len(placements)), key=scores.__getitem__)
+    return scores[best], placements[best]
+
+
+def apply_placement(engine: LazyBlocksEngine, placement: Placement):
+    """Play a placement through the engine: rotate, move, drop, clear and spawn."""
+    engine.current_shape = [list(row) for row in placement.profile.shape]
+    engine.current_position = placement.position
+    engine.place_piece_on_grid()
+    if placement.lines:
+        engine.clear_full_rows()
+    engine.spawn_new_shape()
+
+
+class AutoPlayer:
+    """Greedy bot: plays the best scoring placement of the current piece."""
+
+    def __init__(
+        self, evaluator: Optional[HeuristicEvaluator] = None, use_helper: bool = False
+    ):
+        self.evaluator = evaluator or HeuristicEvaluator()
+        self.use_helper = use_helper  # Also consider swapping with the helper piece
+
+    def choose(self, engine: LazyBlocksEngine) -> Optional[tuple[bool, Placement]]:
+        """Return (swap with helper first?, placement), or None if nothing fits."""
+        board = BoardState.from_engine(engine)
+        if (
+            KERNELS is not None
+            and type(self.evaluator) is HeuristicEvaluator
+            and KERNELS.usable(board)
+        ):
+            # Only the best placement is built, from the compiled search
+            shapes = [engine.current_shape_idx]
+            if self.use_helper and engine.helper_piece_idx is not None:
+                shapes.append(engine.helper_piece_idx)
+            best = KERNELS.best_placement(board, shapes, self.evaluator.weights)
+            if best is None:
+                return None
+            shape, (number, lines, base, x) = best
+            return shape == 1, Placement(KERNELS.profiles[number], x, base, lines)
+        placements = enumerate_placements(board, engine.current_shape_idx)
+        first_helper_placement = len(placements)
+        if self.use_helper and engine.helper_piece_idx is not None:
+            placements += enumerate_placements(board, engine.helper_piece_idx)
+        if not placements:
+            return None
+        # Score the placements of both pieces in one call, for batched evaluators
+        scores = self.evaluator.evaluate_all(board, placements)
+        best = max(range(len(placements)), key=scores.__getitem__)
+        return best >= first_helper_placement, placements[best]
+
+    def play_piece(self, engine: LazyBlocksEngine) -> bool:
+        """Place the current piece. Return False if the game is (or becomes) over."""
+        if engine.game_over:
+            return False
+        play_choice(engine, self.choose(engine))
+        return not engine.game_over
+
+
+def play_choice(engine: LazyBlocksEngine, choice: Optional[tuple[bool, Placement]]):
+    """Play a result of `AutoPlayer.choose`: (swap, placement), or None to drop."""
+    if choice is None:
+        # Nothing fits: drop the piece where it is, the next spawn ends the game
+        engine.place_piece_on_grid()
+        engine.spawn_new_shape()
+    else:
+        swap, placement = choice
+        if swap:
+            engine.swap_current_and_helper()
+        apply_placement(engine, placement)
@@ -0,0 +1,235 @@
+"""
+Batched NumPy evaluation of candidate placements.
+
+`BatchEvaluator` is a drop-in replacement for `HeuristicEvaluator`: instead of
+scoring placements one by one, it stacks all the resulting boards in one
+array and computes their features in a single vectorized pass.
+
+Run this module to compare both evaluators on a single core:
+    python LazyBlocks_batch.py
+"""
+
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from LazyBlocks_ai import (
+    KERNELS,
+    SHAPE_PROFILES,
+    AutoPlayer,
+    BoardState,
+    HeuristicEvaluator,
+    HeuristicWeights,
+    Placement,
+    enumerate_placements,
+)
+from LazyBlocks_engine import LazyBlocksEngine
+
+# Column masks are converted to float64 to find their highest bit: the stack
+# and a piece on top of it must fit in the mantissa
+MAX_MASK_BITS = 53
+
+
+def _profile_tables() -> tuple[dict, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Number every shape profile, and tabulate the cells of its columns (bit 0 =
+    bottom row of the shape) and their top, padded to the widest shape.
+    """
+    keys = {}
+    widest = max(p.width for profiles in SHAPE_PROFILES for p in profiles)
+    column_bits = []
+    tops = []
+    cells = []
+    for profiles in SHAPE_PROFILES:
+        for profile in profiles:
+            keys[id(profile)] = len(keys)
+            padding = widest - profile.width
+            column_bits.append(list(profile.column_bits) + [0] * padding)
+            # Padding columns never raise a column
+            tops.append(list(profile.top) + [-(1 << 30)] * padding)
+            cells.append(sum(profile.row_cells))
+    return (
+        keys,
+        np.array(column_bits, dtype=np.int64),
+        np.array(tops, dtype=np.int64),
+        np.array(cells, dtype=np.int64),
+    )
+
+
+PROFILE_NUMBERS, PROFILE_COLUMN_BITS, PROFILE_TOP, PROFILE_CELLS = _profile_tables()
+PROFILE_WIDTH = PROFILE_COLUMN_BITS.shape[1]
+PROFILE_COLUMNS = np.arange(PROFILE_WIDTH)
+PROFILE_HEIGHT = int(PROFILE_TOP.max())
+
+
+def pack_placements(placements: list[Placement]) -> np.ndarray:
+    """(n, 4) array of the profile number, lines, base row and x of placements."""
+    numbers = PROFILE_NUMBERS
+    return np.array(
+        [(numbers[id(p.profile)], p.lines, p.base, p.x) for p in placements],
+        np.int64,
+    ).reshape(-1, 4)
+
+
+def bit_length(masks: np.ndarray) -> np.ndarray:
+    """Vectorized `int.bit_length`, exact for masks below 2**53."""
+    return np.frexp(masks.astype(np.float64))[1]
+
+
+def resulting_masks(board: BoardState, packed: np.ndarray) -> np.ndarray:
+    """
+    Boards after each (packed) placement, stacked as an (n, width) array of
+    column masks (bit y = row y). As in `resulting_board`, the full rows are
+    cleared, including those that were already full, only from the boards of
+    the placements that complete rows.
+    """
+    # Only the stack matters, not the board height: tall boards are fine as
+    # long as the stack is low
+    if max(board.heights) + PROFILE_HEIGHT > MAX_MASK_BITS:
+        raise ValueError("The stack is too high for float64 masks")
+    ids, lines, bases, xs = packed.T
+    columns = xs[:, None] + PROFILE_COLUMNS
+    # Spare columns on the right take the padding of the narrow shapes
+    masks = np.zeros((len(packed), board.width + PROFILE_WIDTH - 1), dtype=np.int64)
+    masks[np.arange(len(packed))[:, None], columns] = (
+        PROFILE_COLUMN_BITS[ids] << bases[:, None]
+    )
+    masks = masks[:, : board.width] | np.array(board.column_masks, dtype=np.int64)
+
+    full_rows = np.where(lines > 0, np.bitwise_and.reduce(masks, axis=1), 0)
+    while full_rows.any():
+        # Remove the highest full row of every board, shifting the rows above down
+        # (boards without one get a row above their stack, which is a no-op)
+        y = np.where(full_rows > 0, bit_length(full_rows) - 1, 62)
+        full_rows &= (np.int64(1) << y) - 1
+        y = y[:, None]
+        masks = (masks & ((np.int64(1) << y) - 1)) | ((masks >> (y + 1)) << y)
+    return masks
+
+
+def resulting_heights(board: BoardState, packed: np.ndarray) -> np.ndarray:
+    """
+    Column heights after each (packed) placement as an (n, width) array.
+    Only valid when no placement completes a row: the columns under the piece
+    then simply rise to its top.
+    """
+    ids, lines, bases, xs = packed.T
+    columns = xs[:, None] + PROFILE_COLUMNS
+    heights = np.empty((len(packed), board.width + PROFILE_WIDTH - 1), np.int64)
+    heights[:] = board.heights + [0] * (PROFILE_WIDTH - 1)
+    rows = np.arange(len(packed))[:, None]
+    heights[rows, columns] = np.maximum(
+        heights[rows, columns], PROFILE_TOP[ids] + bases[:, None]
+    )
+    return heights[:, : board.width]
+
+
+@dataclass
+class BatchEvaluator:
+    """
+    Vectorized equivalent of `HeuristicEvaluator`, with the same weights.
+
+    All the placements are scored in one pass over stacked arrays: the column
+    heights after each placement when none of them completes a row, otherwise
+    the full boards as column masks, cleared of their full rows by the
+    placements that complete one. The masks
+    only hold stacks of up to `MAX_MASK_BITS` rows: above, the placements that
+    complete rows are scored by `HeuristicEvaluator`, one by one.
+    """
+
+    weights: HeuristicWeights = field(default_factory=HeuristicWeights)
+
+    def _features(
+        self, board: BoardState, placements: list[Placement]
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        packed = pack_placements(placements)
+        if KERNELS is not None and KERNELS.usable(board):
+            # Same features from the compiled kernel, one placement at a time
+            return tuple(KERNELS.features(board, packed).T)
+        ids, lines = packed[:, 0], packed[:, 1]
+        if lines.any() and max(board.heights) + PROFILE_HEIGHT > MAX_MASK_BITS:
+            scalar = HeuristicEvaluator(self.weights)
+            features = [scalar.features(board, p) for p in placements]
+            return tuple(np.array(features, np.int64).reshape(-1, 4).T)
+        if lines.any():
+            heights = bit_length(resulting_masks(board, packed))
+            # The rows already full are cleared with the completed ones
+            full_rows = board.row_counts.count(board.width)
+            cleared = np.where(lines > 0, lines + full_rows, 0)
+            cells = sum(board.row_counts) + PROFILE_CELLS[ids] - board.width * cleared
+        else:
+            heights = resulting_heights(board, packed)
+            cells = sum(board.row_counts) + PROFILE_CELLS[ids]
+        aggregate_height = heights.sum(axis=1)
+        # Every cell below the top of its column is either filled or a hole
+        holes = aggregate_height - cells
+        bumpiness = np.abs(heights[:, 1:] - heights[:, :-1]).sum(axis=1)
+        return aggregate_height, holes, bumpiness, lines
+
+    def features(self, board: BoardState, placements: list[Placement]) -> np.ndarray:
+        """
+        (n, 4) array of (aggregate height, holes, bumpiness, completed lines)
+        after each placement.
+        """
+        return np.stack(self._features(board, placements), axis=1)
+
+    def evaluate_all(
+        self, board: BoardState, placements: list[Placement]
+    ) -> list[float]:
+        if not placements:
+            return []
+        aggregate_height, holes, bumpiness, lines = self._features(board, placements)
+        w = self.weights
+        # Same operation order as the scalar evaluator, for identical scores
+        scores = (
+            w.aggregate_height * aggregate_height
+            + w.holes * holes
+            + w.bumpiness * bumpiness
+            + w.lines * lines
+        )
+        return scores.tolist()
+
+    def evaluate(self, board: BoardState, placement: Placement) -> float:
+        return self.evaluate_all(board, [placement])[0]
+
+
+def benchmark(repeats: int = 20, seed: int = 0) -> dict:
+    """
+    Time one decision (placements of the current and the helper piece) with
+    the scalar and the batched evaluators, on boards from a seeded game. The
+    evaluators take turns, and the fastest of the repeats is kept, to filter
+    out the noise of other processes.
+    """
+    engine = LazyBlocksEngine(seed=seed)
+    player = AutoPlayer(use_helper=True)
+    positions = []
+    while len(positions) < 100 and not engine.game_over:
+        board = BoardState.from_engine(engine)
+        placements = enumerate_placements(board, engine.current_shape_idx)
+        placements += enumerate_placements(board, engine.helper_piece_idx)
+        positions.append((board, placements))
+        player.play_piece(engine)
+
+    evaluators = {"scalar": HeuristicEvaluator(), "batch": BatchEvaluator()}
+    results = dict.fromkeys(evaluators, float("inf"))
+    for _ in range(repeats):
+        for name, evaluator in evaluators.items():
+            start = time.perf_counter()
+            for board, placements in positions:
+                evaluator.evaluate_all(board, placements)
+            elapsed = (time.perf_counter() - start) / len(positions)
+            results[name] = min(results[name], elapsed)
+    results["speedup"] = results["scalar"] / results["batch"]
+    results["placements_per_decision"] = sum(len(p) for _, p in positions) / len(
+        positions
+    )
+    return results
+
+
+if __name__ == "__main__":
+    results = benchmark()
+    print(f"Placements per decision: {results['placements_per_decision']:.1f}")
+    print(f"Scalar evaluator: {results['scalar'] * 1e6:8.1f} us per decision")
+    print(f"Batch evaluator:  {results['batch'] * 1e6:8.1f} us per decision")
+    print(f"Speedup: {results['speedup']:.2f}x")
@@ -0,0 +1,586 @@
+"""
+Benchmark suite: the engine primitives, full-game replays of a corpus of seeded
+games, the lookahead search with each eviction mode of its transposition table,
+the frame times of every render backend, the score history, and the cold
+starts. The results are JSON, and can be compared against a stored
+baseline to see any speed-up or slowdown as numbers.
+
+Usage:
+    lazyblocks-bench                                  # run all, print a table
+    lazyblocks-bench --only engine replay --output bench.json
+    lazyblocks-bench --compare benchmarks/baseline.json --threshold 0.25
+    lazyblocks-bench --save-baseline                  # after a deliberate change
+    lazyblocks-bench --record-corpus                  # after a rules change
+
+The replays also check that every corpus game still ends with the recorded
+score, piece count and board: a replay that diverges fails the comparison
+whatever its time. Timings depend on the machine, so a baseline is only
+meaningful on the machine that saved it (see its "meta").
+"""
+
+import argparse
+import gc
+import importlib
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from LazyBlocks_ai import KERNELS, AutoPlayer, BoardState, enumerate_placements
+from LazyBlocks_batch import BatchEvaluator
+from LazyBlocks_engine import LazyBlocksEngine
+from LazyBlocks_raster import FrameRenderer
+from LazyBlocks_scores import load_leaderboard, merge_shards, store_score
+from LazyBlocks_search import LookaheadPlanner, TranspositionTable
+from LazyBlocks_sim import SimulationConfig, make_policy, new_game
+from LazyBlocks_snapshot import Snapshot, decode_snapshot, encode_snapshot
+
+BENCH_DIR = Path(__file__).with_name("benchmarks")
+CORPUS_FILE = BENCH_DIR / "corpus.json"
+BASELINE_FILE = BENCH_DIR / "baseline.json"
+
+GROUPS = ["engine", "replay", "kernels", "search", "render", "scores", "startup"]
+SCORE_HISTORY_ROWS = [10_000, 1_000_000]
+FULL_SCORE_HISTORY_ROWS = [*SCORE_HISTORY_ROWS, 10_000_000]
+SPECTATOR_BOARDS = 16
+SEARCH_PIECES = 8  # Lookahead decisions of a search benchmark game
+SEARCH_TABLE_SIZE = 2_000  # Small enough for the evictions to matter
+STARTUP_RUNS = 5
+
+# Cold starts, each in a fresh interpreter: Python itself, then the imports
+# and the first piece of work of each entry point
+STARTUP_SCRIPTS = {
+    "python": "pass",
+    "engine": "import LazyBlocks_engine as m; m.LazyBlocksEngine(seed=0)",
+    "sim": (
+        "import LazyBlocks_sim as m;" " m.run_game(0, m.SimulationConfig(max_pieces=1))"
+    ),
+    "raster": (
+        "import LazyBlocks_engine as e, LazyBlocks_raster as m;"
+        " m.FrameRenderer().render(e.LazyBlocksEngine(seed=0))"
+    ),
+    "arcade": "import LazyBlocks",
+    "pyglet": "import LazyBlocks_pyglet",
+}
+
+# Render backends drawing through OpenGL: module and view class
+GAME_VIEWS = {"arcade": "LazyBlocks", "pyglet": "LazyBlocks_pyglet"}
+
+
+def summarize(samples: list[float], unit: str) -> dict:
+    """Median, 90th percentile and count of the samples."""
+    samples = sorted(samples)
+    return {
+        "median": statistics.median(samples),
+        "p90": samples[min(len(samples) - 1, int(len(samples) * 0.9))],
+        "n": len(samples),
+        "unit": unit,
+    }
+
+
+def measure(
+    op: Callable,
+    setup: Optional[Callable] = None,
+    inner: int = 1,
+    min_repeat: int = 5,
+    max_repeat: int = 10_000,
+    min_time: float = 0.2,
+    unit: str = "us",
+) -> dict:
+    """
+    Time `op(setup())` until it ran `min_repeat` times and for `min_time`
+    seconds. `setup` is not timed; `inner` is the number of operations one call
+    of `op` does, to report the time of one.
+    """
+    scale = {"us": 1e6, "ms": 1e3, "s": 1.0}[unit] / inner
+    samples = []
+    spent = 0.0
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while len(samples) < max_repeat and (
+            len(samples) < min_repeat or spent < min_time
+        ):
+            state = setup() if setup is not None else None
+            start = time.perf_counter()
+            op(state)
+            elapsed = time.perf_counter() - start
+            spent += elapsed
+            samples.append(elapsed * scale)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return summarize(samples, unit)
+
+
+def skipped(error: BaseException) -> dict:
+    return {"skipped": f"{type(error).__name__}: {error}"}
+
+
+# Positions
+
+
+def midgame(seed: int = 0, pieces: int = 60) -> Snapshot:
+    """A greedy game after `pieces` pieces: a typical, half filled board."""
+    engine = LazyBlocksEngine(seed=seed)
+    player = AutoPlayer()
+    for _ in range(pieces):
+        player.play_piece(engine)
+    return decode_snapshot(encode_snapshot(engine))
+
+
+def full_rows_position(seed: int = 0, full_rows: int = 4) -> Snapshot:
+    """A greedy game where nobody cleared the rows: `full_rows` to clear."""
+    engine = LazyBlocksEngine(seed=seed)
+    player = AutoPlayer()
+    while len(engine.board_features.full_rows) < full_rows:
+        choice = player.choose(engine)
+        assert choice is not None and not engine.game_over
+        _, placement = choice
+        engine.current_shape = [list(row) for row in placement.profile.shape]
+        engine.current_position = placement.position
+        engine.place_piece_on_grid()
+        engine.spawn_new_shape()
+    return decode_snapshot(encode_snapshot(engine))
+
+
+# Groups
+
+
+def bench_engine() -> dict:
+    position = midgame()
+    engine = position.to_engine()
+    shape = engine.current_shape
+    positions = [
+        (x, y) for y in range(engine.grid_height) for x in range(-1, engine.grid_width)
+    ]
+
+    def can_be_placed(_):
+        for p in positions:
+            engine.can_be_placed(shape, p)
+
+    def rotate(_):
+        for _ in range(100):
+            engine.rotate_current_shape()
+
+    def placed() -> LazyBlocksEngine:
+        played = position.to_engine()
+        played.place_piece_on_grid()
+        played.spawn_new_shape()
+        return played
+
+    with_full_rows = full_rows_position()
+    return {
+        "engine.can_be_placed": measure(can_be_placed, inner=len(positions)),
+        "engine.rotate": measure(rotate, inner=100),
+        "engine.hard_drop": measure(
+            lambda e: e.place_piece_on_grid(), position.to_engine
+        ),
+        "engine.clear_full_rows": measure(
+            lambda e: e.clear_full_rows(), with_full_rows.to_engine
+        ),
+        "engine.undo_prev_move": measure(lambda e: e.undo_prev_move(), placed),
+    }
+
+
+def load_corpus() -> list[dict]:
+    with open(CORPUS_FILE) as corpus:
+        return json.load(corpus)["games"]
+
+
+def replay(game: dict) -> dict:
+    """Play a corpus game. Return how it ended."""
+    config = SimulationConfig(
+        policy=game["policy"],
+        max_pieces=game["max_pieces"],
+        helper_piece_probability=game.get("helper_piece_probability", 1.0),
+        grid_width=game["grid_width"],
+        grid_height=game["grid_height"],
+    )
+    engine = new_game(game["seed"], config)
+    policy = make_policy(config.policy, game["seed"], config.lookahead_depth)
+    pieces = 0
+    while not engine.game_over and pieces < config.max_pieces:
+        policy.play_piece(engine)
+        pieces += 1
+    return {"score": engine.score, "pieces": pieces, "grid_hash": engine.grid_hash}
+
+
+def bench_replay() -> dict:
+    results = {}
+    for game in load_corpus():
+        outcome = {}
+
+        def play(_):
+            outcome.update(replay(game))
+
+        result = measure(play, min_repeat=3, min_time=0.5, unit="ms")
+        result["ok"] = outcome == game["expected"]
+        if not result["ok"]:
+            result["expected"] = game["expected"]
+            result["got"] = outcome
+        results[f"replay.{game['name']}"] = result
+    return results
+
+
+def bench_kernels() -> dict:
+    """
+    The placement search of a greedy decision, and the batched evaluator, with
+    the compiled kernels and with the Python or NumPy code they replace.
+    """
+    if KERNELS is None:
+        return {
+            "kernels": skipped(
+                ImportError("Numba is not installed, or LAZYBLOCKS_JIT=0")
+            )
+        }
+    engines = [midgame(seed, pieces=seed * 5).to_engine() for seed in range(20)]
+    player = AutoPlayer(use_helper=True)
+    batch = BatchEvaluator()
+    boards = []
+    for engine in engines:
+        board = BoardState.from_engine(engine)
+        placements = enumerate_placements(board, engine.current_shape_idx)
+        placements += enumerate_placements(board, engine.helper_piece_idx)
+        boards.append((board, placements))
+
+    def decide(_):
+        for engine in engines:
+            player.choose(engine)
+
+    def evaluate(_):
+        for board, placements in boards:
+            batch.evaluate_all(board, placements)
+
+    results = {}
+    try:
+        for enabled, python_name in [(False, "python"), (True, "jit")]:
+            KERNELS.enabled = enabled
+            decide(None)  # Compile, or load the compiled code, before timing
+            results[f"kernels.greedy_decision.{python_name}"] = measure(
+                decide, inner=len(engines)
+            )
+            name = "numpy" if python_name == "python" else python_name
+            results[f"kernels.batch_evaluate.{name}"] = measure(
+                evaluate, inner=len(boards)
+            )
+    finally:
+        KERNELS.enabled = True
+    return results
+
+
+def bench_search() -> dict:
+    """
+    A game of depth 3 lookahead decisions, with a transposition table that
+    evicts in least-recently-used order, then the shallowest entries first. The
+    decisions are the same; the time and the table stats are not.
+    """
+    results = {}
+    for depth_preferred, name in [(False, "lru"), (True, "depth_preferred")]:
+        tables = []
+
+        def setup():
+            table = TranspositionTable(SEARCH_TABLE_SIZE, depth_preferred)
+            tables.append(table)
+            planner = LookaheadPlanner(max_depth=3, time_budget=math.inf, table=table)
+            return planner, LazyBlocksEngine(seed=0)
+
+        def play(state):
+            planner, engine = state
+            for _ in range(SEARCH_PIECES):
+                planner.play_piece(engine)
+
+        result = measure(play, setup, inner=SEARCH_PIECES, min_repeat=3, unit="ms")
+        result["table"] = tables[-1].stats()
+        results[f"search.lookahead.{name}"] = result
+    return results
+
+
+def bench_render() -> dict:
+    position = midgame()
+    renderer = FrameRenderer()
+    engine = position.to_engine()
+    results = {"render.raster": measure(lambda _: renderer.render(engine), unit="ms")}
+
+    # The OpenGL backends, off screen if there is no display
+    if "DISPLAY" not in os.environ:
+        os.environ.setdefault("ARCADE_HEADLESS", "1")
+    try:
+        import arcade
+
+        window = arcade.Window(800, 800, "LazyBlocks bench", visible=False)
+    except Exception as error:
+        for name in ["spectator", *GAME_VIEWS]:
+            results[f"render.{name}"] = skipped(error)
+        return results
+
+    def frame_time(view) -> dict:
+        window.show_view(view)
+
+        def draw(_):
+            view.on_draw()
+            window.ctx.finish()
+
+        draw(None)  # Upload the textures and buffers
+        return measure(draw, unit="ms")
+
+    try:
+        from LazyBlocks_spectator import SpectatorView
+
+        engines = [position.to_engine() for _ in range(SPECTATOR_BOARDS)]
+        results["render.spectator"] = frame_time(SpectatorView(engines))
+    except Exception as error:
+        results["render.spectator"] = skipped(error)
+
+    for name, module_name in GAME_VIEWS.items():
+        try:
+            view = importlib.import_module(module_name).LazyBlocks()
+            view.setup()
+            position.restore(view)
+            results[f"render.{name}"] = frame_time(view)
+        except Exception as error:
+            results[f"render.{name}"] = skipped(error)
+    window.close()
+    return results
+
+
+def write_score_history(path: str, rows: int, seed: int = 0):
+    """A scores file of `rows` past games."""
+    rng = np.random.default_rng(seed)
+    pd.DataFrame(
+        {
+            "date": "2024-01-01 00:00:00",
+            "player": "Player",
+            "gameid": np.char.mod("%032x", np.arange(rows)),
+            "score": rng.integers(0, 500, rows),
+        }
+    ).to_csv(path, index=False)
+
+
+def bench_scores(sizes: list[int]) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            path = os.path.join(directory, f"scores_{rows}.csv")
+            write_score_history(path, rows)
+            min_repeat = 5 if rows <= 100_000 else 1
+            results[f"scores.store.{rows}"] = measure(
+                lambda _: store_score("bench", 42, scores_file=path),
+                min_repeat=min_repeat,
+                min_time=0.5,
+                unit="ms",
+            )
+            results[f"scores.leaderboard.{rows}"] = measure(
+                lambda _: load_leaderboard(path),
+                min_repeat=min_repeat,
+                min_time=0.5,
+                unit="ms",
+            )
+            output = os.path.join(directory, f"merged_{rows}")
+            results[f"scores.merge.{rows}"] = measure(
+                lambda _: merge_shards([path], output, rebuild=True),
+                min_repeat=min_repeat,
+                min_time=0.5,
+                unit="ms",
+            )
+            # Another game stored since the last merge
+            results[f"scores.merge_update.{rows}"] = measure(
+                lambda _: merge_shards([path], output),
+                lambda: store_score("bench", 42, scores_file=path),
+                min_repeat=min_repeat,
+                min_time=0.5,
+                unit="ms",
+            )
+            os.remove(path)
+    return results
+
+
+def bench_startup() -> dict:
+    results = {}
+    for name, script in STARTUP_SCRIPTS.items():
+        samples = []
+        for _ in range(STARTUP_RUNS):
+            start = time.perf_counter()
+            process = subprocess.run(
+                [sys.executable, "-c", script],
+                cwd=Path(__file__).parent,
+                capture_output=True,
+                text=True,
+            )
+            samples.append((time.perf_counter() - start) * 1e3)
+            if process.returncode:
+                lines = process.stderr.strip().splitlines() or ["failed"]
+                results[f"startup.{name}"] = {"skipped": lines[-1]}
+                break
+        else:
+            results[f"startup.{name}"] = summarize(samples, "ms")
+    return results
+
+
+# Results
+
+
+def machine() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run(groups: list[str], full: bool = False) -> dict:
+    benches = {
+        "engine": bench_engine,
+        "replay": bench_replay,
+        "kernels": bench_kernels,
+        "search": bench_search,
+        "render": bench_render,
+        "scores": lambda: bench_scores(
+            FULL_SCORE_HISTORY_ROWS if full else SCORE_HISTORY_ROWS
+        ),
+        "startup": bench_startup,
+    }
+    results = {}
+    for group in groups:
+        print(f"Running {group} benchmarks...", file=sys.stderr)
+        results.update(benches[group]())
+    return {"meta": machine(), "results": results}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Print the change of every median against the baseline. Return the
+    failures: slowdowns beyond `threshold` and diverging replays.
+    """
+    failures = []
+    print(f"{'benchmark':<32} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, result in results["results"].items():
+        base = baseline["results"].get(name, {})
+        if result.get("ok") is False:
+            failures.append(f"{name}: the replay diverged from the corpus")
+        if "median" not in result or "median" not in base:
+            status = result.get("skipped", "no baseline")
+            print(f"{name:<32} {'':>12} {'':>12} {'':>8}  {status}")
+            continue
+        change = result["median"] / base["median"] - 1 if base["median"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  slower"
+            failures.append(f"{name}: {change:+.0%}")
+        elif change < -threshold:
+            flag = "  faster"
+        unit = result["unit"]
+        print(
+            f"{name:<32} {base['median']:>9.3f} {unit:<2} {result['median']:>9.3f}"
+            f" {unit:<2} {change:>+8.0%}{flag}"
+        )
+    return failures
+
+
+def print_results(results: dict):
+    print(f"{'benchmark':<32} {'median':>12} {'p90':>12} {'n':>6}")
+    for name, result in results["results"].items():
+        if "median" not in result:
+            print(f"{name:<32} skipped: {result['skipped']}")
+            continue
+        unit = result["unit"]
+        notes = "" if result.get("ok", True) else "  DIVERGED"
+        table = result.get("table")
+        if table is not None:
+            notes += (
+                f"  table hit rate {table['hit_rate']:.1%},"
+                f" {table['evictions']} evictions"
+            )
+        print(
+            f"{name:<32} {result['median']:>9.3f} {unit:<2} {result['p90']:>9.3f}"
+            f" {unit:<2} {result['n']:>6}{notes}"
+        )
+
+
+def record_corpus():
+    """Store the current outcome of every corpus game as its expected one."""
+    with open(CORPUS_FILE) as corpus_file:
+        corpus = json.load(corpus_file)
+    for game in corpus["games"]:
+        game["expected"] = replay(game)
+    with open(CORPUS_FILE, "w") as corpus_file:
+        json.dump(corpus, corpus_file, indent=2)
+        corpus_file.write("\n")
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="lazyblocks-bench", description="Run the LazyBlocks benchmarks."
+    )
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=GROUPS)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Also time the scores with a 10M games history (slow)",
+    )
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--compare", metavar="BASELINE", help="Baseline JSON file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Slowdown of a median that fails the comparison (default: 25%%)",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help=f"Store the results as the baseline ({BASELINE_FILE.name})",
+    )
+    parser.add_argument(
+        "--record-corpus",
+        action="store_true",
+        help="Store the current outcome of the corpus games as the expected one",
+    )
+    args = parser.parse_args(argv)
+
+    if args.record_corpus:
+        record_corpus()
+        return
+
+    results = run(args.only, full=args.full)
+    for path in filter(None, [args.output, args.save_baseline and BASELINE_FILE]):
+        with open(path, "w") as output:
+            json.dump(results, output, indent=2)
+            output.write("\n")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        failures = compare(results, baseline, args.threshold)
+        for failure in failures:
+            print(f"FAILED {failure}", file=sys.stderr)
+        sys.exit(1 if failures else 0)
+    print_results(results)
+    if any(result.get("ok") is False for result in results["results"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
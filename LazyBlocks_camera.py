@@ -0,0 +1,64 @@
+"""Viewport of the front-ends over boards larger than the play area."""
+
+from typing import Optional
+
+from LazyBlocks_engine import GRID_SIZE, PLAY_HEIGHT, PLAY_WIDTH
+
+# Rows kept visible above and below the current piece when scrolling, if they
+# fit with the top of the stack
+FOLLOW_MARGIN = 4
+
+
+class BoardCamera:
+    """
+    Which rows of the board are on screen, and at what cell size.
+
+    Cells shrink so that the board width fits the play area, and the visible
+    rows scroll to follow the current piece and the top of the stack under it,
+    so that a frame only draws the rows on screen, whatever the height of the
+    board. The default board fits the play area exactly and never scrolls.
+    """
+
+    def __init__(
+        self,
+        board_width: int,
+        board_height: int,
+        view_width: int = PLAY_WIDTH,
+        view_height: int = PLAY_HEIGHT,
+    ):
+        self.board_height = board_height
+        self.cell_size = max(1, min(GRID_SIZE, view_width // board_width))
+        self.visible_rows = min(board_height, view_height // self.cell_size)
+        self.bottom = 0  # Board row at the bottom of the view
+
+    @property
+    def rows(self) -> range:
+        """Board rows on screen, bottom first."""
+        return range(self.bottom, self.bottom + self.visible_rows)
+
+    def follow(self, low: int, high: int, stack_height: Optional[int] = None):
+        """
+        Scroll the least needed to show the rows `low` to `high`, with a margin,
+        and the top row of a stack of `stack_height` rows (the bottom row if it
+        is empty) below them. If they do not all fit, the top of the stack and
+        the rows above it are shown.
+        """
+        if stack_height is not None:
+            stack_top = max(stack_height - 1, 0)
+            if low > stack_top:
+                low = stack_top
+                high = min(high, stack_top + self.visible_rows - 1)
+        margin = min(FOLLOW_MARGIN, (self.visible_rows - (high - low + 1)) // 2)
+        margin = max(margin, 0)
+        if high + margin >= self.bottom + self.visible_rows:
+            self.bottom = high + margin - self.visible_rows + 1
+        if low - margin < self.bottom:
+            self.bottom = low - margin
+        self.bottom = max(0, min(self.bottom, self.board_height - self.visible_rows))
+
+    def to_screen(self, grid_x: int, grid_y: int) -> tuple[int, int]:
+        """Screen position of the bottom-left corner of a cell."""
+        return grid_x * self.cell_size, (grid_y - self.bottom) * self.cell_size
+
+    def is_visible(self, grid_y: int) -> bool:
+        return self.bottom <= grid_y < self.bottom + self.visible_rows
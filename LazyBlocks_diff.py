@@ -0,0 +1,411 @@
+"""
+Differential testing of engine variants against the reference engine.
+
+Both engines play the same seeded games with the same seeded random stream of
+actions (the keyboard actions of `LazyBlocks_feed`), across all cores, and
+their whole state is compared after every step: the cells and piece numbers of
+the grid, the score, the pieces, the piece queue (the state of the random
+generator), the position, and the undo data. The first divergence of a game is
+shrunk to a minimal list of actions (delta debugging), and written as a
+reproducer that `--replay` plays again step by step.
+
+Usage:
+    lazyblocks-diff --candidate snapshot --games 10000 --steps 500
+    lazyblocks-diff --replay divergence.json
+
+A candidate is a class in `CANDIDATES` with an `engine` attribute and a `step`
+method. Games cycle through several board sizes and rule variants, so that
+narrow boards exercise the row clears and limited undos the undo rules.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import asdict
+from typing import Optional
+
+from LazyBlocks_engine import (
+    EMPTY_SHAPE_CNT,
+    GRID_HEIGHT,
+    GRID_WIDTH,
+    LazyBlocksEngine,
+    RuleSet,
+)
+from LazyBlocks_feed import (
+    CLEAR_ROWS,
+    DROP,
+    MOVE_DOWN,
+    MOVE_LEFT,
+    MOVE_RIGHT,
+    ROTATE,
+    SWAP,
+    UNDO,
+    apply_action,
+)
+from LazyBlocks_snapshot import (
+    JOURNAL_MAGIC,
+    SnapshotEncoder,
+    decode_snapshot,
+    encode_snapshot,
+)
+
+# Relative frequency of the actions in the random streams
+ACTION_WEIGHTS = {
+    MOVE_LEFT: 6,
+    MOVE_RIGHT: 6,
+    MOVE_DOWN: 4,
+    ROTATE: 5,
+    DROP: 4,
+    SWAP: 1,
+    CLEAR_ROWS: 2,
+    UNDO: 1,
+}
+ACTION_NAMES = {
+    MOVE_LEFT: "move_left",
+    MOVE_RIGHT: "move_right",
+    MOVE_DOWN: "move_down",
+    ROTATE: "rotate",
+    DROP: "drop",
+    SWAP: "swap",
+    CLEAR_ROWS: "clear_rows",
+    UNDO: "undo",
+}
+ACTIONS_BY_NAME = {name: action for action, name in ACTION_NAMES.items()}
+
+# Rule variants of the games, picked per seed
+BOARD_SIZES = [(GRID_WIDTH, GRID_HEIGHT), (6, 14), (4, 10), (12, 40)]
+HELPER_PROBABILITIES = [1.0, 0.5]
+MAX_UNDOS = [None, 3]
+
+QUEUE_DEPTH = 4  # Pieces of the queue shown when the generators diverge
+
+
+class ReferenceGame:
+    """A game of the reference engine, played action by action."""
+
+    def __init__(self, seed: int, rules: RuleSet):
+        self.engine = LazyBlocksEngine(seed=seed, rules=rules)
+
+    def step(self, action: int):
+        apply_action(self.engine, action)
+
+
+class SnapshotGame(ReferenceGame):
+    """Saved to a snapshot and restored from it after every action."""
+
+    def step(self, action: int):
+        super().step(action)
+        self.engine = decode_snapshot(encode_snapshot(self.engine)).to_engine()
+
+
+class JournalGame(ReferenceGame):
+    """
+    Restored after every action from an autosave journal of delta records,
+    started again with a full record every `max_deltas` records like the
+    autosave file.
+    """
+
+    def __init__(self, seed: int, rules: RuleSet, max_deltas: int = 64):
+        super().__init__(seed, rules)
+        self.max_deltas = max_deltas
+        self.encoder = SnapshotEncoder()
+        self.journal = b""
+        self.deltas = max_deltas  # Start with a full record
+
+    def step(self, action: int):
+        super().step(action)
+        if self.deltas >= self.max_deltas:
+            record = self.encoder.encode(self.engine)
+            self.journal = JOURNAL_MAGIC
+            self.deltas = 0
+        else:
+            record = self.encoder.encode(self.engine, delta=True)
+            self.deltas += 1
+        if record is not None:
+            self.journal += len(record).to_bytes(4, "little") + record
+        self.engine = decode_snapshot(self.journal).to_engine()
+
+
+CANDIDATES = {
+    "reference": ReferenceGame,  # Checks the harness itself
+    "snapshot": SnapshotGame,
+    "journal": JournalGame,
+}
+
+
+def game_rules(seed: int) -> RuleSet:
+    """Rules of the game of a seed."""
+    rng = random.Random(f"rules-{seed}")
+    width, height = rng.choice(BOARD_SIZES)
+    return RuleSet(
+        helper_piece_probability=rng.choice(HELPER_PROBABILITIES),
+        max_undos=rng.choice(MAX_UNDOS),
+        grid_width=width,
+        grid_height=height,
+    )
+
+
+def action_stream(seed: int, steps: int) -> list[int]:
+    """Random actions of the game of a seed."""
+    rng = random.Random(f"actions-{seed}")
+    return rng.choices(list(ACTION_WEIGHTS), list(ACTION_WEIGHTS.values()), k=steps)
+
+
+def observe(engine: LazyBlocksEngine) -> dict:
+    """Everything that two equivalent engines must agree on."""
+    size = engine.grid_width * engine.grid_height
+    pieces = engine.grid.pieces
+    helper = engine.helper_piece_shape
+    return {
+        "grid": engine.grid.cells(0, engine.grid_height),
+        "pieces": tuple(pieces) + (EMPTY_SHAPE_CNT,) * (size - len(pieces)),
+        "grid_hash": engine.grid_hash,
+        "score": engine.score,
+        "game_over": engine.game_over,
+        "current": (
+            engine.current_shape_idx,
+            tuple(map(tuple, engine.current_shape)),
+            tuple(engine.current_position),
+        ),
+        "helper": (
+            engine.helper_piece_idx,
+            None if helper is None else tuple(map(tuple, helper)),
+        ),
+        "next": engine.next_shape_idx,
+        "rng": engine.rng.getstate(),  # The queue of pieces to come
+        "shapes_cnt": engine.shapes_cnt,
+        "placed_rows": tuple(engine.placed_rows),
+        "cleared_rows": engine.cleared_rows,
+        "undo_count": engine.undo_count,
+        "can_undo": engine.can_undo(),
+        "swap_count": engine.swap_count,
+    }
+
+
+def differences(reference: dict, candidate: dict) -> list[str]:
+    return [key for key in reference if reference[key] != candidate[key]]
+
+
+def play(
+    candidate: str, seed: int, rules: RuleSet, actions: list[int]
+) -> tuple[int, Optional[dict]]:
+    """
+    Play the actions on both engines, until the game is over. Return the
+    number of actions played, and the first divergence or None if the engines
+    agreed all along.
+    """
+    try:
+        reference = ReferenceGame(seed, rules)
+        other = CANDIDATES[candidate](seed, rules)
+    except Exception as error:
+        return 0, {"step": 0, "fields": ["exception"], "error": repr(error)}
+    for step in range(len(actions) + 1):
+        if step:
+            action = actions[step - 1]
+            if reference.engine.game_over:
+                return step - 1, None  # Nothing changes anymore
+            try:
+                reference.step(action)
+            except Exception as error:
+                return step, {
+                    "step": step,
+                    "fields": ["exception"],
+                    "error": repr(error),
+                }
+            try:
+                other.step(action)
+            except Exception as error:
+                return step, {
+                    "step": step,
+                    "fields": ["exception"],
+                    "error": f"Candidate: {error!r}",
+                }
+        expected = observe(reference.engine)
+        got = observe(other.engine)
+        fields = differences(expected, got)
+        if fields:
+            divergence = {
+                "step": step,
+                "fields": fields,
+                "reference": {key: repr(expected[key]) for key in fields},
+                "candidate": {key: repr(got[key]) for key in fields},
+            }
+            if "rng" in fields:
+                for side, game in [("reference", reference), ("candidate", other)]:
+                    queue = game.engine.preview_pieces(QUEUE_DEPTH)
+                    divergence[side]["queue"] = repr(queue)
+            return step, divergence
+    return len(actions), None
+
+
+def check_games(candidate: str, seeds: list[int], steps: int) -> tuple[int, list]:
+    """Worker task: play a batch of games. Return the steps played and divergences."""
+    played = 0
+    divergences = []
+    for seed in seeds:
+        actions = action_stream(seed, steps)
+        steps_played, divergence = play(candidate, seed, game_rules(seed), actions)
+        played += steps_played
+        if divergence is not None:
+            divergence["seed"] = seed
+            divergence["actions"] = actions[: divergence["step"]]
+            divergences.append(divergence)
+    return played, divergences
+
+
+def ddmin(actions: list[int], diverges) -> list[int]:
+    """
+    Smallest list of actions (1-minimal: no single chunk can be removed) that
+    still `diverges`, by delta debugging.
+    """
+    chunks = 2
+    while len(actions) >= 2:
+        size = -(-len(actions) // chunks)
+        for start in range(0, len(actions), size):
+            subset = actions[start : start + size]
+            complement = actions[:start] + actions[start + size :]
+            if diverges(subset):
+                actions, chunks = subset, 2
+                break
+            if diverges(complement):
+                actions, chunks = complement, max(chunks - 1, 2)
+                break
+        else:
+            if chunks >= len(actions):
+                break
+            chunks = min(len(actions), chunks * 2)
+    return actions
+
+
+def shrink(candidate: str, divergence: dict) -> dict:
+    """Minimal reproducer of a divergence."""
+    seed = divergence["seed"]
+    rules = game_rules(seed)
+    fields = set(divergence["fields"])
+
+    def diverges(actions: list[int]) -> bool:
+        _, found = play(candidate, seed, rules, actions)
+        return found is not None and bool(fields & set(found["fields"]))
+
+    actions = ddmin(list(divergence["actions"]), diverges)
+    found = play(candidate, seed, rules, actions)[1] or divergence
+    return {
+        "candidate": candidate,
+        "seed": seed,
+        "rules": asdict(rules),
+        "actions": [ACTION_NAMES[action] for action in actions],
+        "divergence": {
+            key: found[key] for key in found if key not in ("seed", "actions")
+        },
+    }
+
+
+def replay(reproducer: dict) -> Optional[dict]:
+    """Play a reproducer again, printing the actions, and return its divergence."""
+    actions = [ACTIONS_BY_NAME[name] for name in reproducer["actions"]]
+    rules = RuleSet(**reproducer["rules"])
+    for step in range(len(actions) + 1):
+        _, found = play(
+            reproducer["candidate"], reproducer["seed"], rules, actions[:step]
+        )
+        label = ACTION_NAMES[actions[step - 1]] if step else "start"
+        print(f"{step:>4} {label:<12} {'DIVERGED' if found else 'ok'}")
+        if found:
+            return found
+    return None
+
+
+def check(
+    candidate: str,
+    num_games: int,
+    steps: int,
+    base_seed: int = 0,
+    workers: Optional[int] = None,
+    batch_size: int = 16,
+):
+    """
+    Play `num_games` games on a process pool. Yield (steps played, divergences)
+    per batch, with only a few batches per worker in flight at any time.
+    """
+    workers = workers or os.cpu_count() or 1
+    seeds = iter(range(base_seed, base_seed + num_games))
+
+    def next_batch():
+        return [seed for _, seed in zip(range(batch_size), seeds)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        while True:
+            while len(pending) < workers * 4:
+                batch = next_batch()
+                if not batch:
+                    break
+                pending.add(executor.submit(check_games, candidate, batch, steps))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="lazyblocks-diff",
+        description="Check that an engine variant plays exactly like the reference.",
+    )
+    parser.add_argument("--candidate", choices=CANDIDATES, default="snapshot")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=500, help="Actions per game")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first game")
+    parser.add_argument("--workers", type=int, default=None, help="Default: all cores")
+    parser.add_argument(
+        "--output",
+        default="divergence.json",
+        help="Reproducer of the first divergence",
+    )
+    parser.add_argument("--replay", metavar="REPRODUCER", help="Play a reproducer")
+    args = parser.parse_args(argv)
+
+    if args.replay:
+        with open(args.replay) as reproducer_file:
+            found = replay(json.load(reproducer_file))
+        if found:
+            print(json.dumps(found, indent=2))
+        sys.exit(1 if found else 0)
+
+    start = time.perf_counter()
+    played = 0
+    divergences = []
+    for batch_steps, batch_divergences in check(
+        args.candidate, args.games, args.steps, args.seed, args.workers
+    ):
+        played += batch_steps
+        divergences += batch_divergences
+    elapsed = time.perf_counter() - start
+    print(
+        f"{args.games} games, {played} steps in {elapsed:.1f} s"
+        f" ({played / elapsed:.0f} steps/s), {len(divergences)} divergences",
+        file=sys.stderr,
+    )
+    if not divergences:
+        return
+
+    first = min(divergences, key=lambda divergence: divergence["seed"])
+    reproducer = shrink(args.candidate, first)
+    with open(args.output, "w") as output:
+        json.dump(reproducer, output, indent=2)
+    print(
+        f"Seed {first['seed']} diverged on {', '.join(first['fields'])} after"
+        f" {first['step']} actions; {len(reproducer['actions'])} actions"
+        f" reproduce it, see {args.output}",
+        file=sys.stderr,
+    )
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
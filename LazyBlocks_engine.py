@@ -0,0 +1,783 @@
+"""Headless LazyBlocks game rules, shared by the windowed front-ends and the bots."""
+
+import random
+from array import array
+from dataclasses import dataclass
+from typing import Iterator, Optional, Sequence
+
+PLAY_WIDTH = 300
+PLAY_HEIGHT = 600
+
+GRID_SIZE = 30
+GRID_WIDTH = PLAY_WIDTH // GRID_SIZE
+GRID_HEIGHT = PLAY_HEIGHT // GRID_SIZE
+SHAPES = [
+    [[1, 1, 1, 1]],  # I shape
+    [[1, 1], [1, 1]],  # O shape
+    [[0, 1, 0], [1, 1, 1]],  # T shape
+    [[0, 1, 1], [1, 1, 0]],  # S shape
+    [[1, 1, 0], [0, 1, 1]],  # Z shape
+    [[1, 0], [1, 0], [1, 1]],  # J shape
+    [[0, 1], [0, 1], [1, 1]],  # L shape
+]
+
+# The top row of a spawned piece is at most this many rows above the top row of
+# the stack (or of the bottom row of an empty board): on tall boards, the piece
+# and the top of the stack both fit on a screen of the default board height
+SPAWN_CLEARANCE = GRID_HEIGHT - 1
+
+# Zobrist keys per shape for the current, helper and next pieces. Seeded, so
+# hashes are stable between runs.
+_zobrist_rng = random.Random(0x1A2B1C0C)
+ZOBRIST_ROW_SEED = _zobrist_rng.getrandbits(64)
+ZOBRIST_CURRENT = [_zobrist_rng.getrandbits(64) for _ in SHAPES]
+ZOBRIST_HELPER = [_zobrist_rng.getrandbits(64) for _ in SHAPES]
+ZOBRIST_NEXT = [_zobrist_rng.getrandbits(64) for _ in SHAPES]
+
+_MASK_64 = (1 << 64) - 1
+
+
+def _mix64(z: int) -> int:
+    """splitmix64 finalizer: a 64-bit integer to a well-mixed 64-bit integer."""
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK_64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK_64
+    return z ^ (z >> 31)
+
+
+def row_hash(grid_y: int, row_mask: int) -> int:
+    """
+    Hash of the filled cells (bit x = column x) of row `grid_y`, 0 for an empty
+    row. Computed in O(1) from the mask, instead of a key per cell, so that
+    boards of any size need no key table and shifted rows rehash cheaply.
+    """
+    if not row_mask:
+        return 0
+    h = _mix64((ZOBRIST_ROW_SEED + grid_y * 0x9E3779B97F4A7C15) & _MASK_64)
+    while row_mask:
+        h = _mix64(h ^ (row_mask & _MASK_64))
+        row_mask >>= 64
+    return h
+
+
+# RGBA colors, same values as the arcade colors used by the front-ends
+EMPTY_CELL_COLOR = (128, 128, 128, 255)  # arcade.color.GRAY
+PIECE_COLORS = [
+    (255, 0, 0, 255),  # arcade.color.RED
+    (0, 255, 0, 255),  # arcade.color.GREEN
+    (0, 0, 255, 255),  # arcade.color.BLUE
+    (255, 255, 0, 255),  # arcade.color.YELLOW
+    (128, 0, 128, 255),  # arcade.color.PURPLE
+    (255, 165, 0, 255),  # arcade.color.ORANGE
+    (0, 255, 255, 255),  # arcade.color.CYAN
+]
+
+
+@dataclass
+class CellContent:
+    """
+    Content of a cell in the grid. The grid itself stores typed arrays (see
+    `BoardGrid`): cells are only materialized on demand, by `BoardGrid.cell`.
+    """
+
+    value: int
+    color: str
+    shape_cnt: int
+    orig_shape_idx: Optional[int] = (
+        None  # Index of the orignal shape, necessary to implement the "undo" feature
+    )
+
+
+EMPTY_SHAPE_CNT = -1  # `BoardGrid.pieces` value of the empty cells
+EMPTY_CELL = CellContent(value=0, color=EMPTY_CELL_COLOR, shape_cnt=EMPTY_SHAPE_CNT)
+
+
+# Layout of the board feature vector (`LazyBlocksEngine.features`)
+FEATURE_HOLES = 0  # Empty cells below the top of their column
+FEATURE_BUMPINESS = 1  # Sum of the height differences of adjacent columns
+FEATURE_ROW_TRANSITIONS = (
+    2  # Filled/empty changes along the non-empty rows, walls filled
+)
+FEATURE_COLUMN_TRANSITIONS = 3  # Filled/empty changes along the columns, floor filled
+FEATURE_AGGREGATE_HEIGHT = 4  # Sum of the column heights
+FEATURE_HEIGHTS = 5  # Start of the column heights, followed by the well depths
+
+
+class BoardFeatures:
+    """
+    Occupancy bitmasks of a grid and the features derived from them, kept up to
+    date incrementally.
+
+    Cells are flipped with `toggle`, and `update` then recomputes only the
+    columns and rows that changed. `remove_rows` shifts the masks down when
+    rows are cleared. `values` is a read-only view of the feature vector, laid
+    out as described by the `FEATURE_*` offsets: the totals, then `width`
+    column heights, then `width` well depths.
+
+    The per-row lists only extend to the highest row ever written, the rows
+    above are empty: a tall board costs nothing until the stack grows.
+    """
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.column_masks = [0] * width  # Bit y set if the cell (y, x) is filled
+        self.row_masks: list[int] = []  # Bit x set if the cell (y, x) is filled
+        self.full_rows: set[int] = set()
+        self._column_holes = [0] * width
+        self._column_transitions = [1] * width  # Floor to the empty bottom cell
+        self._row_transitions: list[int] = []
+        self._dirty_columns: set[int] = set()
+        self._dirty_rows: set[int] = set()
+        self._values = array("i", [0] * (FEATURE_HEIGHTS + 2 * width))
+        self.values = memoryview(self._values).toreadonly()
+        self._values[FEATURE_COLUMN_TRANSITIONS] = width
+        self._update_columns()
+
+    @property
+    def heights(self) -> memoryview:
+        return self.values[FEATURE_HEIGHTS : FEATURE_HEIGHTS + self.width]
+
+    @property
+    def wells(self) -> memoryview:
+        return self.values[FEATURE_HEIGHTS + self.width :]
+
+    def toggle(self, grid_y: int, grid_x: int):
+        """Flip a cell between empty and filled; call `update` once done."""
+        self.column_masks[grid_x] ^= 1 << grid_y
+        if grid_y >= len(self.row_masks):
+            grow = grid_y + 1 - len(self.row_masks)
+            self.row_masks.extend([0] * grow)
+            self._row_transitions.extend([0] * grow)
+        self.row_masks[grid_y] ^= 1 << grid_x
+        self._dirty_columns.add(grid_x)
+        self._dirty_rows.add(grid_y)
+
+    def update(self):
+        """Recompute the features of the columns and rows flipped since last time."""
+        values = self._values
+        if self._dirty_rows:
+            walls = 1 | (1 << (self.width + 1))
+            span = (1 << (self.width + 1)) - 1
+            full_row = (1 << self.width) - 1
+            for y in self._dirty_rows:
+                mask = self.row_masks[y]
+                if mask == full_row:
+                    self.full_rows.add(y)
+                else:
+                    self.full_rows.discard(y)
+                if mask:
+                    bordered = walls | (mask << 1)
+                    transitions = ((bordered ^ (bordered >> 1)) & span).bit_count()
+                else:
+                    transitions = 0
+                values[FEATURE_ROW_TRANSITIONS] += (
+                    transitions - self._row_transitions[y]
+                )
+                self._row_transitions[y] = transitions
+            self._dirty_rows.clear()
+
+        if self._dirty_columns:
+            span = (1 << self.height) - 1
+            for x in self._dirty_columns:
+                mask = self.column_masks[x]
+                height = mask.bit_length()
+                holes = height - mask.bit_count()
+                transitions = ((mask ^ ((mask << 1) | 1)) & span).bit_count()
+                values[FEATURE_HEIGHTS + x] = height
+                values[FEATURE_HOLES] += holes - self._column_holes[x]
+                values[FEATURE_COLUMN_TRANSITIONS] += (
+                    transitions - self._column_transitions[x]
+                )
+                self._column_holes[x] = holes
+                self._column_transitions[x] = transitions
+            self._dirty_columns.clear()
+            self._update_columns()
+
+    def _update_columns(self):
+        """Recompute the features depending on neighbouring columns, in O(width)."""
+        values = self._values
+        heights = values[FEATURE_HEIGHTS : FEATURE_HEIGHTS + self.width]
+        wells = FEATURE_HEIGHTS + self.width
+        bumpiness = 0
+        for x in range(self.width):
+            left = heights[x - 1] if x > 0 else self.height
+            right = heights[x + 1] if x < self.width - 1 else self.height
+            values[wells + x] = max(0, min(left, right) - heights[x])
+            if x > 0:
+                bumpiness += abs(heights[x] - left)
+        values[FEATURE_BUMPINESS] = bumpiness
+        values[FEATURE_AGGREGATE_HEIGHT] = sum(heights)
+
+    def remove_rows(self, rows: list[int]):
+        """Remove the given (full) rows and shift the rows above them down."""
+        rows = sorted(rows, reverse=True)
+        for y in rows:
+            low = (1 << y) - 1
+            self.column_masks = [
+                (mask & low) | ((mask >> (y + 1)) << y) for mask in self.column_masks
+            ]
+            del self.row_masks[y]
+            self._values[FEATURE_ROW_TRANSITIONS] -= self._row_transitions[y]
+            del self._row_transitions[y]
+        self.full_rows = {
+            y - sum(1 for removed in rows if removed < y)
+            for y in self.full_rows.difference(rows)
+        }
+        self._dirty_columns.update(range(self.width))
+        self.update()
+
+    def save(self) -> tuple:
+        """Copy of the state, for `restore`."""
+        return (
+            self.column_masks[:],
+            self.row_masks[:],
+            set(self.full_rows),
+            self._column_holes[:],
+            self._column_transitions[:],
+            self._row_transitions[:],
+            self._values.tobytes(),
+        )
+
+    def restore(self, state: tuple):
+        (
+            column_masks,
+            row_masks,
+            full_rows,
+            column_holes,
+            column_transitions,
+            row_transitions,
+            values,
+        ) = state
+        self.column_masks = column_masks[:]
+        self.row_masks = row_masks[:]
+        self.full_rows = set(full_rows)
+        self._column_holes = column_holes[:]
+        self._column_transitions = column_transitions[:]
+        self._row_transitions = row_transitions[:]
+        # Write in place, so that `values` stays valid
+        self._values[:] = array("i", values)
+        self._dirty_columns.clear()
+        self._dirty_rows.clear()
+
+
+class BoardGrid:
+    """
+    Cells of a board, bottom row first, in two flat typed arrays of `width`
+    cells per row, so that a board allocates no object per cell:
+
+    - `shapes`: one palette byte per cell, 0 for an empty cell, else the index
+      + 1 of the shape that filled it. The color of a cell only depends on its
+      shape, so the byte indexes the colors as well (see
+      `LazyBlocksEngine.palette`).
+    - `pieces`: the `shapes_cnt` of the piece that filled the cell, for the
+      undo, or `EMPTY_SHAPE_CNT` for an empty cell.
+
+    Only the rows up to the highest one ever written are stored; writes go
+    through `store`, which stores the missing rows first. `grid[y]` is the
+    palette bytes of row y, and `cell` builds a `CellContent` when one is
+    needed.
+    """
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.empty_row = bytes(width)
+        self.shapes = bytearray()
+        self.pieces = array("i")
+
+    @property
+    def stored_rows(self) -> int:
+        return len(self.shapes) // self.width
+
+    def __len__(self) -> int:
+        return self.height
+
+    def __getitem__(self, grid_y: int) -> bytes:
+        if not 0 <= grid_y < self.height:
+            raise IndexError(grid_y)
+        start = grid_y * self.width
+        if start < len(self.shapes):
+            return bytes(self.shapes[start : start + self.width])
+        return self.empty_row
+
+    def __iter__(self) -> Iterator[bytes]:
+        for grid_y in range(self.height):
+            yield self[grid_y]
+
+    def cells(self, bottom: int, top: int) -> bytes:
+        """Palette bytes of the rows `bottom` to `top - 1`, row after row."""
+        width = self.width
+        cells = self.shapes[bottom * width : top * width]
+        return bytes(cells) + bytes((top - bottom) * width - len(cells))
+
+    def cell(self, grid_y: int, grid_x: int, colors: Sequence) -> CellContent:
+        """Content of a cell, with `colors` the colors of the shapes."""
+        i = grid_y * self.width + grid_x
+        if i >= len(self.shapes) or not self.shapes[i]:
+            return EMPTY_CELL
+        shape_idx = self.shapes[i] - 1
+        return CellContent(
+            value=1,
+            color=colors[shape_idx],
+            shape_cnt=self.pieces[i],
+            orig_shape_idx=shape_idx,
+        )
+
+    def store(self, grid_y: int):
+        """Store the rows up to `grid_y`, to write into them."""
+        missing = (grid_y + 1) * self.width - len(self.shapes)
+        if missing > 0:
+            self.shapes.extend(bytes(missing))
+            self.pieces.extend(array("i", [EMPTY_SHAPE_CNT]) * missing)
+
+    def remove_rows(self, grid_rows: list[int]):
+        """Remove rows (in increasing order), the rows above move down."""
+        width = self.width
+        for grid_y in reversed(grid_rows):
+            if grid_y < self.stored_rows:
+                del self.shapes[grid_y * width : (grid_y + 1) * width]
+                del self.pieces[grid_y * width : (grid_y + 1) * width]
+
+    def save(self, grid_y: int) -> tuple:
+        """Copy of the rows from `grid_y` up, for `restore`."""
+        start = grid_y * self.width
+        return start, self.shapes[start:], self.pieces[start:]
+
+    def restore(self, saved: tuple):
+        start, shapes, pieces = saved
+        self.shapes[start:] = shapes
+        self.pieces[start:] = pieces
+
+
+@dataclass
+class RuleSet:
+    """Game rules that can be varied, e.g. to compare variants in simulations."""
+
+    helper_piece_probability: float = 1.0  # Chance to get a helper piece at a spawn
+    max_undos: Optional[int] = None  # Undos allowed per game, None for unlimited
+    grid_width: int = GRID_WIDTH  # Board size, in cells
+    grid_height: int = GRID_HEIGHT
+
+
+@dataclass
+class PlacementUndo:
+    """What `make_placement` changed, so that `unmake_placement` can revert it."""
+
+    written_cells: list[tuple[int, int]]  # (y, x) of the cells, empty before
+    previous_rows: Optional[tuple]  # `BoardGrid.save()` before the clear
+    previous_row_hashes: Optional[list[int]]
+    previous_features: Optional[tuple]  # `BoardFeatures.save()` before the clear
+    grid_hash: int
+    score: int
+    cleared_rows: int
+    shapes_cnt: int
+
+
+def rotate_shape(shape: list[list[int]]) -> list[list[int]]:
+    """Rotate a shape 90 degrees clockwise."""
+    return [list(row) for row in zip(*shape[::-1])]
+
+
+class LazyBlocksEngine:
+    """
+    Game state and rules of LazyBlocks, without any rendering, sound or input.
+
+    The grid is stored bottom row first: `grid[y][x]`, with `y = 0` the bottom
+    of the board. A shape's first row is its top row, so a shape at
+    `current_position = (x, y)` covers the rows `y, y - 1, ...`. The board size
+    comes from the rules (`grid_width` x `grid_height`), and only the rows up to
+    the stack are stored, so very tall boards are cheap. Drops, clears and
+    undos only touch the rows around the piece or above the cleared rows.
+
+    The occupancy of the grid is hashed: `row_hashes[y]` is the `row_hash` of
+    row y and `grid_hash` the XOR of all rows. Both are kept up to date by every
+    method writing to the grid, so that `position_hash` is O(1). The same
+    methods keep `board_features` (column heights, holes, transitions, wells...)
+    up to date, exposed as the read-only array `features`.
+    """
+
+    def __init__(self, seed: Optional[int] = None, rules: Optional[RuleSet] = None):
+        self.rng = random.Random(seed)
+        self.rules = rules or RuleSet()
+        self.all_pieces_colors = list(PIECE_COLORS)
+        self.reset_state()
+
+    def reset_state(self):
+        """Reset the board and the pieces, and spawn the first shape."""
+        self.grid_width = self.rules.grid_width
+        self.grid_height = self.rules.grid_height
+        self.grid = BoardGrid(self.grid_width, self.grid_height)
+        self.row_hashes: list[int] = []
+        self.grid_hash = 0
+        self.board_features = BoardFeatures(self.grid_width, self.grid_height)
+        self.current_shape = None
+        self.current_position = (0, 0)
+        self.game_over = False
+        self.score = 0
+        self.current_shape_color = None
+        self.next_shape = None
+        self.current_shape_idx = None
+        self.next_shape_idx = None
+        self.helper_piece_idx = None
+        self.helper_piece_shape = None
+        self.shapes_cnt = -1
+        self.undo_count = 0
+        self.swap_count = 0
+        self.cleared_rows = 0  # Rows cleared since the start of the game
+        # (bottom row, top row, `cleared_rows`) of each piece when it was placed,
+        # indexed by `shapes_cnt`: the undo only searches around these rows
+        self.placed_rows = array("q")
+
+        self.spawn_new_shape()
+
+    @property
+    def position_hash(self) -> int:
+        """Zobrist hash of the grid occupancy and the current, helper, next pieces."""
+        h = self.grid_hash
+        if self.current_shape_idx is not None:
+            h ^= ZOBRIST_CURRENT[self.current_shape_idx]
+        if self.helper_piece_idx is not None:
+            h ^= ZOBRIST_HELPER[self.helper_piece_idx]
+        if self.next_shape_idx is not None:
+            h ^= ZOBRIST_NEXT[self.next_shape_idx]
+        return h
+
+    @property
+    def palette(self) -> list:
+        """Color of each palette byte of the grid: empty, then the shapes."""
+        return [EMPTY_CELL_COLOR, *self.all_pieces_colors]
+
+    def cell(self, grid_y: int, grid_x: int) -> CellContent:
+        """Content of a cell of the grid."""
+        return self.grid.cell(grid_y, grid_x, self.all_pieces_colors)
+
+    @property
+    def features(self) -> memoryview:
+        """Read-only board feature vector, see the `FEATURE_*` offsets."""
+        return self.board_features.values
+
+    def _toggle_cell(self, grid_y: int, grid_x: int):
+        """
+        Update the hashes and the feature masks of a cell going from empty to
+        filled, or the reverse. `board_features.update()` must follow.
+        """
+        self.board_features.toggle(grid_y, grid_x)
+        row_hashes = self.row_hashes
+        if grid_y >= len(row_hashes):
+            row_hashes.extend([0] * (grid_y + 1 - len(row_hashes)))
+        new_hash = row_hash(grid_y, self.board_features.row_masks[grid_y])
+        self.grid_hash ^= row_hashes[grid_y] ^ new_hash
+        row_hashes[grid_y] = new_hash
+
+    def rebuild_board_state(self):
+        """
+        Recompute the hashes and the features from the cells, after the grid
+        rows were replaced as a whole (e.g. when a snapshot is restored).
+        """
+        self.board_features = BoardFeatures(self.grid_width, self.grid_height)
+        for i, shape in enumerate(self.grid.shapes):
+            if shape:
+                self.board_features.toggle(*divmod(i, self.grid_width))
+        self.board_features.update()
+        self.row_hashes = [
+            row_hash(grid_y, mask)
+            for grid_y, mask in enumerate(self.board_features.row_masks)
+        ]
+        self.grid_hash = 0
+        for h in self.row_hashes:
+            self.grid_hash ^= h
+
+    @property
+    def stack_height(self) -> int:
+        """Height of the highest column."""
+        return max(self.board_features.heights)
+
+    def spawn_position(self, shape: list[list[int]]) -> tuple[int, int]:
+        """
+        Starting position of a shape, centered at the top of the grid, or with
+        its top row `SPAWN_CLEARANCE` rows above the stack if that is lower.
+        """
+        top = min(self.grid_height - 1, max(self.stack_height - 1, 0) + SPAWN_CLEARANCE)
+        return (self.grid_width // 2 - len(shape[0]) // 2, top)
+
+    def _draw_spawn_pieces(self, rng: random.Random) -> tuple[Optional[int], int]:
+        """Draw the helper (None if there is none) and the next shape of a spawn."""
+        # The helper's random draw is skipped under the default rules, so that
+        # seeded games don't depend on the rule set
+        if (
+            self.rules.helper_piece_probability >= 1
+            or rng.random() < self.rules.helper_piece_probability
+        ):
+            helper_idx = rng.randint(0, len(SHAPES) - 1)
+        else:
+            helper_idx = None
+        return helper_idx, rng.randint(0, len(SHAPES) - 1)
+
+    def preview_pieces(self, count: int) -> list[tuple[int, Optional[int]]]:
+        """
+        The (current, helper) shapes offered for the next `count` placements,
+        starting with the present ones, as drawn by the spawns to come. The
+        random generator itself is not advanced.
+        """
+        rng = random.Random()
+        rng.setstate(self.rng.getstate())
+        pieces = [(self.current_shape_idx, self.helper_piece_idx)]
+        next_idx = self.next_shape_idx
+        while len(pieces) < count:
+            helper_idx, following_idx = self._draw_spawn_pieces(rng)
+            pieces.append((next_idx, helper_idx))
+            next_idx = following_idx
+        return pieces[:count]
+
+    def spawn_new_shape(self):
+        """Spawn a new shape at the top of the grid."""
+        self.current_shape_idx = (
+            self.rng.randint(0, len(SHAPES) - 1)
+            if self.next_shape_idx is None
+            else self.next_shape_idx
+        )
+        self.current_shape = SHAPES[self.current_shape_idx]
+
+        # Generate the helper and the next shapes
+        self.helper_piece_idx, self.next_shape_idx = self._draw_spawn_pieces(self.rng)
+        self.helper_piece_shape = (
+            None if self.helper_piece_idx is None else SHAPES[self.helper_piece_idx]
+        )
+        self.next_shape = SHAPES[self.next_shape_idx]
+
+        self.current_position = self.spawn_position(self.current_shape)
+        self.current_shape_color = self.all_pieces_colors[self.current_shape_idx]
+        if not self.can_be_placed(self.current_shape, self.current_position):
+            self.game_over = True
+
+        assert isinstance(self.current_shape_idx, int)
+        assert isinstance(self.next_shape_idx, int)
+
+    def swap_current_and_helper(self):
+        """
+        Swap the current and the helper shapes
+        """
+        if self.helper_piece_idx is None:
+            return
+        self.swap_count += 1
+        (
+            self.current_shape_idx,
+            self.current_shape,
+            self.helper_piece_idx,
+            self.helper_piece_shape,
+        ) = (
+            self.helper_piece_idx,
+            self.helper_piece_shape,
+            self.current_shape_idx,
+            self.current_shape,
+        )
+
+        # Update the colors
+        # TODO: Find a consistent way to do this
+        self.current_shape_color = self.all_pieces_colors[self.current_shape_idx]
+
+        # Put the shape in the starting position
+        self.current_position = self.spawn_position(self.current_shape)
+
+    def can_be_placed(self, shape: list[list[int]], position: list[int]):
+        """Check if the shape can be placed at the given position."""
+        row_masks = self.board_features.row_masks
+        for y, row in enumerate(shape):
+            for x, cell in enumerate(row):
+                if cell:
+                    grid_x = position[0] + x
+                    grid_y = position[1] - y
+                    if (
+                        grid_x < 0
+                        or grid_x >= self.grid_width
+                        or grid_y < 0
+                        or grid_y >= self.grid_height
+                        or (grid_y < len(row_masks) and row_masks[grid_y] >> grid_x & 1)
+                    ):
+                        return False
+        return True
+
+    def drop_position(
+        self, shape: list[list[int]], position: tuple[int, int]
+    ) -> tuple[int, int]:
+        """
+        Lowest position straight below a (valid) position where the shape fits,
+        found from the column masks rather than by moving down row by row.
+        """
+        column_masks = self.board_features.column_masks
+        distance = position[1]
+        for y, row in enumerate(shape):
+            grid_y = position[1] - y
+            for x, cell in enumerate(row):
+                if cell:
+                    # Highest filled cell below this one
+                    below = column_masks[position[0] + x] & ((1 << grid_y) - 1)
+                    distance = min(distance, grid_y - below.bit_length())
+        return (position[0], position[1] - distance)
+
+    def move_current_shape(self, dx: int, dy: int) -> bool:
+        """Move the current shape by (dx, dy) if possible. Return True if it moved."""
+        position = (self.current_position[0] + dx, self.current_position[1] + dy)
+        if not self.can_be_placed(self.current_shape, position):
+            return False
+        self.current_position = position
+        return True
+
+    def rotate_current_shape(self) -> bool:
+        """Rotate the current shape clockwise if possible. Return True if it rotated."""
+        rotated_shape = rotate_shape(self.current_shape)
+        if not self.can_be_placed(rotated_shape, self.current_position):
+            return False
+        self.current_shape = rotated_shape
+        return True
+
+    def place_piece_on_grid(self):
+        """Drop the current shape as far as it goes and write it into the grid."""
+        # Drop the shape immediately
+        below = (self.current_position[0], self.current_position[1] - 1)
+        if self.can_be_placed(self.current_shape, below):
+            self.current_position = self.drop_position(self.current_shape, below)
+        # Place the shape on the grid
+        self.shapes_cnt += 1
+        self.grid.store(self.current_position[1])
+        shapes, pieces = self.grid.shapes, self.grid.pieces
+        shape_byte = self.current_shape_idx + 1
+        for y, row in enumerate(self.current_shape):
+            for x, cell in enumerate(row):
+                if cell:
+                    grid_x = self.current_position[0] + x
+                    grid_y = self.current_position[1] - y
+                    if grid_y >= 0:
+                        i = grid_y * self.grid_width + grid_x
+                        if not shapes[i]:
+                            self._toggle_cell(grid_y, grid_x)
+                        shapes[i] = shape_byte
+                        pieces[i] = self.shapes_cnt
+        self.board_features.update()
+        self._record_placement(self.current_shape, self.current_position)
+
+    def _record_placement(self, shape: list[list[int]], position: tuple[int, int]):
+        top = position[1]
+        self.placed_rows.extend((max(0, top - len(shape) + 1), top, self.cleared_rows))
+
+    def clear_full_rows(self) -> int:
+        """Clear full rows and update the score. Return the number of cleared rows."""
+        features = self.board_features
+        if not features.full_rows:
+            return 0
+        full_rows = sorted(features.full_rows)
+        cleared_rows = len(full_rows)
+        features.remove_rows(full_rows)
+
+        self.grid.remove_rows(full_rows)
+
+        # The rows below the first cleared one keep their place, and their hash
+        first_cleared = full_rows[0]
+
+        row_hashes = self.row_hashes[:first_cleared]
+        grid_hash = self.grid_hash
+        for old_hash in self.row_hashes[first_cleared:]:
+            grid_hash ^= old_hash
+        row_masks = features.row_masks
+        for y in range(first_cleared, len(row_masks)):
+            new_hash = row_hash(y, row_masks[y])
+            grid_hash ^= new_hash
+            row_hashes.append(new_hash)
+        self.row_hashes = row_hashes
+        self.grid_hash = grid_hash
+
+        self.cleared_rows += cleared_rows
+        self.score += cleared_rows
+        return cleared_rows
+
+    def make_placement(
+        self, shape: list[list[int]], position: tuple[int, int], shape_idx: int
+    ) -> PlacementUndo:
+        """
+        Write a shape on the grid at its final position and clear the full rows,
+        without touching the pieces or the random generator. Used by the search
+        code to explore moves; `unmake_placement` restores the previous state.
+        """
+        undo = PlacementUndo(
+            written_cells=[],
+            previous_rows=None,
+            previous_row_hashes=None,
+            previous_features=None,
+            grid_hash=self.grid_hash,
+            score=self.score,
+            cleared_rows=self.cleared_rows,
+            shapes_cnt=self.shapes_cnt,
+        )
+        self.shapes_cnt += 1
+        self.grid.store(position[1])
+        shapes, pieces = self.grid.shapes, self.grid.pieces
+        for y, row in enumerate(shape):
+            for x, cell in enumerate(row):
+                if cell:
+                    grid_x = position[0] + x
+                    grid_y = position[1] - y
+                    undo.written_cells.append((grid_y, grid_x))
+                    self._toggle_cell(grid_y, grid_x)
+                    i = grid_y * self.grid_width + grid_x
+                    shapes[i] = shape_idx + 1
+                    pieces[i] = self.shapes_cnt
+        self.board_features.update()
+        self._record_placement(shape, position)
+
+        full_rows = self.board_features.full_rows
+        if any(grid_y in full_rows for grid_y, _ in undo.written_cells):
+            undo.previous_rows = self.grid.save(min(full_rows))
+            undo.previous_row_hashes = self.row_hashes
+            undo.previous_features = self.board_features.save()
+            # Bypass the front-ends' overrides (sounds, score file) while exploring
+            LazyBlocksEngine.clear_full_rows(self)
+        return undo
+
+    def unmake_placement(self, undo: PlacementUndo):
+        """Revert a `make_placement`."""
+        if undo.previous_rows is not None:
+            self.grid.restore(undo.previous_rows)
+            self.row_hashes = undo.previous_row_hashes
+            self.board_features.restore(undo.previous_features)
+        shapes, pieces = self.grid.shapes, self.grid.pieces
+        for grid_y, grid_x in reversed(undo.written_cells):
+            i = grid_y * self.grid_width + grid_x
+            shapes[i] = 0
+            pieces[i] = EMPTY_SHAPE_CNT
+            self._toggle_cell(grid_y, grid_x)
+        self.board_features.update()
+        del self.placed_rows[-3:]
+        self.grid_hash = undo.grid_hash
+        self.score = undo.score
+        self.cleared_rows = undo.cleared_rows
+        self.shapes_cnt = undo.shapes_cnt
+
+    def can_undo(self) -> bool:
+        """Whether there is a piece to undo, within the undo limit of the rules."""
+        return self.shapes_cnt > -1 and (
+            self.rules.max_undos is None or self.undo_count < self.rules.max_undos
+        )
+
+    def undo_prev_move(self):
+        """
+        Remove the cells of the last placed piece (the ones still on the grid),
+        and make its shape the next one to spawn.
+        """
+        # The piece's rows can only have moved down by the rows cleared since
+        bottom, top, cleared_rows = self.placed_rows[-3:]
+        bottom = max(0, bottom - (self.cleared_rows - cleared_rows))
+        shapes, pieces = self.grid.shapes, self.grid.pieces
+        width = self.grid_width
+        for i in range(bottom * width, min((top + 1) * width, len(pieces))):
+            if pieces[i] == self.shapes_cnt:
+                # Assign the next shape index to the current shape index
+                self.next_shape_idx = shapes[i] - 1
+                # Remove the piece from the grid
+                self._toggle_cell(*divmod(i, width))
+                shapes[i] = 0
+                pieces[i] = EMPTY_SHAPE_CNT
+        self.board_features.update()
+        del self.placed_rows[-3:]
+        self.undo_count += 1
+        # Decrease the shapes count
+        self.shapes_cnt -= 1
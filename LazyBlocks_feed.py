@@ -0,0 +1,351 @@
+"""
+Live state feed of a running game in shared memory, for bots in other
+processes.
+
+The game publishes its board and pieces into a `multiprocessing.shared_memory`
+block, and takes actions back from a ring buffer in the same block. There is
+no lock, no pipe and no serialization: a bot reads the state with a few
+memory copies, and the game applies its actions within a couple of
+milliseconds, instead of at the 10 FPS of the game updates.
+
+    python LazyBlocks.py --feed lazyblocks       # the game
+    python LazyBlocks_feed.py lazyblocks         # a demo bot, with latencies
+
+The state is guarded by a sequence counter (a seqlock): the game makes it odd
+while it writes and even again when done, and a reader retries until it read
+the same even counter before and after its copy. Actions go through a
+single-producer, single-consumer ring: the bot only writes `head` and the game
+only writes `tail`, each on its own cache line.
+
+Layout of the block (little-endian):
+    0       magic "LZBF", version, board width, height, ring capacity
+    64      sequence counter (uint64)
+    128     ring head (uint64), actions sent by the bot
+    192     ring tail (uint64), actions taken by the game
+    256     ring: `capacity` action bytes
+    ...     state: score, shapes_cnt, current shape and rotation, helper shape
+            and rotation (255 if none), next shape, position, game over
+    ...     board: one palette byte per cell (see `BoardGrid`), bottom row first
+"""
+
+import struct
+import sys
+import time
+from dataclasses import dataclass
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional
+
+from LazyBlocks_engine import SHAPES, LazyBlocksEngine, rotate_shape
+
+FEED_MAGIC = b"LZBF"
+FEED_VERSION = 1
+RING_CAPACITY = 256  # Actions, a power of 2
+
+# Actions, the moves of the keyboard controls
+MOVE_LEFT = 1
+MOVE_RIGHT = 2
+MOVE_DOWN = 3
+ROTATE = 4
+DROP = 5
+SWAP = 6
+CLEAR_ROWS = 7
+UNDO = 8
+
+NO_PIECE = 255  # Shape index of a missing helper piece
+
+_HEADER = struct.Struct("<4sHIIH")
+_COUNTER = struct.Struct("<Q")
+_STATE = struct.Struct("<qqBBBBBii?")
+_SEQ_OFFSET = 64
+_HEAD_OFFSET = 128
+_TAIL_OFFSET = 192
+_RING_OFFSET = 256
+
+# Every rotation of every shape, to send the current shape as a rotation index
+ROTATIONS = []
+for _shape in SHAPES:
+    ROTATIONS.append([_shape])
+    for _ in range(3):
+        ROTATIONS[-1].append(rotate_shape(ROTATIONS[-1][-1]))
+
+
+def shape_rotation(shape, shape_idx: int) -> int:
+    """Number of clockwise rotations from `SHAPES[shape_idx]` to `shape`."""
+    return ROTATIONS[shape_idx].index([list(row) for row in shape])
+
+
+def feed_size(width: int, height: int, capacity: int = RING_CAPACITY) -> int:
+    return _RING_OFFSET + capacity + _STATE.size + width * height
+
+
+def apply_action(engine: LazyBlocksEngine, action: int) -> bool:
+    """Play an action on an engine (or a game view). Return True if it did anything."""
+    if engine.game_over:
+        return False
+    if action == MOVE_LEFT:
+        return engine.move_current_shape(-1, 0)
+    if action == MOVE_RIGHT:
+        return engine.move_current_shape(1, 0)
+    if action == MOVE_DOWN:
+        return engine.move_current_shape(0, -1)
+    if action == ROTATE:
+        return engine.rotate_current_shape()
+    if action == DROP:
+        engine.place_piece_on_grid()
+        engine.spawn_new_shape()
+        return True
+    if action == SWAP:
+        if engine.helper_piece_idx is None:
+            return False
+        engine.swap_current_and_helper()
+        return True
+    if action == CLEAR_ROWS:
+        return bool(engine.clear_full_rows())
+    if action == UNDO:
+        if not engine.can_undo():
+            return False
+        engine.undo_prev_move()
+        engine.spawn_new_shape()
+        return True
+    raise ValueError(f"Unknown action: {action}")
+
+
+class StateFeed:
+    """
+    Game side of the feed: creates the shared block, publishes the state and
+    takes the actions. Only one process may publish.
+    """
+
+    def __init__(self, name: str, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.capacity = RING_CAPACITY
+        self.memory = shared_memory.SharedMemory(
+            name=name, create=True, size=feed_size(width, height)
+        )
+        self.buffer = self.memory.buf
+        _HEADER.pack_into(
+            self.buffer, 0, FEED_MAGIC, FEED_VERSION, width, height, self.capacity
+        )
+        self.state_offset = _RING_OFFSET + self.capacity
+        self.board_offset = self.state_offset + _STATE.size
+        self.seq = 0
+        self.tail = 0
+        self.published_cells = 0  # Board bytes written by the last publish
+        self.published = None
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def publish(self, engine: LazyBlocksEngine, force: bool = False) -> bool:
+        """Write the engine's state if it changed. Return True if it was written."""
+        assert (engine.grid_width, engine.grid_height) == (self.width, self.height)
+        key = (
+            engine.grid_hash,
+            engine.shapes_cnt,
+            engine.score,
+            engine.current_position,
+            id(engine.current_shape),
+            engine.helper_piece_idx,
+            id(engine.helper_piece_shape),
+            engine.next_shape_idx,
+            engine.game_over,
+        )
+        if key == self.published and not force:
+            return False
+        self.published = key
+
+        buffer = self.buffer
+        helper_idx = engine.helper_piece_idx
+        self.seq += 1  # Odd: being written
+        _COUNTER.pack_into(buffer, _SEQ_OFFSET, self.seq)
+        _STATE.pack_into(
+            buffer,
+            self.state_offset,
+            engine.score,
+            engine.shapes_cnt,
+            engine.current_shape_idx,
+            shape_rotation(engine.current_shape, engine.current_shape_idx),
+            NO_PIECE if helper_idx is None else helper_idx,
+            (
+                0
+                if helper_idx is None
+                else shape_rotation(engine.helper_piece_shape, helper_idx)
+            ),
+            engine.next_shape_idx,
+            engine.current_position[0],
+            engine.current_position[1],
+            engine.game_over,
+        )
+        # Only the stored rows, and the ones stored at the previous publish
+        cells = engine.grid.shapes
+        start = self.board_offset
+        buffer[start : start + len(cells)] = cells
+        if len(cells) < self.published_cells:
+            buffer[start + len(cells) : start + self.published_cells] = bytes(
+                self.published_cells - len(cells)
+            )
+        self.published_cells = len(cells)
+        self.seq += 1  # Even: consistent again
+        _COUNTER.pack_into(buffer, _SEQ_OFFSET, self.seq)
+        return True
+
+    def actions(self) -> bytes:
+        """Take the actions sent since the last call, oldest first."""
+        (head,) = _COUNTER.unpack_from(self.buffer, _HEAD_OFFSET)
+        if head == self.tail:
+            return b""
+        # The actions may wrap around the end of the ring
+        count = head - self.tail
+        start = _RING_OFFSET + (self.tail & (self.capacity - 1))
+        first = min(count, _RING_OFFSET + self.capacity - start)
+        taken = bytes(self.buffer[start : start + first]) + bytes(
+            self.buffer[_RING_OFFSET : _RING_OFFSET + count - first]
+        )
+        self.tail = head
+        _COUNTER.pack_into(self.buffer, _TAIL_OFFSET, self.tail)
+        return taken
+
+    def close(self):
+        """Remove the block. Bots still attached keep their mapping."""
+        self.buffer = None
+        self.memory.close()
+        self.memory.unlink()
+
+
+@dataclass
+class FeedState:
+    seq: int
+    score: int
+    shapes_cnt: int
+    current_shape_idx: int
+    current_rotation: int
+    helper_piece_idx: Optional[int]
+    helper_rotation: int
+    next_shape_idx: int
+    position: tuple[int, int]
+    game_over: bool
+    board: bytes  # Palette byte of the cell (x, y) at `y * width + x`
+    width: int
+    height: int
+
+    @property
+    def current_shape(self) -> list[list[int]]:
+        return ROTATIONS[self.current_shape_idx][self.current_rotation]
+
+    def cell(self, grid_x: int, grid_y: int) -> int:
+        return self.board[grid_y * self.width + grid_x]
+
+
+class FeedClient:
+    """Bot side of the feed: reads the state and sends actions."""
+
+    def __init__(self, name: str):
+        self.memory = shared_memory.SharedMemory(name=name)
+        # Attaching registers the block for removal when this process exits,
+        # which is the game's job
+        resource_tracker.unregister(self.memory._name, "shared_memory")
+        self.buffer = self.memory.buf
+        magic, version, self.width, self.height, self.capacity = _HEADER.unpack_from(
+            self.buffer, 0
+        )
+        if magic != FEED_MAGIC or version != FEED_VERSION:
+            raise ValueError(f"{name} is not a LazyBlocks feed")
+        self.state_offset = _RING_OFFSET + self.capacity
+        self.board_offset = self.state_offset + _STATE.size
+        self.end = self.board_offset + self.width * self.height
+        (self.head,) = _COUNTER.unpack_from(self.buffer, _HEAD_OFFSET)
+
+    @property
+    def seq(self) -> int:
+        return _COUNTER.unpack_from(self.buffer, _SEQ_OFFSET)[0]
+
+    def read(self) -> FeedState:
+        """Consistent copy of the latest state."""
+        buffer = self.buffer
+        while True:
+            (before,) = _COUNTER.unpack_from(buffer, _SEQ_OFFSET)
+            if before & 1:
+                continue  # Being written
+            data = bytes(buffer[self.state_offset : self.end])
+            (after,) = _COUNTER.unpack_from(buffer, _SEQ_OFFSET)
+            if before == after:
+                break
+        (
+            score,
+            shapes_cnt,
+            current_idx,
+            current_rotation,
+            helper_idx,
+            helper_rotation,
+            next_idx,
+            x,
+            y,
+            game_over,
+        ) = _STATE.unpack_from(data)
+        return FeedState(
+            seq=before,
+            score=score,
+            shapes_cnt=shapes_cnt,
+            current_shape_idx=current_idx,
+            current_rotation=current_rotation,
+            helper_piece_idx=None if helper_idx == NO_PIECE else helper_idx,
+            helper_rotation=helper_rotation,
+            next_shape_idx=next_idx,
+            position=(x, y),
+            game_over=game_over,
+            board=data[_STATE.size :],
+            width=self.width,
+            height=self.height,
+        )
+
+    def wait(self, after_seq: int, timeout: float = 1.0) -> Optional[FeedState]:
+        """The first state published after `after_seq`, None on timeout."""
+        deadline = time.perf_counter() + timeout
+        while self.seq <= after_seq + 1:
+            if time.perf_counter() > deadline:
+                return None
+        return self.read()
+
+    def send(self, action: int) -> bool:
+        """Queue an action for the game. Return False if the ring is full."""
+        (tail,) = _COUNTER.unpack_from(self.buffer, _TAIL_OFFSET)
+        if self.head - tail >= self.capacity:
+            return False
+        self.buffer[_RING_OFFSET + (self.head & (self.capacity - 1))] = action
+        self.head += 1
+        _COUNTER.pack_into(self.buffer, _HEAD_OFFSET, self.head)
+        return True
+
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+
+
+def main(argv: Optional[list[str]] = None):
+    """Demo bot: wiggle the current piece and report the round-trip latency."""
+    argv = sys.argv[1:] if argv is None else argv
+    client = FeedClient(argv[0] if argv else "lazyblocks")
+    latencies = []
+    state = client.read()
+    for i in range(200):
+        start = time.perf_counter()
+        client.send(MOVE_LEFT if i % 2 else MOVE_RIGHT)
+        new_state = client.wait(state.seq, timeout=0.1)
+        if new_state is None:  # The move was blocked: nothing to publish
+            continue
+        latencies.append(time.perf_counter() - start)
+        state = new_state
+    client.close()
+    if latencies:
+        latencies.sort()
+        print(
+            f"{len(latencies)} moves, latency median"
+            f" {latencies[len(latencies) // 2] * 1e3:.2f} ms,"
+            f" max {latencies[-1] * 1e3:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+Heatmaps of many games: how often each cell is filled, where the pieces land
+(per shape and rotation), where holes form and which rows are cleared. They
+show how rule variants (e.g. the helper piece probability) change the play.
+
+    lazyblocks-heatmap --games 100000 --policy greedy --output heatmaps/
+    lazyblocks-heatmap --archive games.lzba --output heatmaps/
+
+Games are simulated (as `lazyblocks-sim` plays them) or read from a replay
+archive, in batches on a process pool. The game loop only copies the board
+before each placement into a chunk of `CHUNK` boards, with the placed piece;
+a full chunk is accumulated with NumPy at once:
+    occupancy   filled cells of the boards
+    landings    cells of the placed pieces, per shape and rotation
+    holes       empty cells covered by the piece that were not covered before
+    cleared     rows completed by the placements that clear them, and rows
+                cleared by the clear action of the keyboard controls
+
+The output directory gets the arrays (heatmaps.npz, counts of events, bottom
+row first) and a PNG of each heatmap, top row first.
+"""
+
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+from PIL import Image
+
+from LazyBlocks_ai import Placement, apply_placement
+from LazyBlocks_engine import GRID_HEIGHT, GRID_WIDTH, SHAPES, LazyBlocksEngine
+from LazyBlocks_feed import (
+    CLEAR_ROWS,
+    DROP,
+    ROTATIONS,
+    apply_action,
+    shape_rotation,
+)
+from LazyBlocks_replay import PLACE, Replay, ReplayArchive, play_placement
+from LazyBlocks_sim import (
+    POLICIES,
+    SimulationConfig,
+    UndoPlayer,
+    make_policy,
+    new_game,
+)
+
+CHUNK = 4096  # Placements accumulated at once
+CELL_PIXELS = 16  # Side of a cell in the PNGs
+GAP_COLOR = (102, 102, 153)  # Between the boards of the landings PNG
+
+# Cells of each rotation of each shape: (rows below the top-left cell, columns)
+_CELLS = [
+    [
+        (
+            np.array([dy for dy, row in enumerate(shape) for c in row if c]),
+            np.array([dx for row in shape for dx, c in enumerate(row) if c]),
+        )
+        for shape in rotations
+    ]
+    for rotations in ROTATIONS
+]
+
+# Black, red, yellow, white
+_HEAT = np.array([[0, 0, 0], [200, 0, 0], [255, 220, 0], [255, 255, 255]], float)
+
+
+@dataclass
+class Heatmaps:
+    """Event counts of a set of games, per cell (row 0 at the bottom)."""
+
+    occupancy: np.ndarray  # (height, width)
+    landings: np.ndarray  # (shapes, 4 rotations, height, width)
+    holes: np.ndarray  # (height, width)
+    cleared: np.ndarray  # (height,)
+    games: int = 0
+    placements: int = 0
+    skipped: int = 0  # Games of another board size
+
+    @classmethod
+    def empty(cls, width: int, height: int) -> "Heatmaps":
+        return cls(
+            occupancy=np.zeros((height, width), np.int64),
+            landings=np.zeros((len(SHAPES), 4, height, width), np.int64),
+            holes=np.zeros((height, width), np.int64),
+            cleared=np.zeros(height, np.int64),
+        )
+
+    def add(self, other: "Heatmaps"):
+        for field in fields(self):
+            setattr(
+                self, field.name, getattr(self, field.name) + getattr(other, field.name)
+            )
+
+    def save(self, directory: str):
+        """Write heatmaps.npz and the PNGs."""
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path / "heatmaps.npz",
+            **{field.name: getattr(self, field.name) for field in fields(self)},
+        )
+        save_png(heat_colors(self.occupancy[::-1]), path / "occupancy.png")
+        save_png(heat_colors(self.holes[::-1]), path / "holes.png")
+        save_png(heat_colors(self.cleared[::-1, None]), path / "cleared.png")
+        save_png(landings_image(self.landings), path / "landings.png")
+
+
+class HeatmapCollector:
+    """
+    Takes the placements of games as they are played, and accumulates them
+    into heatmaps by chunks.
+    """
+
+    def __init__(self, width: int, height: int, chunk: int = CHUNK):
+        self.width = width
+        self.height = height
+        self.heatmaps = Heatmaps.empty(width, height)
+        self.boards = np.zeros((chunk, height, width), np.uint8)
+        self.pieces = np.zeros((chunk, 5), np.int64)  # Shape, rotation, x, y, clear
+        self.count = 0
+
+    def placement(self, engine: LazyBlocksEngine, rotation: int, position, clear):
+        """Take a placement of the current piece, before it is played."""
+        n = self.count
+        cells = engine.grid.cells(0, self.height)
+        self.boards[n] = np.frombuffer(cells, np.uint8).reshape(self.height, -1)
+        self.pieces[n] = (engine.current_shape_idx, rotation, *position, clear)
+        self.count += 1
+        if self.count == len(self.boards):
+            self.flush()
+
+    def rows_cleared(self, engine: LazyBlocksEngine):
+        """Take a clear action, before it is played."""
+        full = (1 << self.width) - 1
+        for grid_y, mask in enumerate(engine.board_features.row_masks):
+            if mask == full and grid_y < self.height:
+                self.heatmaps.cleared[grid_y] += 1
+
+    def flush(self):
+        """Accumulate the placements taken since the last flush."""
+        n = self.count
+        if not n:
+            return
+        heatmaps = self.heatmaps
+        height, width = self.height, self.width
+        before = self.boards[:n] != 0
+        shape, rotation, x, y, clear = self.pieces[:n].T
+        heatmaps.occupancy += before.sum(axis=0)
+
+        # The boards with the pieces dropped, the completed rows not cleared
+        after = before.copy()
+        for s, r in set(zip(shape.tolist(), rotation.tolist())):
+            group = np.flatnonzero((shape == s) & (rotation == r))
+            dy, dx = _CELLS[s][r]
+            rows = y[group, None] - dy
+            columns = x[group, None] + dx
+            inside = (rows >= 0) & (rows < height) & (columns >= 0) & (columns < width)
+            board = np.broadcast_to(group[:, None], rows.shape)
+            after[board[inside], rows[inside], columns[inside]] = True
+            heatmaps.landings[s, r] += np.bincount(
+                rows[inside] * width + columns[inside], minlength=height * width
+            ).reshape(height, width)
+
+        heatmaps.holes += (_holes(after) & ~_holes(before)).sum(axis=0)
+        heatmaps.cleared += after[clear != 0].all(axis=2).sum(axis=0)
+        heatmaps.placements += n
+        self.count = 0
+
+    def play_game(self, seed: int, config: SimulationConfig):
+        """Play a seeded bot game, as `run_game` does."""
+        engine = new_game(seed, config)
+        policy = make_policy(config.policy, seed, config.lookahead_depth)
+
+        def place(choice: Optional[tuple[bool, Placement]]):
+            # An undone placement was played too, and stays in the heatmaps
+            if choice is None:
+                # Nothing fits: drop the piece where it is, the next spawn ends it
+                rotation = shape_rotation(
+                    engine.current_shape, engine.current_shape_idx
+                )
+                self.placement(engine, rotation, engine.current_position, False)
+                engine.place_piece_on_grid()
+                engine.spawn_new_shape()
+            else:
+                swap, placement = choice
+                if swap:
+                    engine.swap_current_and_helper()
+                rotation = placement.profile.rotation
+                self.placement(
+                    engine, rotation, placement.position, placement.lines > 0
+                )
+                apply_placement(engine, placement)
+
+        pieces = 0
+        while not engine.game_over and pieces < config.max_pieces:
+            if isinstance(policy, UndoPlayer):
+                policy.play_piece(engine, place)
+            else:
+                place(policy.choose(engine))
+            pieces += 1
+        self.heatmaps.games += 1
+
+    def play_replay(self, replay: Replay):
+        """Play a replay from its start."""
+        engine = replay.start_engine()
+        for step in replay.step_actions():
+            if step[0] == PLACE:
+                _, rotation, position, clear = step
+                self.placement(engine, rotation, position, clear)
+                play_placement(engine, rotation, position, clear)
+                continue
+            (action,) = step
+            if action == DROP and not engine.game_over:
+                rotation = shape_rotation(
+                    engine.current_shape, engine.current_shape_idx
+                )
+                self.placement(engine, rotation, engine.current_position, False)
+            elif action == CLEAR_ROWS and not engine.game_over:
+                self.rows_cleared(engine)
+            apply_action(engine, action)
+        self.heatmaps.games += 1
+
+
+def _holes(filled: np.ndarray) -> np.ndarray:
+    """Empty cells under a filled cell of their column, of (n, rows, columns) boards."""
+    covered = np.logical_or.accumulate(filled[:, ::-1], axis=1)[:, ::-1]
+    return covered & ~filled
+
+
+def collect_games(seeds: list[int], config: SimulationConfig) -> Heatmaps:
+    """Worker task: the heatmaps of a batch of seeded games."""
+    collector = HeatmapCollector(config.grid_width, config.grid_height)
+    for seed in seeds:
+        collector.play_game(seed, config)
+    collector.flush()
+    return collector.heatmaps
+
+
+def collect_replays(
+    path: str, game_ids: list[str], width: int, height: int
+) -> Heatmaps:
+    """Worker task: the heatmaps of a batch of games of a replay archive."""
+    archive = ReplayArchive(path)
+    collector = HeatmapCollector(width, height)
+    try:
+        for game_id in game_ids:
+            replay = archive.replay(game_id)
+            if replay.board_size != (width, height):
+                collector.heatmaps.skipped += 1
+                continue
+            collector.play_replay(replay)
+    finally:
+        archive.close()
+    collector.flush()
+    return collector.heatmaps
+
+
+def collect(
+    tasks: Iterator[tuple], width: int, height: int, workers: Optional[int] = None
+) -> Heatmaps:
+    """
+    Run the tasks, (function, *arguments) tuples, on a process pool, with only
+    a few of them in flight per worker, and add up their heatmaps.
+    """
+    workers = workers or os.cpu_count() or 1
+    total = Heatmaps.empty(width, height)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        while True:
+            for task in itertools.islice(tasks, workers * 4 - len(pending)):
+                pending.add(executor.submit(*task))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                total.add(future.result())
+    return total
+
+
+def heat_colors(counts: np.ndarray) -> np.ndarray:
+    """RGB image of counts, scaled to the largest one, from black to white."""
+    peak = counts.max()
+    level = counts / peak if peak > 0 else np.zeros(counts.shape)
+    stops = np.linspace(0, 1, len(_HEAT))
+    return np.stack(
+        [np.interp(level, stops, _HEAT[:, channel]) for channel in range(3)], axis=-1
+    ).astype(np.uint8)
+
+
+def landings_image(landings: np.ndarray) -> np.ndarray:
+    """
+    RGB image of the landings of every shape (rows) and rotation (columns),
+    each board on its own scale, with a cell between the boards.
+    """
+    shapes, rotations, height, width = landings.shape
+    image = np.empty((shapes * (height + 1) - 1, rotations * (width + 1) - 1, 3))
+    image[:] = GAP_COLOR
+    for s in range(shapes):
+        for r in range(rotations):
+            top, left = s * (height + 1), r * (width + 1)
+            image[top : top + height, left : left + width] = heat_colors(
+                landings[s, r][::-1]
+            )
+    return image.astype(np.uint8)
+
+
+def save_png(image: np.ndarray, path, cell: int = CELL_PIXELS):
+    """PNG of an image of cells, each `cell` pixels wide."""
+    Image.fromarray(image.repeat(cell, axis=0).repeat(cell, axis=1)).save(path)
+
+
+def batches(items: Iterator, size: int) -> Iterator[list]:
+    while batch := list(itertools.islice(items, size)):
+        yield batch
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="lazyblocks-heatmap",
+        description="Heatmaps of cells, landings, holes and cleared rows of games.",
+    )
+    parser.add_argument("--output", default="heatmaps", help="Output directory")
+    parser.add_argument(
+        "--archive", default=None, help="Replay archive to read instead of playing"
+    )
+    parser.add_argument("--games", type=int, default=1000, help="Number of games")
+    parser.add_argument("--policy", choices=POLICIES, default="greedy")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first game")
+    parser.add_argument("--workers", type=int, default=None, help="Default: all cores")
+    parser.add_argument("--batch-size", type=int, default=20, help="Games per task")
+    parser.add_argument("--max-pieces", type=int, default=1000)
+    parser.add_argument("--lookahead-depth", type=int, default=2)
+    parser.add_argument("--helper-probability", type=float, default=1.0)
+    parser.add_argument("--max-undos", type=int, default=None)
+    parser.add_argument("--board-width", type=int, default=GRID_WIDTH)
+    parser.add_argument("--board-height", type=int, default=GRID_HEIGHT)
+    args = parser.parse_args(argv)
+
+    width, height = args.board_width, args.board_height
+    if args.archive:
+        archive = ReplayArchive(args.archive)
+        game_ids = list(archive)
+        archive.close()
+        tasks = (
+            (collect_replays, args.archive, batch, width, height)
+            for batch in batches(iter(game_ids), args.batch_size)
+        )
+    else:
+        config = SimulationConfig(
+            policy=args.policy,
+            max_pieces=args.max_pieces,
+            lookahead_depth=args.lookahead_depth,
+            helper_piece_probability=args.helper_probability,
+            max_undos=args.max_undos,
+            grid_width=width,
+            grid_height=height,
+        )
+        seeds = iter(range(args.seed, args.seed + args.games))
+        tasks = (
+            (collect_games, batch, config) for batch in batches(seeds, args.batch_size)
+        )
+
+    start = time.perf_counter()
+    heatmaps = collect(tasks, width, height, args.workers)
+    heatmaps.save(args.output)
+    skipped = (
+        f", {heatmaps.skipped} of another size skipped" if heatmaps.skipped else ""
+    )
+    print(
+        f"{heatmaps.games} games, {heatmaps.placements} placements{skipped}"
+        f" in {time.perf_counter() - start:.1f} s, written to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Optional compiled kernels of the placement search, used when Numba is
+installed (`pip install numba`); the pure Python code of `LazyBlocks_ai` is
+used otherwise, with identical results.
+
+The bots spend most of their time enumerating the hard drops of a piece (the
+drop height of every rotation and column, and the rows it completes) and
+computing the board features after each of them (with the completed rows
+cleared). Both are loops over small integer arrays: here they are compiled
+with Numba, over the whole list of placements at once. The engine's own
+moves, collisions and clears stay in Python: a single call of them is cheaper
+than a call into compiled code.
+
+The compiled code is cached next to this file, so only the first run pays for
+the compilation. Set LAZYBLOCKS_JIT=0 to use the Python code anyway.
+"""
+
+import os
+from typing import Optional
+
+try:
+    import numba
+    import numpy as np
+except ImportError:
+    numba = None
+
+ENABLED = numba is not None and os.environ.get("LAZYBLOCKS_JIT", "1") != "0"
+
+# Column masks are int64: the stack and a piece on top of it must fit in them
+MAX_MASK_BITS = 63
+
+# Columns of a placement table, one row per placement. Same layout as the
+# packed placements of `LazyBlocks_batch`.
+PROFILE, LINES, BASE, X = range(4)
+
+
+def _jit(function):
+    return numba.njit(cache=True, nogil=True)(function) if ENABLED else function
+
+
+@_jit
+def _bit_length(mask):
+    length = 0
+    while mask:
+        mask >>= 1
+        length += 1
+    return length
+
+
+@_jit
+def _bit_count(mask):
+    count = 0
+    while mask:
+        mask &= mask - 1
+        count += 1
+    return count
+
+
+@_jit
+def enumerate_kernel(
+    first,
+    last,
+    profile_width,
+    profile_height,
+    profile_bottom,
+    profile_row_cells,
+    heights,
+    row_counts,
+    board_height,
+    out,
+):
+    """
+    Fill `out` with the hard drops of the profiles `first` to `last` - 1, as
+    `enumerate_placements` lists them. Return their number.
+    """
+    board_width = len(heights)
+    n = 0
+    for p in range(first, last):
+        width = profile_width[p]
+        height = profile_height[p]
+        for x in range(board_width - width + 1):
+            base = heights[x] - profile_bottom[p, 0]
+            for c in range(1, width):
+                base = max(base, heights[x + c] - profile_bottom[p, c])
+            if base + height > board_height:
+                continue
+            lines = 0
+            for r in range(height):
+                if row_counts[base + r] + profile_row_cells[p, r] == board_width:
+                    lines += 1
+            out[n, PROFILE] = p
+            out[n, LINES] = lines
+            out[n, BASE] = base
+            out[n, X] = x
+            n += 1
+    return n
+
+
+@_jit
+def features_kernel(
+    table,
+    profile_width,
+    profile_height,
+    profile_bottom,
+    profile_top,
+    profile_gaps,
+    profile_column_bits,
+    profile_row_cells,
+    heights,
+    column_masks,
+    row_counts,
+    holes,
+    out,
+):
+    """
+    Fill `out` with the (aggregate height, holes, bumpiness, completed lines)
+    of the board after each placement of `table`, as `HeuristicEvaluator`
+    computes them.
+    """
+    board_width = len(heights)
+    after = np.empty(board_width, np.int64)
+    masks = np.empty(board_width, np.int64)
+    counts = np.empty(len(row_counts), np.int64)
+    for i in range(len(table)):
+        p = table[i, PROFILE]
+        lines = table[i, LINES]
+        base = table[i, BASE]
+        x = table[i, X]
+        width = profile_width[p]
+        if lines:
+            # Write the piece, clear the full rows from the top, and count
+            masks[:] = column_masks
+            counts[:] = row_counts
+            for c in range(width):
+                masks[x + c] |= profile_column_bits[p, c] << base
+            for r in range(profile_height[p]):
+                counts[base + r] += profile_row_cells[p, r]
+            for y in range(len(counts) - 1, -1, -1):
+                if counts[y] == board_width:
+                    low = (np.int64(1) << y) - 1
+                    for col in range(board_width):
+                        masks[col] = (masks[col] & low) | ((masks[col] >> (y + 1)) << y)
+            after_holes = 0
+            for col in range(board_width):
+                after[col] = _bit_length(masks[col])
+                after_holes += after[col] - _bit_count(masks[col])
+        else:
+            # No row is cleared: only the columns under the piece change
+            after[:] = heights
+            after_holes = holes
+            for c in range(width):
+                col = x + c
+                after_holes += (
+                    base + profile_bottom[p, c] - heights[col] + profile_gaps[p, c]
+                )
+                after[col] = base + profile_top[p, c]
+        aggregate_height = 0
+        bumpiness = 0
+        for col in range(board_width):
+            aggregate_height += after[col]
+            if col:
+                bumpiness += abs(after[col] - after[col - 1])
+        out[i, 0] = aggregate_height
+        out[i, 1] = after_holes
+        out[i, 2] = bumpiness
+        out[i, 3] = lines
+
+
+class PlacementKernels:
+    """The kernels, with the tables of the shape profiles they work on."""
+
+    def __init__(self, shape_profiles: list):
+        self.enabled = True  # Switched off to time the Python code
+        self.profiles = [profile for profiles in shape_profiles for profile in profiles]
+        self.numbers = {id(profile): i for i, profile in enumerate(self.profiles)}
+        # Profiles of each shape: `first[shape]` to `first[shape + 1]` - 1
+        self.first = [0]
+        for profiles in shape_profiles:
+            self.first.append(self.first[-1] + len(profiles))
+        self.max_height = max(profile.height for profile in self.profiles)
+
+        def padded(values, size):
+            return np.array([list(v) + [0] * (size - len(v)) for v in values], np.int64)
+
+        widest = max(profile.width for profile in self.profiles)
+        profiles = self.profiles
+        self.width = np.array([profile.width for profile in profiles], np.int64)
+        self.height = np.array([profile.height for profile in profiles], np.int64)
+        self.bottom = padded([profile.bottom for profile in profiles], widest)
+        self.top = padded([profile.top for profile in profiles], widest)
+        self.gaps = padded([profile.gaps for profile in profiles], widest)
+        self.column_bits = padded([profile.column_bits for profile in profiles], widest)
+        self.row_cells = padded(
+            [profile.row_cells for profile in profiles], self.max_height
+        )
+
+    def usable(self, board) -> bool:
+        """Whether the kernels are on and the board's stack fits in their masks."""
+        return self.enabled and max(board.heights) + self.max_height <= MAX_MASK_BITS
+
+    def placements(self, board, shape_idx: int) -> "np.ndarray":
+        """Table of the placements of a shape, in `enumerate_placements` order."""
+        first, last = self.first[shape_idx], self.first[shape_idx + 1]
+        out = np.empty(((last - first) * board.width, 4), np.int64)
+        n = enumerate_kernel(
+            first,
+            last,
+            self.width,
+            self.height,
+            self.bottom,
+            self.row_cells,
+            np.array(board.heights, np.int64),
+            np.array(board.row_counts, np.int64),
+            board.height,
+            out,
+        )
+        return out[:n]
+
+    def table(self, placements: list) -> "np.ndarray":
+        """Table of a list of `Placement`."""
+        numbers = self.numbers
+        return np.array(
+            [(numbers[id(p.profile)], p.lines, p.base, p.x) for p in placements],
+            np.int64,
+        ).reshape(-1, 4)
+
+    def features(self, board, table: "np.ndarray") -> "np.ndarray":
+        """(n, 4) array of the features after each placement of a table."""
+        out = np.empty((len(table), 4), np.int64)
+        features_kernel(
+            table,
+            self.width,
+            self.height,
+            self.bottom,
+            self.top,
+            self.gaps,
+            self.column_bits,
+            self.row_cells,
+            np.array(board.heights, np.int64),
+            np.array(board.column_masks, np.int64),
+            np.array(board.row_counts, np.int64),
+            board.holes,
+            out,
+        )
+        return out
+
+    def scores(self, features: "np.ndarray", weights) -> "np.ndarray":
+        """Heuristic scores of features, with the operations of `evaluate`."""
+        aggregate_height, holes, bumpiness, lines = features.T
+        return (
+            weights.aggregate_height * aggregate_height
+            + weights.holes * holes
+            + weights.bumpiness * bumpiness
+            + weights.lines * lines
+        )
+
+    def best_placement(
+        self, board, shape_indices: list[int], weights
+    ) -> Optional[tuple[int, list[int]]]:
+        """
+        Highest scoring placement of any of the shapes, the first one on ties:
+        (index of its shape in `shape_indices`, its row of a placement table).
+        None if no shape can be placed.
+        """
+        tables = [self.placements(board, shape_idx) for shape_idx in shape_indices]
+        table = np.concatenate(tables)
+        if not len(table):
+            return None
+        best = int(np.argmax(self.scores(self.features(board, table), weights)))
+        ends = np.cumsum([len(t) for t in tables])
+        return int(np.searchsorted(ends, best, side="right")), table[best].tolist()
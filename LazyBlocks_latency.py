@@ -0,0 +1,203 @@
+"""
+Input latency of the game: from a key press to the frame that first shows its
+effect, per action.
+
+Every key press is timestamped, then followed through the stages it goes
+through:
+
+    key press -> applied to the game (update: the wait for the 10 FPS tick)
+              -> drawn, at the end of the first frame after it (draw)
+    key press -> its sound started (audio)
+
+The latencies go into histograms per action and stage, shown in-game with F3
+and written as JSON with F4. The timestamps are taken when the game sees the
+event, after the window system delivered it, and a frame is counted as shown
+when `on_draw` returns, before the buffer swap.
+"""
+
+import bisect
+import json
+import time
+from typing import Optional
+
+ACTIONS = ["move", "rotate", "drop", "swap", "undo"]
+STAGES = ["total", "update", "draw", "audio"]
+
+# Action of each sound effect of the game
+SOUND_ACTIONS = {"move": "move", "rotate": "rotate", "drop": "drop", "switch": "swap"}
+
+# Bucket upper bounds in milliseconds, 2**(1/2) apart from 0.5 ms to ~1.4 s
+BUCKET_BOUNDS = [0.5 * 2 ** (i / 2) for i in range(24)]
+
+# Key presses that did nothing after this long (e.g. moves into a wall) are
+# dropped rather than kept until a later action completes them
+PENDING_TIMEOUT = 2.0
+
+
+class LatencyHistogram:
+    """Counts of latencies in milliseconds, in fixed logarithmic buckets."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)  # The last one: overflow
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency: float):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Latency below which `q` (0-1) of them are, interpolated in its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = BUCKET_BOUNDS[i - 1] if i else 0.0
+                high = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+                return min(self.max, low + (high - low) * (rank - seen) / count)
+            seen += count
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "max": self.max,
+            "buckets": [
+                [bound, count]
+                for bound, count in zip([*BUCKET_BOUNDS, None], self.counts)
+                if count
+            ],
+        }
+
+
+class InputEvent:
+    __slots__ = ["action", "key", "pressed", "applied", "audio"]
+
+    def __init__(self, action: str, key: int, pressed: float):
+        self.action = action
+        self.key = key
+        self.pressed = pressed
+        self.applied: Optional[float] = None
+        self.audio: Optional[float] = None
+
+
+class LatencyTracker:
+    """
+    Follows the key presses through the game. The game calls `key_pressed`
+    from its key handlers, `applied` where an action changes the game,
+    `sound_started` when its sound starts, and `frame_drawn` at the end of
+    every frame.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.pending: list[InputEvent] = []
+        self.histograms = {
+            action: {stage: LatencyHistogram() for stage in STAGES}
+            for action in ACTIONS
+        }
+        self.frames = LatencyHistogram()  # Time spent in `on_draw`
+        self.ignored = dict.fromkeys(ACTIONS, 0)  # Presses that did nothing
+
+    def key_pressed(self, action: str, key: int):
+        self.pending.append(InputEvent(action, key, self.clock()))
+
+    def applied(self, action: str):
+        """The game state changed for all the pending presses of `action`."""
+        now = self.clock()
+        for event in self.pending:
+            if event.action == action and event.applied is None:
+                event.applied = now
+
+    def sound_started(self, sound: str):
+        """`SoundEngine` listener: the sound of an action started playing."""
+        action = SOUND_ACTIONS.get(sound)
+        now = self.clock()
+        for event in self.pending:
+            if event.action == action and event.audio is None:
+                event.audio = now
+                histogram = self.histograms[action]["audio"]
+                histogram.add((now - event.pressed) * 1e3)
+
+    def key_released(self, key: int):
+        """Forget the presses of `key` that never changed the game."""
+        pending = []
+        for event in self.pending:
+            if event.key == key and event.applied is None:
+                self.ignored[event.action] += 1
+            else:
+                pending.append(event)
+        self.pending = pending
+
+    def frame_drawn(self, frame_start: float):
+        """End of a frame, started at `frame_start`: it shows the applied presses."""
+        now = self.clock()
+        self.frames.add((now - frame_start) * 1e3)
+        if not self.pending:
+            return
+        pending = []
+        for event in self.pending:
+            if event.applied is not None:
+                histograms = self.histograms[event.action]
+                histograms["total"].add((now - event.pressed) * 1e3)
+                histograms["update"].add((event.applied - event.pressed) * 1e3)
+                histograms["draw"].add((now - event.applied) * 1e3)
+            elif now - event.pressed > PENDING_TIMEOUT:
+                self.ignored[event.action] += 1
+            else:
+                pending.append(event)
+        self.pending = pending
+
+    def report_lines(self) -> list[str]:
+        """Median latencies of each action in milliseconds, for the overlay."""
+        lines = [
+            "Input latency in ms (F4: export)",
+            f"{'':<7}{'n':>5} {'p50':>6} / {'p95':<6}"
+            f"{'update':>8}{'draw':>8}{'audio':>8}",
+        ]
+        for action, histograms in self.histograms.items():
+            total = histograms["total"]
+            if not total.count:
+                continue
+            lines.append(
+                f"{action:<7}{total.count:>5} {total.percentile(0.5):>6.0f}"
+                f" / {total.percentile(0.95):<6.0f}"
+                + "".join(
+                    f"{histograms[stage].percentile(0.5):>8.0f}"
+                    for stage in ["update", "draw", "audio"]
+                )
+            )
+        lines.append(
+            f"frame  {self.frames.count:>5} {self.frames.percentile(0.5):>6.1f}"
+            f" / {self.frames.percentile(0.95):<6.1f}"
+        )
+        return lines
+
+    def to_dict(self) -> dict:
+        return {
+            "actions": {
+                action: {
+                    stage: histogram.to_dict()
+                    for stage, histogram in histograms.items()
+                }
+                for action, histograms in self.histograms.items()
+            },
+            "frames": self.frames.to_dict(),
+            "ignored": self.ignored,
+        }
+
+    def export(self, path: str):
+        with open(path, "w") as report:
+            json.dump(self.to_dict(), report, indent=2)
@@ -0,0 +1,254 @@
+"""
+Opt-in memory monitor for long sessions (e.g. kiosks): allocation sampling
+with `tracemalloc`, and the RSS trend of the process with `psutil`.
+
+    python LazyBlocks.py --track-memory memory.json
+
+Every frame, the monitor records how much the frame allocated at its peak and
+how much it kept. Every `interval` seconds it takes a sample: the RSS, the
+traced memory, the traced memory per subsystem (by the module that allocated
+it), and the allocation sites that grew the most since the first sample. When
+the RSS or the traced memory grows steadily over the last samples, it prints
+a warning with the top growing sites. The report is written as JSON on exit.
+
+Tracing every allocation slows Python down noticeably; keep it off unless
+looking for a leak.
+"""
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import psutil
+
+SAMPLE_INTERVAL = 10.0  # Seconds between two samples
+HISTORY_SAMPLES = 360  # One hour at the default interval
+TOP_SITES = 10
+TRACEBACK_DEPTH = 1
+
+# Growth over the last GROWTH_WINDOW samples is flagged when it is faster than
+# GROWTH_THRESHOLD bytes per hour and close to a straight line (steady, rather
+# than a one-off allocation or a garbage collection sawtooth)
+GROWTH_WINDOW = 30
+GROWTH_THRESHOLD = 1 << 20
+GROWTH_MIN_R2 = 0.8
+
+# Subsystem of the LazyBlocks modules, by module name
+MODULE_SUBSYSTEMS = {
+    "LazyBlocks": "game",
+    "LazyBlocks_pyglet": "game",
+    "LazyBlocks_engine": "engine",
+    "LazyBlocks_ai": "engine",
+    "LazyBlocks_search": "engine",
+    "LazyBlocks_kernels": "engine",
+    "LazyBlocks_camera": "render",
+    "LazyBlocks_sound": "sound",
+    "LazyBlocks_scores": "scores",
+    "LazyBlocks_snapshot": "saves",
+    "LazyBlocks_replay": "saves",
+    "LazyBlocks_heatmap": "render",
+    "LazyBlocks_feed": "network",
+    "LazyBlocks_server": "network",
+    "LazyBlocks_sessions": "network",
+    "LazyBlocks_latency": "monitoring",
+    "LazyBlocks_memory": "monitoring",
+}
+
+_IGNORED_TRACES = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def subsystem(filename: str) -> str:
+    """Subsystem of the code in a source file."""
+    module = os.path.splitext(os.path.basename(filename))[0]
+    if module in MODULE_SUBSYSTEMS:
+        return MODULE_SUBSYSTEMS[module]
+    parts = filename.replace("\\", "/").split("/")
+    if "pandas" in parts:
+        return "scores"
+    if "media" in parts or module == "sound" and "arcade" in parts:
+        return "sound"
+    if "pyglet" in parts or "arcade" in parts or "PIL" in parts:
+        return "render"
+    if "asyncio" in parts:
+        return "network"
+    return "other"
+
+
+def trend(times: list[float], values: list[float]) -> tuple[float, float]:
+    """Least squares slope of the values per second, and its R²."""
+    n = len(times)
+    mean_t = sum(times) / n
+    mean_v = sum(values) / n
+    var_t = sum((t - mean_t) ** 2 for t in times)
+    var_v = sum((v - mean_v) ** 2 for v in values)
+    if not var_t or not var_v:
+        return 0.0, 0.0
+    cov = sum((t - mean_t) * (v - mean_v) for t, v in zip(times, values))
+    return cov / var_t, cov * cov / (var_t * var_v)
+
+
+@dataclass
+class AllocationSite:
+    site: str  # file:line
+    size: int  # Bytes allocated there and still alive
+    count: int
+    size_diff: int  # Since the first sample
+    count_diff: int
+
+
+@dataclass
+class MemorySample:
+    time: float  # Seconds since the monitor started
+    rss: int
+    traced: int
+    frames: int  # Frames since the previous sample
+    frame_peak: int  # Largest transient allocation of a frame, in bytes
+    frame_kept: float  # Mean growth of the traced memory per frame
+    subsystems: dict[str, int]
+
+
+class MemoryMonitor:
+    """
+    Tracks the memory of the process. The game calls `frame` at the end of
+    every frame and `sample` every `interval` seconds.
+    """
+
+    def __init__(
+        self,
+        interval: float = SAMPLE_INTERVAL,
+        top: int = TOP_SITES,
+        history: int = HISTORY_SAMPLES,
+    ):
+        self.interval = interval
+        self.top = top
+        self.samples: deque[MemorySample] = deque(maxlen=history)
+        self.process = psutil.Process()
+        self.first_snapshot: Optional[tracemalloc.Snapshot] = None
+        self.top_sites: list[AllocationSite] = []
+        self.growing: dict[str, float] = {}  # Flagged series: bytes per hour
+        self.started = 0.0
+        self.frame_start = None  # Traced memory at the end of the previous frame
+        self.reset_frames()
+
+    def reset_frames(self):
+        self.frames = 0
+        self.frame_peak = 0
+        self.frames_start = self.frame_start  # Same, at the previous sample
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEBACK_DEPTH)
+        self.started = time.monotonic()
+        self.sample()
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def frame(self):
+        """End of a frame: record what it allocated."""
+        current, peak = tracemalloc.get_traced_memory()
+        if self.frame_start is None:
+            self.frames_start = current
+        else:
+            self.frames += 1
+            self.frame_peak = max(self.frame_peak, peak - self.frame_start)
+        self.frame_start = current
+        tracemalloc.reset_peak()
+
+    def sample(self):
+        """Take a sample, and check the trend of the memory."""
+        snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED_TRACES)
+        subsystems = {}
+        for stat in snapshot.statistics("filename"):
+            name = subsystem(stat.traceback[0].filename)
+            subsystems[name] = subsystems.get(name, 0) + stat.size
+        if self.first_snapshot is None:
+            self.first_snapshot = snapshot
+        self.top_sites = [
+            AllocationSite(
+                site=f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                size=stat.size,
+                count=stat.count,
+                size_diff=stat.size_diff,
+                count_diff=stat.count_diff,
+            )
+            for stat in snapshot.compare_to(self.first_snapshot, "lineno")[: self.top]
+        ]
+
+        traced = tracemalloc.get_traced_memory()[0]
+        frames_kept = 0.0
+        if self.frames and self.frames_start is not None:
+            frames_kept = (self.frame_start - self.frames_start) / self.frames
+        self.samples.append(
+            MemorySample(
+                time=time.monotonic() - self.started,
+                rss=self.process.memory_info().rss,
+                traced=traced,
+                frames=self.frames,
+                frame_peak=self.frame_peak,
+                frame_kept=frames_kept,
+                subsystems=subsystems,
+            )
+        )
+        self.reset_frames()
+        self.check_growth()
+
+    def check_growth(self):
+        """Flag the RSS or traced memory when it grows steadily."""
+        window = list(self.samples)[-GROWTH_WINDOW:]
+        if len(window) < GROWTH_WINDOW:
+            return
+        times = [sample.time for sample in window]
+        for series in ["rss", "traced"]:
+            slope, r2 = trend(times, [getattr(sample, series) for sample in window])
+            per_hour = slope * 3600
+            if per_hour > GROWTH_THRESHOLD and r2 >= GROWTH_MIN_R2:
+                if series not in self.growing:
+                    self.warn(series, per_hour)
+                self.growing[series] = per_hour
+            else:
+                self.growing.pop(series, None)
+
+    def warn(self, series: str, per_hour: float):
+        minutes = (self.samples[-1].time - self.samples[-GROWTH_WINDOW].time) / 60
+        print(
+            f"Memory: {series} growing {per_hour / 2**20:.1f} MB/h"
+            f" over the last {minutes:.0f} min. Top growing sites:",
+            file=sys.stderr,
+        )
+        for site in self.top_sites[:5]:
+            print(
+                f"  {site.size_diff / 1024:+10.1f} KB {site.count_diff:+8}"
+                f" blocks  {site.site}",
+                file=sys.stderr,
+            )
+
+    def report(self) -> dict:
+        samples = list(self.samples)
+        report = {
+            "samples": [asdict(sample) for sample in samples],
+            "top_sites": [asdict(site) for site in self.top_sites],
+            "growing": self.growing,
+        }
+        if len(samples) >= 2:
+            times = [sample.time for sample in samples]
+            for series in ["rss", "traced"]:
+                slope, r2 = trend(
+                    times, [getattr(sample, series) for sample in samples]
+                )
+                report[f"{series}_trend"] = {"bytes_per_hour": slope * 3600, "r2": r2}
+        return report
+
+    def export(self, path: str):
+        with open(path, "w") as report:
+            json.dump(self.report(), report, indent=2)
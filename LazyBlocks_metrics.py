@@ -0,0 +1,210 @@
+"""
+Game and runtime metrics, served in the OpenMetrics text format for local
+scrapers (e.g. Prometheus or a kiosk monitoring agent):
+
+    python LazyBlocks.py --metrics 127.0.0.1:9464
+    curl http://127.0.0.1:9464/metrics
+
+The game updates the counters and histograms of `GameMetrics` in its hot paths
+with plain increments: only the game thread writes them, and the HTTP thread
+only reads them, so no lock is taken. A scrape may see a histogram between the
+update of its sum and of its count, which is off by one observation at most.
+The RSS and CPU time of the process are read with `psutil` at scrape time.
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import psutil
+
+METRICS_ADDRESS = "127.0.0.1:9464"
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Bucket upper bounds in seconds
+FRAME_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0]
+SCORE_WRITE_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0]
+
+# A frame is dropped when the draws are further apart than this many intervals
+DROPPED_FRAME_FACTOR = 1.5
+
+
+class Histogram:
+    """Observations counted in fixed buckets, as an OpenMetrics histogram."""
+
+    def __init__(self, buckets: list[float]):
+        self.bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one: +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def lines(self, name: str) -> list[str]:
+        counts = list(self.counts)
+        lines = []
+        cumulative = 0
+        for bound, count in zip([*self.bounds, "+Inf"], counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_count {cumulative}")
+        lines.append(f"{name}_sum {self.sum}")
+        return lines
+
+
+class GameMetrics:
+    """Counters of a game view, updated by the game and read by the server."""
+
+    def __init__(self, frame_interval: float = 1 / 60):
+        self.frame_interval = frame_interval  # Expected time between two draws
+        self.frame_seconds = Histogram(FRAME_BUCKETS)
+        self.update_seconds = Histogram(FRAME_BUCKETS)
+        self.score_write_seconds = Histogram(SCORE_WRITE_BUCKETS)
+        self.dropped_frames = 0
+        self.placements = 0
+        self.lines_cleared = 0
+        self.undos = 0
+        self.swaps = 0
+        self.queue_depth = 0  # Remote actions taken at the last poll
+        self.recent_placements: deque[float] = deque()  # Times, last minute
+        self.last_frame_start: Optional[float] = None
+
+    def frame_done(self, frame_start: float):
+        """End of a draw started at `frame_start` (a `time.perf_counter` time)."""
+        self.frame_seconds.observe(time.perf_counter() - frame_start)
+        if self.last_frame_start is not None:
+            gap = frame_start - self.last_frame_start
+            if gap > self.frame_interval * DROPPED_FRAME_FACTOR:
+                self.dropped_frames += round(gap / self.frame_interval) - 1
+        self.last_frame_start = frame_start
+
+    def update_done(self, update_start: float):
+        self.update_seconds.observe(time.perf_counter() - update_start)
+
+    def placed(self):
+        self.placements += 1
+        now = time.monotonic()
+        recent = self.recent_placements
+        recent.append(now)
+        while recent[0] < now - 60:
+            recent.popleft()
+
+    def placements_per_minute(self) -> int:
+        minute_ago = time.monotonic() - 60
+        return sum(placed >= minute_ago for placed in list(self.recent_placements))
+
+    def exposition(self, process: psutil.Process, score: int = 0) -> str:
+        """All the metrics, in the OpenMetrics text format."""
+        lines = []
+
+        def metric(name: str, kind: str, description: str, samples: list[str]):
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"# HELP {name} {description}")
+            lines.extend(samples)
+
+        def counter(name: str, description: str, value: float):
+            metric(name, "counter", description, [f"{name}_total {value}"])
+
+        def gauge(name: str, description: str, value: float):
+            metric(name, "gauge", description, [f"{name} {value}"])
+
+        prefix = "lazyblocks"
+        metric(
+            f"{prefix}_frame_seconds",
+            "histogram",
+            "Time to draw a frame.",
+            self.frame_seconds.lines(f"{prefix}_frame_seconds"),
+        )
+        metric(
+            f"{prefix}_update_seconds",
+            "histogram",
+            "Time of a game update.",
+            self.update_seconds.lines(f"{prefix}_update_seconds"),
+        )
+        metric(
+            f"{prefix}_score_write_seconds",
+            "histogram",
+            "Time to store a score.",
+            self.score_write_seconds.lines(f"{prefix}_score_write_seconds"),
+        )
+        counter(f"{prefix}_dropped_frames", "Frames drawn late.", self.dropped_frames)
+        counter(f"{prefix}_placements", "Pieces placed.", self.placements)
+        gauge(
+            f"{prefix}_placements_per_minute",
+            "Pieces placed in the last minute.",
+            self.placements_per_minute(),
+        )
+        counter(f"{prefix}_lines_cleared", "Rows cleared.", self.lines_cleared)
+        counter(f"{prefix}_undos", "Moves undone.", self.undos)
+        counter(f"{prefix}_swaps", "Swaps with the helper piece.", self.swaps)
+        gauge(
+            f"{prefix}_queue_depth",
+            "Remote actions waiting at the last poll.",
+            self.queue_depth,
+        )
+        gauge(f"{prefix}_score", "Score of the current game.", score)
+
+        memory = process.memory_info()
+        cpu = process.cpu_times()
+        gauge(
+            "process_resident_memory_bytes", "Resident set size in bytes.", memory.rss
+        )
+        counter(
+            "process_cpu_seconds",
+            "User and system CPU time in seconds.",
+            cpu.user + cpu.system,
+        )
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """HTTP server of the metrics of a game, on a daemon thread."""
+
+    def __init__(self, metrics: GameMetrics, engine=None, address=METRICS_ADDRESS):
+        host, _, port = address.rpartition(":")
+        self.metrics = metrics
+        self.engine = engine  # For the score
+        self.process = psutil.Process()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = server.exposition().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # No line per scrape on the console
+
+        self.httpd = ThreadingHTTPServer((host or "127.0.0.1", int(port)), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name="metrics", daemon=True
+        )
+
+    @property
+    def address(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"{host}:{port}"
+
+    def exposition(self) -> str:
+        score = self.engine.score if self.engine is not None else 0
+        return self.metrics.exposition(self.process, score)
+
+    def start(self):
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,495 @@
+"""
+Software rendering of game frames to RGB NumPy images, and export of bot games
+to GIF, video or PNG frames. Needs no window and no GL context, so clips and
+thumbnails can be made on headless machines.
+
+Frames follow the layout of `LazyBlocks.on_draw`: the grid and the current
+piece, the next and helper pieces on the right, and the score bar at the top.
+Cells are drawn by indexing pre-rendered cell tiles with the palette bytes of
+the grid, one NumPy gather per frame, so a full 800 x 800 frame takes about a
+millisecond.
+
+Usage:
+    lazyblocks-render --seed 3 --policy greedy --max-pieces 300 --output game.gif
+    lazyblocks-render --seed 3 --output thumbnail.png --scale 4
+"""
+
+import argparse
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+from PIL import GifImagePlugin, Image, ImageDraw, ImageFont
+
+from LazyBlocks_camera import BoardCamera
+from LazyBlocks_engine import (
+    EMPTY_CELL_COLOR,
+    GRID_HEIGHT,
+    GRID_SIZE,
+    GRID_WIDTH,
+    PIECE_COLORS,
+    LazyBlocksEngine,
+)
+from LazyBlocks_sim import POLICIES, SimulationConfig, make_policy, new_game
+
+# Layout of `LazyBlocks.on_draw`
+SCREEN_WIDTH = 800
+SCREEN_HEIGHT = 800
+TINY_GRID_SIZE = 20
+PREVIEW_CELLS = 4  # Cells per side of the next and helper piece windows
+PREVIEW_LEFT = SCREEN_WIDTH - PREVIEW_CELLS * TINY_GRID_SIZE - 20
+STATUS_BAR_HEIGHT = GRID_SIZE * 2
+NEXT_PIECE_BOTTOM = (
+    SCREEN_HEIGHT - PREVIEW_CELLS * TINY_GRID_SIZE - 20 - STATUS_BAR_HEIGHT
+)
+HELPER_PIECE_BOTTOM = SCREEN_HEIGHT - PREVIEW_CELLS * TINY_GRID_SIZE - 200
+SCORE_LEFT = 10
+SCORE_BASELINE = SCREEN_HEIGHT - STATUS_BAR_HEIGHT // 2
+SCORE_FONT_SIZE = 20
+
+# RGB, same values as the arcade colors of the front-ends
+BACKGROUND_COLOR = (102, 102, 153)  # arcade.color.DARK_BLUE_GRAY
+BORDER_COLOR = (255, 255, 255)
+PREVIEW_BORDER_COLOR = (0, 0, 0)
+HINT_COLOR = (255, 255, 255)
+HINT_WIDTH = 3
+STATUS_BAR_COLOR = (0, 0, 0)
+SCORE_COLOR = (255, 255, 255)
+GAME_OVER_COLOR = (255, 0, 0)
+
+# Frames rendered ahead of the writer before the renderer waits for it
+MAX_PENDING_FRAMES = 32
+
+# Shades between the status bar and the text colors, for the anti-aliased text
+TEXT_SHADES = 32
+
+
+def cell_tiles(palette: list, size: int, border: tuple) -> np.ndarray:
+    """(colors, size, size, 3) array: a filled cell of each color, outlined."""
+    tiles = np.empty((len(palette), size, size, 3), dtype=np.uint8)
+    tiles[:] = np.array([color[:3] for color in palette], dtype=np.uint8)[
+        :, None, None, :
+    ]
+    tiles[:, [0, -1], :] = border
+    tiles[:, :, [0, -1]] = border
+    return tiles
+
+
+def expand_cells(cells: np.ndarray, tiles: np.ndarray) -> np.ndarray:
+    """
+    Image of a (rows, columns) array of palette bytes, bottom row first: each
+    cell becomes its tile.
+    """
+    rows, columns = cells.shape
+    size = tiles.shape[1]
+    blocks = tiles[cells[::-1]]  # (rows, columns, size, size, 3), top row first
+    return blocks.transpose(0, 2, 1, 3, 4).reshape(rows * size, columns * size, 3)
+
+
+def outline(
+    frame: np.ndarray, left: int, top: int, size: int, color: tuple, width: int = 1
+):
+    """Draw a square outline, `left` and `top` in image coordinates."""
+    frame[top : top + width, left : left + size] = color
+    frame[top + size - width : top + size, left : left + size] = color
+    frame[top : top + size, left : left + width] = color
+    frame[top : top + size, left + size - width : left + size] = color
+
+
+@lru_cache(maxsize=1)
+def score_font() -> ImageFont.ImageFont:
+    try:
+        return ImageFont.load_default(size=SCORE_FONT_SIZE)
+    except TypeError:  # Pillow < 10.1, bitmap font only
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=256)
+def status_bar(text: str, color: tuple, width: int) -> np.ndarray:
+    """Score bar image with its text. Cached: the score rarely changes."""
+    image = Image.new("RGB", (width, STATUS_BAR_HEIGHT), STATUS_BAR_COLOR)
+    ImageDraw.Draw(image).text(
+        (SCORE_LEFT, SCREEN_HEIGHT - SCORE_BASELINE),
+        text,
+        fill=color,
+        font=score_font(),
+        anchor="ls",
+    )
+    return np.asarray(image)
+
+
+class FrameRenderer:
+    """
+    Renders engines to (height, width, 3) uint8 RGB frames.
+
+    The static parts of the frame (background, preview windows) are drawn
+    once; a frame is a copy of them with the board, pieces and score drawn
+    over. Like the game view, the renderer keeps a camera that scrolls to
+    follow the current piece and the top of the stack on tall boards, so
+    render the frames of a game in order with the same renderer.
+    """
+
+    def __init__(self, width: int = SCREEN_WIDTH, height: int = SCREEN_HEIGHT):
+        self.width = width
+        self.height = height
+        self.background = np.empty((height, width, 3), dtype=np.uint8)
+        self.background[:] = BACKGROUND_COLOR
+        for bottom in (NEXT_PIECE_BOTTOM, HELPER_PIECE_BOTTOM):
+            top = height - bottom - PREVIEW_CELLS * TINY_GRID_SIZE
+            for y in range(PREVIEW_CELLS):
+                for x in range(PREVIEW_CELLS):
+                    outline(
+                        self.background,
+                        PREVIEW_LEFT + x * TINY_GRID_SIZE,
+                        top + y * TINY_GRID_SIZE,
+                        TINY_GRID_SIZE,
+                        PREVIEW_BORDER_COLOR,
+                    )
+        self.board_size: Optional[tuple[int, int]] = None
+        self.camera: Optional[BoardCamera] = None
+        self.palette: Optional[list] = None
+        self.tiles = self.tiny_tiles = np.empty((0, 1, 1, 3), dtype=np.uint8)
+
+    def _prepare(self, engine: LazyBlocksEngine):
+        """Camera and tiles for the engine's board size and colors."""
+        board_size = (engine.grid_width, engine.grid_height)
+        if board_size != self.board_size:
+            self.board_size = board_size
+            self.camera = BoardCamera(*board_size)
+            self.palette = None
+        camera = self.camera
+        palette = engine.palette
+        if palette != self.palette:
+            self.palette = palette
+            self.tiles = cell_tiles(palette, camera.cell_size, BORDER_COLOR)
+            self.tiny_tiles = cell_tiles(palette, TINY_GRID_SIZE, PREVIEW_BORDER_COLOR)
+
+    def render(self, engine: LazyBlocksEngine, hint=None) -> np.ndarray:
+        """
+        Frame of the engine's state, with the outline of a hint (a
+        `LazyBlocks_search` plan) if given.
+        """
+        self._prepare(engine)
+        frame = self.background.copy()
+        camera = self.camera
+
+        # Board, with the current piece written into the cells on screen
+        shape = engine.current_shape
+        if shape:
+            top = engine.current_position[1]
+            camera.follow(top - len(shape) + 1, top, engine.stack_height)
+        bottom = camera.bottom
+        cells = np.frombuffer(
+            engine.grid.cells(bottom, bottom + camera.visible_rows), dtype=np.uint8
+        ).reshape(camera.visible_rows, engine.grid_width)
+        if shape:
+            cells = cells.copy()
+            left, top = engine.current_position
+            for y, row in enumerate(shape):
+                if camera.is_visible(top - y):
+                    for x, cell in enumerate(row):
+                        if cell:
+                            cells[top - y - bottom, left + x] = (
+                                engine.current_shape_idx + 1
+                            )
+        board = expand_cells(cells, self.tiles)
+        frame[self.height - board.shape[0] :, : board.shape[1]] = board
+
+        if hint is not None:
+            hint_x, hint_y = hint.placement.position
+            for y, row in enumerate(hint.placement.profile.shape):
+                for x, cell in enumerate(row):
+                    if cell and camera.is_visible(hint_y - y):
+                        screen_x, screen_y = camera.to_screen(hint_x + x, hint_y - y)
+                        outline(
+                            frame,
+                            screen_x,
+                            self.height - screen_y - camera.cell_size,
+                            camera.cell_size,
+                            HINT_COLOR,
+                            HINT_WIDTH,
+                        )
+
+        # Next and helper pieces, aligned on the bottom of their windows
+        for bottom, shape_idx, shape in (
+            (NEXT_PIECE_BOTTOM, engine.next_shape_idx, engine.next_shape),
+            (HELPER_PIECE_BOTTOM, engine.helper_piece_idx, engine.helper_piece_shape),
+        ):
+            if shape:
+                filled = np.array(shape, dtype=bool)  # Top row first
+                piece = expand_cells(
+                    filled[::-1] * np.uint8(shape_idx + 1), self.tiny_tiles
+                )
+                mask = filled.repeat(TINY_GRID_SIZE, 0).repeat(TINY_GRID_SIZE, 1)
+                window = frame[
+                    self.height - bottom - piece.shape[0] : self.height - bottom,
+                    PREVIEW_LEFT : PREVIEW_LEFT + piece.shape[1],
+                ]
+                window[mask] = piece[mask]
+
+        if engine.game_over:
+            text, color = f"Game Over! Final Score: {engine.score}", GAME_OVER_COLOR
+        else:
+            text, color = f"Score: {engine.score}", SCORE_COLOR
+        frame[:STATUS_BAR_HEIGHT] = status_bar(text, color, self.width)
+        return frame
+
+
+def thumbnail(frame: np.ndarray, scale: int) -> np.ndarray:
+    """Frame shrunk `scale` times, keeping one pixel in `scale` each way."""
+    return np.ascontiguousarray(frame[::scale, ::scale]) if scale > 1 else frame
+
+
+def gif_palette() -> Image.Image:
+    """
+    Palette image of every color the renderer draws: the cells, the frame, and
+    the shades of the anti-aliased score text.
+    """
+    colors = [color[:3] for color in (EMPTY_CELL_COLOR, *PIECE_COLORS)]
+    colors += [
+        BACKGROUND_COLOR,
+        BORDER_COLOR,
+        PREVIEW_BORDER_COLOR,
+        HINT_COLOR,
+        STATUS_BAR_COLOR,
+    ]
+    background = np.array(STATUS_BAR_COLOR, float)
+    for text_color in (SCORE_COLOR, GAME_OVER_COLOR):
+        for level in np.linspace(0, 1, TEXT_SHADES):
+            shade = background + level * (np.array(text_color) - background)
+            colors.append(tuple(int(c) for c in np.rint(shade)))
+    colors = list(dict.fromkeys(colors))
+    palette = Image.new("P", (1, 1))
+    palette.putpalette([c for color in colors for c in color])
+    return palette
+
+
+class GifWriter:
+    """
+    Animated GIF, with PIL. Every frame is mapped to the fixed palette of the
+    renderer's colors (see `gif_palette`) and written as it comes, so memory
+    does not grow with the clip length.
+    """
+
+    def __init__(self, path: str, fps: float):
+        self.duration = round(1000 / fps)
+        self.palette = gif_palette()
+        self.file = open(path, "wb")
+        self.frames = 0
+
+    def write(self, frame: np.ndarray):
+        image = Image.fromarray(frame).quantize(
+            palette=self.palette, dither=Image.Dither.NONE
+        )
+        if not self.frames:
+            header, _ = GifImagePlugin.getheader(
+                image, None, {"loop": 0, "duration": self.duration}
+            )
+            self.file.write(b"".join(header))
+        for data in GifImagePlugin.getdata(image, duration=self.duration):
+            self.file.write(data)
+        self.frames += 1
+
+    def close(self):
+        self.file.write(b";")  # Trailer
+        self.file.close()
+
+
+class PngSequenceWriter:
+    """Numbered PNG files in a directory, or one PNG of the last frame."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.single = self.path.suffix.lower() == ".png"
+        if not self.single:
+            self.path.mkdir(parents=True, exist_ok=True)
+        self.count = 0
+        self.last: Optional[np.ndarray] = None
+
+    def write(self, frame: np.ndarray):
+        if self.single:
+            self.last = frame
+        else:
+            Image.fromarray(frame).save(
+                self.path / f"frame_{self.count:06d}.png", compress_level=1
+            )
+        self.count += 1
+
+    def close(self):
+        if self.single and self.last is not None:
+            Image.fromarray(self.last).save(self.path)
+
+
+class FfmpegWriter:
+    """Any video format ffmpeg knows, from raw frames piped to it."""
+
+    def __init__(self, path: str, fps: float, width: int, height: int):
+        executable = shutil.which("ffmpeg")
+        if executable is None:
+            raise RuntimeError(f"ffmpeg is needed to write {path}")
+        self.process = subprocess.Popen(
+            [
+                executable,
+                "-loglevel",
+                "error",
+                "-y",
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "rgb24",
+                "-s",
+                f"{width}x{height}",
+                "-r",
+                str(fps),
+                "-i",
+                "-",
+                # Even sizes, as most codecs need
+                "-vf",
+                "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+                "-pix_fmt",
+                "yuv420p",
+                path,
+            ],
+            stdin=subprocess.PIPE,
+        )
+
+    def write(self, frame: np.ndarray):
+        self.process.stdin.write(frame.tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait():
+            raise RuntimeError(f"ffmpeg failed with code {self.process.returncode}")
+
+
+def open_writer(path: str, fps: float, width: int, height: int):
+    """
+    Writer for the format of the path: .gif, .png, a directory, or a video. GIFs
+    are always written by `GifWriter`, with the renderer's palette, whether
+    ffmpeg is installed or not.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == ".gif":
+        return GifWriter(path, fps)
+    if suffix in ("", ".png"):
+        return PngSequenceWriter(path)
+    return FfmpegWriter(path, fps, width, height)
+
+
+def write_frames(
+    frames: Iterable[np.ndarray], writer, max_pending: int = MAX_PENDING_FRAMES
+) -> int:
+    """
+    Write frames with a writer thread, so that rendering and encoding overlap.
+    The queue between them is bounded: rendering waits when the writer falls
+    `max_pending` frames behind, so memory stays flat for any clip length.
+    Return the number of frames written.
+    """
+    pending: queue.Queue = queue.Queue(maxsize=max_pending)
+    errors: list[BaseException] = []
+
+    def consume():
+        try:
+            while (frame := pending.get()) is not None:
+                writer.write(frame)
+            writer.close()
+        except BaseException as error:
+            errors.append(error)
+            # Keep draining, so that the renderer never blocks on a full queue
+            while pending.get() is not None:
+                pass
+
+    thread = threading.Thread(target=consume, name="frame-writer", daemon=True)
+    thread.start()
+    count = 0
+    try:
+        for frame in frames:
+            pending.put(frame)
+            count += 1
+            if errors:
+                break
+    finally:
+        pending.put(None)
+        thread.join()
+    if errors:
+        raise errors[0]
+    return count
+
+
+def game_frames(
+    seed: int,
+    config: SimulationConfig,
+    renderer: Optional[FrameRenderer] = None,
+    scale: int = 1,
+) -> Iterator[np.ndarray]:
+    """
+    Frames of the bot game `lazyblocks-sim` plays for a seed and config: one
+    per piece, as it spawns, then the final position.
+    """
+    renderer = renderer or FrameRenderer()
+    engine = new_game(seed, config)
+    policy = make_policy(config.policy, seed, config.lookahead_depth)
+    for _ in range(config.max_pieces):
+        if engine.game_over:
+            break
+        yield thumbnail(renderer.render(engine), scale)
+        policy.play_piece(engine)
+    yield thumbnail(renderer.render(engine), scale)
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="lazyblocks-render",
+        description="Render a seeded bot game to a GIF, a video or PNG frames.",
+    )
+    parser.add_argument(
+        "--output",
+        required=True,
+        help="A .gif, a video (.mp4, .webm... with ffmpeg), a .png of the last"
+        " frame, or a directory for PNG frames",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--policy", choices=POLICIES, default="greedy")
+    parser.add_argument("--max-pieces", type=int, default=200)
+    parser.add_argument("--lookahead-depth", type=int, default=2)
+    parser.add_argument("--helper-probability", type=float, default=1.0)
+    parser.add_argument("--board-width", type=int, default=GRID_WIDTH)
+    parser.add_argument("--board-height", type=int, default=GRID_HEIGHT)
+    parser.add_argument(
+        "--start", default=None, help="Snapshot or autosave file to start from"
+    )
+    parser.add_argument("--fps", type=float, default=10.0, help="Pieces per second")
+    parser.add_argument(
+        "--scale", type=int, default=1, help="Shrink the frames this many times"
+    )
+    args = parser.parse_args(argv)
+
+    config = SimulationConfig(
+        policy=args.policy,
+        max_pieces=args.max_pieces,
+        lookahead_depth=args.lookahead_depth,
+        helper_piece_probability=args.helper_probability,
+        grid_width=args.board_width,
+        grid_height=args.board_height,
+        start=args.start,
+    )
+    renderer = FrameRenderer()
+    size = thumbnail(renderer.background, args.scale).shape
+    writer = open_writer(args.output, args.fps, size[1], size[0])
+    start = time.perf_counter()
+    count = write_frames(game_frames(args.seed, config, renderer, args.scale), writer)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{count} frames written to {args.output} in {elapsed:.2f} s"
+        f" ({count / elapsed:.0f} frames/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,602 @@
+"""
+Replays of games with keyframes, for random access, and archives of many
+replays with an index by game id.
+
+A replay is the starting position of a game (a full snapshot) and the steps
+played from it: the actions of the keyboard controls (see `LazyBlocks_feed`),
+and the placements of the bots. Every `KEYFRAME_INTERVAL` steps, a keyframe
+saves the state of the game, so that going to step N loads the keyframe before
+it and plays at most `KEYFRAME_INTERVAL` - 1 steps, wherever N is in the game.
+
+Keyframes are snapshot records without the random generator, which is most of
+a full snapshot: a keyframe stores how many words the game drew from the
+generator instead, and the generator of the start is fast-forwarded by that
+many words on load (in C, about 40 microseconds per thousand pieces). For the
+same reason, the replay of a seeded game stores the seed, and its start
+snapshot leaves the generator out too. Every `FULL_KEYFRAMES`-th keyframe is a
+full record, the others are delta records with the rows and undo entries that
+changed since the keyframe before, so loading a keyframe decodes at most
+`FULL_KEYFRAMES` records.
+
+Format of a replay (little-endian):
+    header      magic "LZBR", version, size of the start snapshot, seeded flag,
+                seed, words drawn from the generator since the seed
+    start       full snapshot of the starting position, with the game id in
+                its front-end bytes (without the generator if seeded)
+    steps       an action byte each, or `PLACE`, the rotation (+ 4 if the
+                completed rows are cleared) and the position (int16) of the
+                placed piece
+    keyframes   snapshot records, each prefixed by its size
+    index       for each keyframe: its step, the offset of that step, the words
+                drawn from the generator (since the seed, or the start), the
+                offset of its record
+    footer      offset and size of the steps, number of steps, offset of the
+                index, number of keyframes, magic "LZBR"
+
+An archive packs replays compressed one by one with zlib, so that a game is
+read without touching the others, and ends with an open addressing hash table
+of the game ids: finding a game reads one or two slots of the table, through
+a memory map, whatever the number of games.
+
+Format of an archive:
+    header      magic "LZBA", version
+    blocks      for each game: size of the game id, size of the compressed
+                replay, the game id (UTF-8), the compressed replay
+    table       slots of (64-bit hash of the game id, offset of its block),
+                offset 0 for an empty slot
+    footer      offset of the table, number of slots, number of games, magic
+                "LZBA"
+
+Usage:
+    lazyblocks-replay record games.lzba --games 1000 --policy greedy
+    lazyblocks-replay list games.lzba
+    lazyblocks-replay show games.lzba 42 --step 1500
+"""
+
+import argparse
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from functools import partial
+from typing import Iterator, Optional
+
+from LazyBlocks_ai import Placement
+from LazyBlocks_engine import LazyBlocksEngine
+from LazyBlocks_feed import DROP, ROTATIONS, SWAP, UNDO, apply_action
+from LazyBlocks_sim import (
+    POLICIES,
+    SimulationConfig,
+    UndoPlayer,
+    make_policy,
+    new_game,
+)
+from LazyBlocks_snapshot import (
+    JOURNAL_MAGIC,
+    RNG_WORDS,
+    SnapshotEncoder,
+    decode_snapshot,
+)
+
+REPLAY_MAGIC = b"LZBR"
+ARCHIVE_MAGIC = b"LZBA"
+REPLAY_VERSION = 1
+
+KEYFRAME_INTERVAL = 64  # Steps between two keyframes
+FULL_KEYFRAMES = 16  # Every this many keyframes, one is a full record
+
+PLACE = 9  # Step of a bot placement, after the actions 1 to 8
+CLEAR = 4  # Flag of a placement that clears the rows it completes
+
+SKIP_CHUNK = 1 << 16  # Generator words skipped per call
+
+_HEADER = struct.Struct("<4sHI?qQ")
+_PLACE = struct.Struct("<Bhh")
+_KEYFRAME = struct.Struct("<IIQI")
+_FOOTER = struct.Struct("<IIIII4s")
+_SIZE = struct.Struct("<I")
+_ARCHIVE_HEADER = struct.Struct("<4sH")
+_BLOCK = struct.Struct("<HI")
+_SLOT = struct.Struct("<QQ")
+_ARCHIVE_FOOTER = struct.Struct("<QQQ4s")
+
+
+class ReplayError(ValueError):
+    """The data is not a valid replay or archive."""
+
+
+def skip_words(rng, words: int):
+    """Advance a generator by `words` 32-bit words, as that many draws would."""
+    while words > 0:
+        chunk = min(words, SKIP_CHUNK)
+        rng.getrandbits(32 * chunk)  # Exactly one word per 32 bits
+        words -= chunk
+
+
+def play_placement(engine: LazyBlocksEngine, rotation: int, position, clear: bool):
+    """Play a `PLACE` step, as `apply_placement` plays a placement."""
+    engine.current_shape = [
+        list(row) for row in ROTATIONS[engine.current_shape_idx][rotation]
+    ]
+    engine.current_position = position
+    engine.place_piece_on_grid()
+    if clear:
+        engine.clear_full_rows()
+    engine.spawn_new_shape()
+
+
+def play_step(engine: LazyBlocksEngine, steps, offset: int) -> int:
+    """Play the step at `offset` of the step bytes. Return the next offset."""
+    step = steps[offset]
+    if step != PLACE:
+        apply_action(engine, step)
+        return offset + 1
+    flags, x, y = _PLACE.unpack_from(steps, offset + 1)
+    play_placement(engine, flags & 3, (x, y), bool(flags & CLEAR))
+    return offset + 1 + _PLACE.size
+
+
+class ReplayRecorder:
+    """
+    Plays steps on an engine and records them, with the keyframes. Only the
+    actions that did something are recorded.
+
+    `seed` is the seed of the engine's generator, if it drew less than a state
+    of words since it was seeded (as by `LazyBlocksEngine(seed)` or `new_game`).
+    """
+
+    def __init__(
+        self,
+        engine: LazyBlocksEngine,
+        game_id: str = "",
+        keyframe_interval: int = KEYFRAME_INTERVAL,
+        seed: Optional[int] = None,
+    ):
+        self.engine = engine
+        self.keyframe_interval = keyframe_interval
+        self.seed = seed if seed is not None and -(2**63) <= seed < 2**63 else None
+        self.start = SnapshotEncoder().encode(
+            engine, game_id.encode(), generator=self.seed is None
+        )
+        self.steps = bytearray()
+        self.step_count = 0
+        self.keyframes = bytearray()
+        self.index: list[tuple[int, int, int, int]] = []
+        self.encoder = SnapshotEncoder()
+        self.rng_index = engine.rng.getstate()[1][RNG_WORDS]
+        # Words drawn from the generator since the seed (a seeded generator
+        # is at index 624, and twists on the first draw), or the start
+        self.drawn = 0 if self.seed is None else self.rng_index % RNG_WORDS
+        self.start_drawn = self.drawn
+
+    def action(self, action: int) -> bool:
+        """Play and record an action. Return True if it did something."""
+        if not apply_action(self.engine, action):
+            return False
+        self.steps.append(action)
+        self._stepped()
+        return True
+
+    def place(self, placement: Placement, swap: bool = False):
+        """Play and record a bot placement, after a swap with the helper."""
+        if swap:
+            self.action(SWAP)
+        rotation = placement.profile.rotation
+        clear = placement.lines > 0
+        play_placement(self.engine, rotation, placement.position, clear)
+        self.steps.append(PLACE)
+        self.steps += _PLACE.pack(
+            rotation | (CLEAR if clear else 0), *placement.position
+        )
+        self._stepped()
+
+    def _stepped(self):
+        # Fewer than a whole state of words are drawn per step, so a lower
+        # index is one twist of the generator
+        rng_index = self.engine.rng.getstate()[1][RNG_WORDS]
+        self.drawn += (rng_index - self.rng_index) % RNG_WORDS
+        self.rng_index = rng_index
+        self.step_count += 1
+        if self.step_count % self.keyframe_interval == 0:
+            full = len(self.index) % FULL_KEYFRAMES == 0
+            record = self.encoder.encode(self.engine, delta=not full, generator=False)
+            if record is None:  # Nothing changed since the keyframe before
+                record = self.encoder.encode(self.engine, generator=False)
+            self.index.append(
+                (self.step_count, len(self.steps), self.drawn, len(self.keyframes))
+            )
+            self.keyframes += _SIZE.pack(len(record)) + record
+
+    def finish(self) -> bytes:
+        """The replay."""
+        parts = [
+            _HEADER.pack(
+                REPLAY_MAGIC,
+                REPLAY_VERSION,
+                len(self.start),
+                self.seed is not None,
+                self.seed or 0,
+                self.start_drawn,
+            )
+        ]
+        parts.append(self.start)
+        steps_offset = _HEADER.size + len(self.start)
+        parts.append(self.steps)
+        keyframes_offset = steps_offset + len(self.steps)
+        parts.append(self.keyframes)
+        index_offset = keyframes_offset + len(self.keyframes)
+        for step, step_offset, drawn, record_offset in self.index:
+            parts.append(
+                _KEYFRAME.pack(
+                    step, step_offset, drawn, keyframes_offset + record_offset
+                )
+            )
+        parts.append(
+            _FOOTER.pack(
+                steps_offset,
+                len(self.steps),
+                self.step_count,
+                index_offset,
+                len(self.index),
+                REPLAY_MAGIC,
+            )
+        )
+        return b"".join(parts)
+
+
+class Replay:
+    """A replay, to read its steps and the state of the game at any step."""
+
+    def __init__(self, data):
+        data = memoryview(data)
+        try:
+            (
+                magic,
+                version,
+                start_size,
+                seeded,
+                seed,
+                self.start_drawn,
+            ) = _HEADER.unpack_from(data)
+            (
+                steps_offset,
+                steps_size,
+                self.step_count,
+                index_offset,
+                keyframe_count,
+                end_magic,
+            ) = _FOOTER.unpack_from(data, len(data) - _FOOTER.size)
+        except struct.error as error:
+            raise ReplayError(f"Truncated replay: {error}") from error
+        if magic != REPLAY_MAGIC or end_magic != REPLAY_MAGIC:
+            raise ReplayError("Not a LazyBlocks replay")
+        if version > REPLAY_VERSION:
+            raise ReplayError(f"Unsupported replay version {version}")
+        self.data = data
+        self.seed = seed if seeded else None
+        self.start = decode_snapshot(data[_HEADER.size : _HEADER.size + start_size])
+        self.steps = data[steps_offset : steps_offset + steps_size]
+        self.keyframes = [
+            _KEYFRAME.unpack_from(data, index_offset + i * _KEYFRAME.size)
+            for i in range(keyframe_count)
+        ]
+        self.keyframe_steps = [keyframe[0] for keyframe in self.keyframes]
+
+    @property
+    def game_id(self) -> str:
+        return self.start.extra.decode()
+
+    @property
+    def board_size(self) -> tuple[int, int]:
+        """(width, height) of the board."""
+        return self.start.rules[2], self.start.rules[3]
+
+    def start_engine(self) -> LazyBlocksEngine:
+        """Engine at the start of the game."""
+        engine = self.start.to_engine()
+        if self.seed is not None:
+            engine.rng.seed(self.seed)
+            skip_words(engine.rng, self.start_drawn)
+        return engine
+
+    def step_actions(self) -> Iterator[tuple]:
+        """The steps: (action,), or (PLACE, rotation, position, clear)."""
+        steps = self.steps
+        offset = 0
+        while offset < len(steps):
+            if steps[offset] != PLACE:
+                yield (steps[offset],)
+                offset += 1
+            else:
+                flags, x, y = _PLACE.unpack_from(steps, offset + 1)
+                yield (PLACE, flags & 3, (x, y), bool(flags & CLEAR))
+                offset += 1 + _PLACE.size
+
+    def engine_at(self, step: int) -> LazyBlocksEngine:
+        """
+        Engine in the state of the game after `step` steps (0 for the start),
+        from the keyframe before it.
+        """
+        if not 0 <= step <= self.step_count:
+            raise IndexError(f"Step {step} out of 0 to {self.step_count}")
+        engine = self.start_engine()
+        at, offset = 0, 0
+        keyframe = bisect.bisect_right(self.keyframe_steps, step) - 1
+        if keyframe >= 0:
+            full = keyframe - keyframe % FULL_KEYFRAMES
+            at, offset, drawn, _ = self.keyframes[keyframe]
+            first = self.keyframes[full][3]
+            last = self.keyframes[keyframe][3]
+            (size,) = _SIZE.unpack_from(self.data, last)
+            records = self.data[first : last + _SIZE.size + size]
+            decode_snapshot(JOURNAL_MAGIC + records).restore(engine)
+            skip_words(engine.rng, drawn - self.start_drawn)
+        while at < step:
+            offset = play_step(engine, self.steps, offset)
+            at += 1
+        return engine
+
+    def play(self) -> LazyBlocksEngine:
+        """Engine at the end of the game, from the start, without the keyframes."""
+        engine = self.start_engine()
+        offset = 0
+        while offset < len(self.steps):
+            offset = play_step(engine, self.steps, offset)
+        return engine
+
+
+def _game_hash(game_id: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(game_id, digest_size=8).digest(), "little")
+
+
+class ArchiveWriter:
+    """
+    Writes replays into an archive, to a temporary file first: the archive only
+    appears, complete, on `close`.
+    """
+
+    def __init__(self, path: str, level: int = 6):
+        self.path = path
+        self.level = level
+        self.file = open(path + ".tmp", "wb")
+        self.file.write(_ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, REPLAY_VERSION))
+        self.offsets: dict[bytes, int] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.path + ".tmp")
+
+    def add(self, game_id: str, replay: bytes):
+        key = game_id.encode()
+        if key in self.offsets:
+            raise ReplayError(f"Game {game_id} is already in the archive")
+        self.offsets[key] = self.file.tell()
+        compressed = zlib.compress(replay, self.level)
+        self.file.write(_BLOCK.pack(len(key), len(compressed)) + key)
+        self.file.write(compressed)
+
+    def close(self):
+        """Write the index of the games, and put the archive in place."""
+        slot_count = 1
+        while slot_count * 3 < len(self.offsets) * 4:  # At most 75% full
+            slot_count *= 2
+        slots = array("Q", bytes(2 * 8 * slot_count))
+        mask = slot_count - 1
+        for key, offset in self.offsets.items():
+            game_hash = _game_hash(key)
+            slot = game_hash & mask
+            while slots[2 * slot + 1]:
+                slot = (slot + 1) & mask
+            slots[2 * slot] = game_hash
+            slots[2 * slot + 1] = offset
+        if sys.byteorder != "little":
+            slots.byteswap()
+        table_offset = self.file.tell()
+        self.file.write(slots.tobytes())
+        self.file.write(
+            _ARCHIVE_FOOTER.pack(
+                table_offset, slot_count, len(self.offsets), ARCHIVE_MAGIC
+            )
+        )
+        self.file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+class ReplayArchive:
+    """An archive, memory mapped: a game is found and read on its own."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            try:
+                self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as error:  # Empty file
+                raise ReplayError(f"Not a LazyBlocks archive: {path}") from error
+        try:
+            magic, version = _ARCHIVE_HEADER.unpack_from(self.map)
+            (
+                self.table_offset,
+                self.slot_count,
+                self.game_count,
+                end_magic,
+            ) = _ARCHIVE_FOOTER.unpack_from(
+                self.map, len(self.map) - _ARCHIVE_FOOTER.size
+            )
+        except struct.error as error:
+            raise ReplayError(f"Truncated archive: {error}") from error
+        if magic != ARCHIVE_MAGIC or end_magic != ARCHIVE_MAGIC:
+            raise ReplayError(f"Not a LazyBlocks archive: {path}")
+        if version > REPLAY_VERSION:
+            raise ReplayError(f"Unsupported archive version {version}")
+
+    def __len__(self) -> int:
+        return self.game_count
+
+    def __contains__(self, game_id: str) -> bool:
+        return self._find(game_id.encode()) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        """The game ids, in the order of the archive."""
+        offset = _ARCHIVE_HEADER.size
+        while offset < self.table_offset:
+            key_size, size = _BLOCK.unpack_from(self.map, offset)
+            offset += _BLOCK.size
+            yield self.map[offset : offset + key_size].decode()
+            offset += key_size + size
+
+    def _find(self, key: bytes) -> Optional[bytes]:
+        """The compressed replay of a game id, or None."""
+        game_hash = _game_hash(key)
+        mask = self.slot_count - 1
+        slot = game_hash & mask
+        while True:
+            slot_hash, offset = _SLOT.unpack_from(
+                self.map, self.table_offset + slot * _SLOT.size
+            )
+            if not offset:
+                return None
+            if slot_hash == game_hash:
+                key_size, size = _BLOCK.unpack_from(self.map, offset)
+                start = offset + _BLOCK.size
+                if self.map[start : start + key_size] == key:
+                    start += key_size
+                    return self.map[start : start + size]
+            slot = (slot + 1) & mask
+
+    def replay(self, game_id: str) -> Replay:
+        """The replay of a game. KeyError if the archive does not have it."""
+        compressed = self._find(game_id.encode())
+        if compressed is None:
+            raise KeyError(game_id)
+        return Replay(zlib.decompress(compressed))
+
+    def engine_at(self, game_id: str, step: int) -> LazyBlocksEngine:
+        """Engine in the state of a game after `step` steps."""
+        return self.replay(game_id).engine_at(step)
+
+    def close(self):
+        self.map.close()
+
+
+def record_game(seed: int, config: SimulationConfig, game_id: str = "") -> bytes:
+    """Play a seeded bot game, as `run_game` does, and return its replay."""
+    engine = new_game(seed, config)
+    policy = make_policy(config.policy, seed, config.lookahead_depth)
+    recorder = ReplayRecorder(engine, game_id or str(seed), seed=seed)
+
+    def place(choice: Optional[tuple[bool, Placement]]):
+        if choice is None:
+            # Nothing fits: drop the piece where it is, the next spawn ends the game
+            recorder.action(DROP)
+        else:
+            swap, placement = choice
+            recorder.place(placement, swap)
+
+    pieces = 0
+    while not engine.game_over and pieces < config.max_pieces:
+        if isinstance(policy, UndoPlayer):
+            policy.play_piece(engine, place, partial(recorder.action, UNDO))
+        else:
+            place(policy.choose(engine))
+        pieces += 1
+    return recorder.finish()
+
+
+def board_text(engine: LazyBlocksEngine) -> str:
+    """The grid as text, top row first: "#" filled, "@" the current piece."""
+    width = engine.grid_width
+    lines = []
+    piece = set()
+    x0, y0 = engine.current_position
+    for dy, row in enumerate(engine.current_shape):
+        for dx, filled in enumerate(row):
+            if filled:
+                piece.add((y0 - dy, x0 + dx))
+    shapes = engine.grid.shapes
+    for grid_y in range(engine.grid_height - 1, -1, -1):
+        cells = []
+        for grid_x in range(width):
+            if (grid_y, grid_x) in piece and not engine.game_over:
+                cells.append("@")
+            elif grid_y < engine.grid.stored_rows and shapes[grid_y * width + grid_x]:
+                cells.append("#")
+            else:
+                cells.append(".")
+        lines.append("".join(cells))
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="lazyblocks-replay",
+        description="Record bot games into a replay archive, and read them back.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record", help="Record seeded bot games")
+    record.add_argument("archive")
+    record.add_argument("--games", type=int, default=100, help="Number of games")
+    record.add_argument("--policy", choices=POLICIES, default="greedy")
+    record.add_argument("--seed", type=int, default=0, help="Seed of the first game")
+    record.add_argument("--max-pieces", type=int, default=1000)
+    record.add_argument("--helper-probability", type=float, default=1.0)
+    listing = commands.add_parser("list", help="List the games of an archive")
+    listing.add_argument("archive")
+    show = commands.add_parser("show", help="Print a game at a step")
+    show.add_argument("archive")
+    show.add_argument("game_id")
+    show.add_argument("--step", type=int, default=None, help="Default: the end")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        config = SimulationConfig(
+            policy=args.policy,
+            max_pieces=args.max_pieces,
+            helper_piece_probability=args.helper_probability,
+        )
+        start = time.perf_counter()
+        size = 0
+        with ArchiveWriter(args.archive) as writer:
+            for seed in range(args.seed, args.seed + args.games):
+                replay = record_game(seed, config)
+                size += len(replay)
+                writer.add(str(seed), replay)
+        print(
+            f"Recorded {args.games} games ({size / 1e6:.1f} MB of replays,"
+            f" {os.path.getsize(args.archive) / 1e6:.1f} MB compressed)"
+            f" in {time.perf_counter() - start:.1f} s"
+        )
+    elif args.command == "list":
+        archive = ReplayArchive(args.archive)
+        for game_id in archive:
+            print(game_id)
+    else:
+        archive = ReplayArchive(args.archive)
+        try:
+            replay = archive.replay(args.game_id)
+        except KeyError:
+            sys.exit(f"No game {args.game_id} in {args.archive}")
+        step = replay.step_count if args.step is None else args.step
+        start = time.perf_counter()
+        engine = replay.engine_at(step)
+        elapsed = time.perf_counter() - start
+        print(board_text(engine))
+        print(
+            f"Game {replay.game_id}, step {step} of {replay.step_count}:"
+            f" score {engine.score}, {engine.shapes_cnt} pieces"
+            f"{', game over' if engine.game_over else ''}"
+            f" ({elapsed * 1000:.1f} ms)"
+        )
+
+
+if __name__ == "__main__":
+    main()
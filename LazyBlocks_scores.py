@@ -0,0 +1,370 @@
+"""
+Score history of the games: date, player, game id, score.
+
+Each machine appends the scores of its games to its own shard, at
+`scores/<host>.csv` in the working directory. Machines never write to the same
+file, and storing a score costs one appended line whatever the history. A game
+stored again (e.g. at exit, or after it was resumed) gets a new line: the
+latest line of a game id holds its score.
+
+`lazyblocks-scores merge` merges the shards collected from the machines into
+one log sorted by game id, with one line per game, and a global leaderboard.
+The merge streams in constant memory: the new lines of the shards are sorted
+in runs of at most `RUN_ROWS` lines, then the runs and the previous merged
+log are merged k-way. It is incremental: only the lines appended to the
+shards since the last merge are read, unless a shard was rewritten, which
+rebuilds the merged log from the shards.
+
+    lazyblocks-scores merge collected/ --output merged/
+    lazyblocks-scores leaderboard merged/leaderboard.csv
+"""
+
+import argparse
+import csv
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import os
+import re
+import socket
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import Iterator, Optional
+
+import pandas as pd
+
+SCORES_FILE = "scores.csv"  # Single score file of the earlier versions, still read
+SCORES_DIR = "scores"
+SCORE_COLUMNS = ["date", "player", "gameid", "score"]
+
+MERGED_FILE = "merged.csv"
+LEADERBOARD_FILE = "leaderboard.csv"
+STATE_FILE = "state.json"
+RUN_ROWS = 50_000  # Lines sorted in memory at once
+MERGE_FAN_IN = 256  # Files merged at once: more runs are merged in passes
+LEADERBOARD_SIZE = 100
+FINGERPRINT_BYTES = 4096  # Bytes hashed at both ends of the merged part of a shard
+
+
+def host_name() -> str:
+    """Name of this machine, usable as a file name."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", socket.gethostname()) or "localhost"
+
+
+def shard_path(directory: str = SCORES_DIR, host: Optional[str] = None) -> str:
+    """Score shard of a machine, this one by default."""
+    return os.path.join(directory, f"{host or host_name()}.csv")
+
+
+def store_score(
+    game_id: str, score: int, player: str = "Player", scores_file: Optional[str] = None
+):
+    """
+    Store the score of a game: append it to this machine's shard, or to
+    `scores_file`. It replaces the scores stored earlier for the same game.
+    """
+    path = scores_file or shard_path()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    line = io.StringIO()
+    writer = csv.writer(line)
+    # Line based readers must not see a line break in a name
+    player = " ".join(str(player).splitlines())
+    writer.writerow([time.strftime("%Y-%m-%d %H:%M:%S"), player, game_id, score])
+    with open(path, "a", newline="") as shard:
+        # In one write, so that a reader never sees the header alone
+        header = "" if shard.tell() else ",".join(SCORE_COLUMNS) + "\r\n"
+        shard.write(header + line.getvalue())
+
+
+def local_score_files() -> list[str]:
+    """The score files of this machine: its shard, and the earlier single file."""
+    return [path for path in [SCORES_FILE, shard_path()] if os.path.exists(path)]
+
+
+def load_leaderboard(scores_file: Optional[str] = None, top: int = 10) -> pd.DataFrame:
+    """The `top` best scores, one per game, of this machine or of a score file."""
+    paths = [scores_file] if scores_file else local_score_files()
+    frames = [pd.read_csv(path) for path in paths if os.path.exists(path)]
+    if not frames:
+        return pd.DataFrame(columns=SCORE_COLUMNS)
+    df = pd.concat(frames, ignore_index=True).drop_duplicates("gameid", keep="last")
+    return df.sort_values(by="score", ascending=False).head(top)
+
+
+# Merge
+
+# Lines travel through the merge as records sorted by game id, then by how
+# recent they are: (game id, date, source, line, player, score). The source
+# is 0 for the previous merged log and 1 + the index of a shard otherwise, the
+# line its position in the shard, so that the last record of a game id is its
+# latest line.
+
+
+@dataclass
+class ShardState:
+    size: int  # Bytes already merged, up to the end of a line
+    fingerprint: str  # Hash of the first and last bytes of the merged part
+
+
+@dataclass
+class MergeResult:
+    shards: int  # Shards with new lines
+    read: int  # Bytes read from the shards
+    games: int  # Games in the merged log
+    rebuilt: bool
+
+
+def fingerprint(path: str, size: int) -> str:
+    """Hash of the first and last `FINGERPRINT_BYTES` of a shard's first bytes."""
+    with open(path, "rb") as shard:
+        head = shard.read(min(size, FINGERPRINT_BYTES))
+        shard.seek(max(0, size - FINGERPRINT_BYTES))
+        tail = shard.read(size - shard.tell())
+    return hashlib.sha1(head + b"|" + tail).hexdigest()
+
+
+def complete_size(path: str) -> int:
+    """Size of a shard up to its last line break: a line may be being written."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as shard:
+        end = size
+        while end > 0:
+            start = max(0, end - FINGERPRINT_BYTES)
+            shard.seek(start)
+            newline = shard.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+def shard_records(path: str, start: int, end: int, source: int) -> Iterator[tuple]:
+    """Records of the lines of a shard between two byte offsets."""
+
+    def lines() -> Iterator[str]:
+        offset = start
+        with open(path, "rb") as shard:
+            shard.seek(start)
+            for line in shard:
+                offset += len(line)
+                if offset > end:
+                    return
+                yield line.decode("utf-8", "replace")
+
+    for number, row in enumerate(csv.reader(lines())):
+        if len(row) != 4 or row == SCORE_COLUMNS:
+            continue  # Header, or a damaged line
+        date, player, game_id, score = row
+        try:
+            int(score)
+        except ValueError:
+            continue
+        yield (game_id, date, source, number, player, score)
+
+
+def merged_records(path: str) -> Iterator[tuple]:
+    """Records of a merged log, as the oldest source."""
+    with open(path, newline="") as merged:
+        reader = csv.reader(merged)
+        next(reader, None)
+        for date, player, game_id, score in reader:
+            yield (game_id, date, 0, 0, player, score)
+
+
+def run_records(path: str) -> Iterator[tuple]:
+    with open(path, newline="") as run:
+        for game_id, date, source, number, player, score in csv.reader(run):
+            yield (game_id, date, int(source), int(number), player, score)
+
+
+def write_run(records: Iterator[tuple], directory: str) -> str:
+    handle, path = tempfile.mkstemp(suffix=".csv", dir=directory)
+    with os.fdopen(handle, "w", newline="") as run:
+        csv.writer(run).writerows(records)
+    return path
+
+
+def sorted_runs(records: Iterator[tuple], directory: str, run_rows: int) -> list[str]:
+    """Sort records in runs of `run_rows` records, each written to a file."""
+    runs = []
+    while chunk := list(itertools.islice(records, run_rows)):
+        chunk.sort()
+        runs.append(write_run(iter(chunk), directory))
+    return runs
+
+
+def reduce_runs(runs: list[str], directory: str) -> list[str]:
+    """Merge runs in passes until they can all be opened at once."""
+    while len(runs) > MERGE_FAN_IN:
+        merged = []
+        for i in range(0, len(runs), MERGE_FAN_IN):
+            group = runs[i : i + MERGE_FAN_IN]
+            merged.append(write_run(heapq.merge(*map(run_records, group)), directory))
+            for path in group:
+                os.remove(path)
+        runs = merged
+    return runs
+
+
+def latest_per_game(records: Iterator[tuple]) -> Iterator[tuple]:
+    """The last record of each game id, from records sorted by game id."""
+    previous = None
+    for record in records:
+        if previous is not None and record[0] != previous[0]:
+            yield previous
+        previous = record
+    if previous is not None:
+        yield previous
+
+
+def merge_shards(
+    shards: list[str],
+    output: str,
+    top: int = LEADERBOARD_SIZE,
+    run_rows: int = RUN_ROWS,
+    rebuild: bool = False,
+) -> MergeResult:
+    """
+    Merge the new lines of the shards into `output`/merged.csv, and write the
+    `top` games of it to `output`/leaderboard.csv.
+    """
+    os.makedirs(output, exist_ok=True)
+    merged_path = os.path.join(output, MERGED_FILE)
+    state_path = os.path.join(output, STATE_FILE)
+    known = {}
+    games = 0
+    if os.path.exists(state_path) and os.path.exists(merged_path) and not rebuild:
+        with open(state_path) as state_file:
+            state = json.load(state_file)
+        known = {path: ShardState(**shard) for path, shard in state["shards"].items()}
+        games = state["games"]
+    else:
+        rebuild = True
+
+    # The new lines of each shard, or all of them after a rewrite
+    ranges = {}
+    for path in map(os.path.abspath, shards):
+        end = complete_size(path)
+        state = known.get(path)
+        start = 0
+        if state is not None:
+            if end < state.size or fingerprint(path, state.size) != state.fingerprint:
+                rebuild = True
+            start = state.size
+        ranges[path] = (start, end)
+    if rebuild:
+        known = {}
+        ranges = {path: (0, end) for path, (_, end) in ranges.items()}
+    changed = [
+        (path, start, end) for path, (start, end) in ranges.items() if end > start
+    ]
+    if not changed and not rebuild:
+        return MergeResult(shards=0, read=0, games=games, rebuilt=False)
+
+    read = 0
+    with tempfile.TemporaryDirectory(dir=output) as directory:
+        runs = []
+        for source, (path, start, end) in enumerate(changed, start=1):
+            records = shard_records(path, start, end, source)
+            runs += sorted_runs(records, directory, run_rows)
+            read += end - start
+        runs = reduce_runs(runs, directory)
+        sources = [run_records(run) for run in runs]
+        if not rebuild:
+            sources.append(merged_records(merged_path))
+
+        games = 0
+        best: list[tuple] = []  # Heap of the `top` best games
+        merged_file = tempfile.NamedTemporaryFile(
+            "w", newline="", dir=output, suffix=".csv", delete=False
+        )
+        with merged_file:
+            writer = csv.writer(merged_file)
+            writer.writerow(SCORE_COLUMNS)
+            for game_id, date, _, _, player, score in latest_per_game(
+                heapq.merge(*sources)
+            ):
+                writer.writerow([date, player, game_id, score])
+                games += 1
+                entry = (int(score), date, game_id, player)
+                if len(best) < top:
+                    heapq.heappush(best, entry)
+                elif entry > best[0]:
+                    heapq.heapreplace(best, entry)
+        os.replace(merged_file.name, merged_path)
+
+    leaderboard_path = os.path.join(output, LEADERBOARD_FILE)
+    with open(leaderboard_path, "w", newline="") as leaderboard:
+        writer = csv.writer(leaderboard)
+        writer.writerow(SCORE_COLUMNS)
+        for score, date, game_id, player in sorted(best, reverse=True):
+            writer.writerow([date, player, game_id, score])
+
+    for path, (_, end) in ranges.items():
+        known[path] = ShardState(end, fingerprint(path, end))
+    with open(state_path, "w") as state_file:
+        json.dump(
+            {
+                "games": games,
+                "shards": {path: asdict(state) for path, state in known.items()},
+            },
+            state_file,
+            indent=2,
+        )
+    return MergeResult(shards=len(changed), read=read, games=games, rebuilt=rebuild)
+
+
+def shard_files(paths: list[str]) -> list[str]:
+    """The shards given as files, or as directories of CSV files."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.endswith(".csv")
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="lazyblocks-scores",
+        description="Merge the score shards of machines, or show a leaderboard.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    merge = commands.add_parser("merge", help="Merge shards into a global log")
+    merge.add_argument("shards", nargs="+", help="Shard files, or directories of them")
+    merge.add_argument("--output", default="merged", help="Directory of the merge")
+    merge.add_argument("--top", type=int, default=LEADERBOARD_SIZE)
+    merge.add_argument(
+        "--rebuild", action="store_true", help="Merge all the lines of the shards"
+    )
+    show = commands.add_parser("leaderboard", help="Print the best scores")
+    show.add_argument("file", nargs="?", help="Score file, default: this machine's")
+    show.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    if args.command == "merge":
+        start = time.perf_counter()
+        result = merge_shards(
+            shard_files(args.shards), args.output, args.top, rebuild=args.rebuild
+        )
+        print(
+            f"{'Rebuilt' if result.rebuilt else 'Merged'} {result.shards} changed"
+            f" shards ({result.read / 1e6:.1f} MB) into {result.games} games"
+            f" in {time.perf_counter() - start:.1f} s"
+        )
+    else:
+        print(load_leaderboard(args.file, args.top).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""Lookahead planner for LazyBlocks, using the current, helper and next pieces."""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Hashable, Optional
+
+from LazyBlocks_ai import (
+    BoardState,
+    HeuristicEvaluator,
+    Placement,
+    apply_placement,
+    enumerate_placements,
+)
+from LazyBlocks_engine import SHAPES, LazyBlocksEngine
+
+# Value of a position where the game is lost
+GAME_OVER_VALUE = -1_000_000.0
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time budget is exhausted."""
+
+
+class TranspositionTable:
+    """
+    Bounded cache of search results, keyed by position (Zobrist hash, pieces, depth).
+
+    Entries are evicted in least-recently-used order. With `depth_preferred`,
+    the shallowest of the `probe` least recently used entries is evicted
+    instead, since deep results are the most expensive to recompute.
+    """
+
+    def __init__(
+        self, capacity: int = 200_000, depth_preferred: bool = False, probe: int = 8
+    ):
+        assert capacity > 0 and probe > 0
+        self.capacity = capacity
+        self.depth_preferred = depth_preferred
+        self.probe = probe
+        self.entries: OrderedDict[Hashable, tuple[int, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Cached value for the key, or None."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any, depth: int = 0):
+        """Store a value computed by a search of the given depth."""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        elif len(self.entries) >= self.capacity:
+            self._evict()
+        self.entries[key] = (depth, value)
+
+    def _evict(self):
+        self.evictions += 1
+        if not self.depth_preferred:
+            self.entries.popitem(last=False)
+            return
+        victim, victim_depth = None, None
+        for i, (key, (depth, _)) in enumerate(self.entries.items()):
+            if i == self.probe:
+                break
+            if victim is None or depth < victim_depth:
+                victim, victim_depth = key, depth
+        del self.entries[victim]
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+
+@dataclass
+class Plan:
+    """Decision returned by the planner."""
+
+    swap: bool  # Swap the current piece with the helper piece before placing it
+    placement: Placement
+    value: float
+    depth: int  # Deepest search depth completed within the time budget
+    nodes: int  # Number of placements made on the engine while searching
+    # `TranspositionTable.stats` after the search, counted since the table was
+    # created or cleared
+    table: dict = field(default_factory=dict)
+
+
+class LookaheadPlanner:
+    """
+    Expectimax search over placements, with a beam.
+
+    At the root both the current and the helper piece are tried. Once a piece is
+    placed, the known next piece becomes the current one while the new helper
+    and the following pieces are random, so the search averages over the shapes
+    for every unknown piece (a player always takes the better of current and
+    helper). Only the `beam_width` best placements of a piece, according to the
+    one-ply evaluation, are searched deeper.
+
+    The search deepens iteratively up to `max_depth` placements and returns the
+    result of the deepest depth finished within `time_budget` seconds. Moves are
+    explored with `make_placement` / `unmake_placement` on the engine itself, so
+    no grid is ever copied. Undo is not searched: it only gives back a piece that
+    was already placed.
+
+    Results are cached in a transposition table keyed by the engine's Zobrist
+    `grid_hash`: different move orders often lead to the same stack, and the
+    table is kept between decisions.
+    """
+
+    def __init__(
+        self,
+        evaluator: Optional[HeuristicEvaluator] = None,
+        max_depth: int = 3,
+        beam_width: int = 6,
+        time_budget: float = 0.05,
+        table: Optional[TranspositionTable] = None,
+    ):
+        assert max_depth >= 1 and beam_width >= 1
+        self.evaluator = evaluator or HeuristicEvaluator()
+        self.max_depth = max_depth
+        self.beam_width = beam_width
+        self.time_budget = time_budget
+        self.table = TranspositionTable() if table is None else table
+        self.deadline = 0.0
+        self.nodes = 0
+
+    def plan(self, engine: LazyBlocksEngine) -> Optional[Plan]:
+        """Best move for the current position, or None if no piece fits."""
+        if engine.game_over:
+            return None
+        self.deadline = time.perf_counter() + self.time_budget
+        self.nodes = 0
+        best = None
+        for depth in range(1, self.max_depth + 1):
+            try:
+                result = self._search_root(engine, depth)
+            except SearchTimeout:
+                break
+            if result is None:
+                break
+            best = result
+        if best is not None:
+            best.table = self.table.stats()
+        return best
+
+    def choose(self, engine: LazyBlocksEngine) -> Optional[tuple[bool, Placement]]:
+        """Return (swap with helper first?, placement), as `AutoPlayer.choose`."""
+        plan = self.plan(engine)
+        return None if plan is None else (plan.swap, plan.placement)
+
+    def play_piece(self, engine: LazyBlocksEngine) -> bool:
+        """Place the current piece. Return False if the game is (or becomes) over."""
+        plan = self.plan(engine)
+        if plan is None:
+            if not engine.game_over:
+                # Nothing fits: drop the piece where it is, the next spawn ends the game
+                engine.place_piece_on_grid()
+                engine.spawn_new_shape()
+            return False
+        if plan.swap:
+            engine.swap_current_and_helper()
+        apply_placement(engine, plan.placement)
+        return not engine.game_over
+
+    def _search_root(self, engine: LazyBlocksEngine, depth: int) -> Optional[Plan]:
+        board = BoardState.from_engine(engine)
+        pieces = [(False, engine.current_shape_idx)]
+        if engine.helper_piece_idx not in (None, engine.current_shape_idx):
+            pieces.append((True, engine.helper_piece_idx))
+
+        best = None
+        for swap, shape_idx in pieces:
+            value, placement = self._best_placement(
+                engine, board, shape_idx, depth, engine.next_shape_idx
+            )
+            if placement is not None and (best is None or value > best.value):
+                best = Plan(swap, placement, value, depth, self.nodes)
+        if best is not None:
+            best.nodes = self.nodes
+        return best
+
+    def _best_placement(
+        self,
+        engine: LazyBlocksEngine,
+        board: BoardState,
+        shape_idx: int,
+        depth: int,
+        next_idx: Optional[int],
+    ) -> tuple[float, Optional[Placement]]:
+        """Value of the best placement of a piece, searching `depth` pieces ahead."""
+        key = (engine.grid_hash, shape_idx, next_idx, depth)
+        cached = self.table.get(key)
+        if cached is not None:
+            return cached
+        result = self._search_placements(engine, board, shape_idx, depth, next_idx)
+        self.table.put(key, result, depth)
+        return result
+
+    def _search_placements(
+        self,
+        engine: LazyBlocksEngine,
+        board: BoardState,
+        shape_idx: int,
+        depth: int,
+        next_idx: Optional[int],
+    ) -> tuple[float, Optional[Placement]]:
+        placements = enumerate_placements(board, shape_idx)
+        if not placements:
+            return GAME_OVER_VALUE, None
+        scores = self.evaluator.evaluate_all(board, placements)
+        if depth == 1:
+            best = max(range(len(placements)), key=scores.__getitem__)
+            return scores[best], placements[best]
+
+        beam = sorted(range(len(placements)), key=scores.__getitem__, reverse=True)
+        lines_weight = self.evaluator.weights.lines
+        best_value, best_placement = GAME_OVER_VALUE, None
+        for i in beam[: self.beam_width]:
+            if time.perf_counter() > self.deadline:
+                raise SearchTimeout()
+            placement = placements[i]
+            self.nodes += 1
+            undo = engine.make_placement(
+                placement.profile.shape, placement.position, shape_idx
+            )
+            try:
+                value = lines_weight * placement.lines + self._after_spawn(
+                    engine, depth - 1, next_idx
+                )
+            finally:
+                engine.unmake_placement(undo)
+            if best_placement is None or value > best_value:
+                best_value, best_placement = value, placement
+        return best_value, best_placement
+
+    def _after_spawn(
+        self, engine: LazyBlocksEngine, depth: int, current_idx: Optional[int]
+    ) -> float:
+        """
+        Expected value after the next spawn: the current piece is `current_idx`
+        (random if None), the helper and the next pieces are random.
+        """
+        if current_idx is not None:
+            shape = SHAPES[current_idx]
+            if not engine.can_be_placed(shape, engine.spawn_position(shape)):
+                return GAME_OVER_VALUE
+
+        key = (engine.grid_hash, current_idx, depth)
+        cached = self.table.get(key)
+        if cached is not None:
+            return cached
+
+        board = BoardState.from_engine(engine)
+        values = [
+            self._best_placement(engine, board, shape_idx, depth, None)[0]
+            for shape_idx in range(len(SHAPES))
+        ]
+        current_values = values if current_idx is None else [values[current_idx]]
+        # The player keeps the current piece or swaps it with the helper
+        total = 0.0
+        for current_value in current_values:
+            for helper_value in values:
+                total += max(current_value, helper_value)
+        value = total / (len(current_values) * len(values))
+        self.table.put(key, value, depth)
+        return value
@@ -0,0 +1,505 @@
+"""
+Spectator and remote-control server of a game, on localhost or a Unix socket.
+
+The game hands its state to the server at every change (`publish`), and the
+server streams it to any number of spectators from its own thread, so the
+game's frames never wait for the network. Only the rows that changed since the
+last frame a client acknowledged are sent, with the piece events since; one
+client holding the control token can play the game.
+
+Protocol: one JSON object per line, both ways.
+    client  {"hello": "spectator"} or {"hello": "control", "token": "..."}
+    server  {"type": "hello", "width": 10, "height": 20, "control": false}
+    server  {"type": "frame", "seq": 12, "base": 10, "stored": 5,
+             "rows": [[y, "0031000000"], ...], "piece": {...}, "score": 3,
+             "game_over": false, "events": [[11, "placed", {...}], ...]}
+    client  {"ack": 12}
+    client  {"action": "left"}    (control only, see `ACTIONS`)
+
+A frame with `base` 0 is a full frame, else it applies to the state of frame
+`base`. `stored` rows are sent or kept (one palette digit per cell, see
+`BoardGrid`), the rows above are empty. Clients must ack the frames: a client
+more than `MAX_IN_FLIGHT` frames behind gets no new frame until it acks (it
+then gets a single delta covering what it missed), and a client that stays
+behind for `SLOW_CLIENT_TIMEOUT` seconds is dropped.
+
+    python LazyBlocks.py --serve 127.0.0.1:8765
+    python LazyBlocks_server.py serve --address 127.0.0.1:8765   # bot game
+    python LazyBlocks_server.py watch --address 127.0.0.1:8765 --spectators 200
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import secrets
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from LazyBlocks_engine import LazyBlocksEngine, RuleSet
+from LazyBlocks_feed import (
+    CLEAR_ROWS,
+    DROP,
+    MOVE_DOWN,
+    MOVE_LEFT,
+    MOVE_RIGHT,
+    ROTATE,
+    SWAP,
+    UNDO,
+    apply_action,
+    shape_rotation,
+)
+from LazyBlocks_sim import POLICIES, make_policy
+
+ACTIONS = {
+    "left": MOVE_LEFT,
+    "right": MOVE_RIGHT,
+    "down": MOVE_DOWN,
+    "rotate": ROTATE,
+    "drop": DROP,
+    "swap": SWAP,
+    "clear": CLEAR_ROWS,
+    "undo": UNDO,
+}
+
+MAX_IN_FLIGHT = 8  # Frames sent to a client and not acknowledged yet
+HISTORY_FRAMES = 64  # Frames kept to compute the deltas from
+HIGH_WATER = 256 * 1024  # Bytes buffered for a client before it counts as slow
+SLOW_CLIENT_TIMEOUT = 5.0  # Seconds a client may stay behind before it is dropped
+MAX_LINE = 16 * 1024 * 1024  # Longest message, a full frame of a huge board
+
+# Rows travel as one digit per cell, the palette byte
+TO_DIGITS = bytes.maketrans(bytes(range(10)), b"0123456789")
+FROM_DIGITS = bytes.maketrans(b"0123456789", bytes(range(10)))
+
+
+def parse_address(address: str) -> tuple:
+    """("tcp", host, port) for "host:port", ("unix", path) for a socket path."""
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return ("tcp", host or "127.0.0.1", int(port))
+    return ("unix", address)
+
+
+@dataclass
+class Frame:
+    seq: int
+    rows: list[bytes]  # Palette bytes of the stored rows, bottom first
+    state: dict  # Everything but the rows and the events
+    events: list  # [seq, name, details] of the changes since the previous frame
+
+
+@dataclass(eq=False)
+class Client:
+    writer: asyncio.StreamWriter
+    control: bool = False
+    acked: int = 0  # Last frame acknowledged, 0 for none
+    sent: deque = field(default_factory=deque)  # Seqs sent and not acked yet
+    slow_since: Optional[float] = None
+
+
+def game_state(engine: LazyBlocksEngine) -> dict:
+    """State of a frame, but the rows and the events."""
+    helper_idx = engine.helper_piece_idx
+    return {
+        "piece": {
+            "current": engine.current_shape_idx,
+            "rotation": shape_rotation(engine.current_shape, engine.current_shape_idx),
+            "helper": helper_idx,
+            "helper_rotation": (
+                0
+                if helper_idx is None
+                else shape_rotation(engine.helper_piece_shape, helper_idx)
+            ),
+            "next": engine.next_shape_idx,
+            "position": list(engine.current_position),
+        },
+        "score": engine.score,
+        "shapes_cnt": engine.shapes_cnt,
+        "cleared_rows": engine.cleared_rows,
+        "swap_count": engine.swap_count,
+        "game_over": engine.game_over,
+    }
+
+
+def frame_events(previous: Optional[dict], state: dict, seq: int) -> list:
+    """Piece events between two published states."""
+    if previous is None:
+        return []
+    events = []
+    if state["shapes_cnt"] > previous["shapes_cnt"]:
+        events.append([seq, "placed", {"piece": state["shapes_cnt"]}])
+    elif state["shapes_cnt"] < previous["shapes_cnt"]:
+        events.append([seq, "undo", {"piece": previous["shapes_cnt"]}])
+    if state["cleared_rows"] > previous["cleared_rows"]:
+        lines = state["cleared_rows"] - previous["cleared_rows"]
+        events.append([seq, "cleared", {"rows": lines}])
+    if state["swap_count"] > previous["swap_count"]:
+        events.append([seq, "swap", {}])
+    if state["game_over"] and not previous["game_over"]:
+        events.append([seq, "game_over", {"score": state["score"]}])
+    return events
+
+
+class GameServer:
+    """
+    Streams the state of one game to spectators, and takes the actions of one
+    controller. `publish` and `actions` are called from the game's thread; the
+    network runs in an asyncio loop on a thread of its own.
+    """
+
+    def __init__(self, address: str, control_token: Optional[str] = None):
+        self.address = parse_address(address)
+        self.control_token = control_token or secrets.token_hex(8)
+        self.width = self.height = 0
+        self.clients: set[Client] = set()
+        self.controller: Optional[Client] = None
+        self.history: dict[int, Frame] = {}
+        self.latest: Optional[Frame] = None
+        self.deltas: dict[int, bytes] = {}  # Latest frame, encoded per base frame
+        self.pending_actions: deque = deque()  # Appended here, popped by the game
+        self.published = None
+        self.previous_state: Optional[dict] = None
+        self.seq = 0
+        self.dropped = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="game-server", daemon=True
+        )
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    def start(self, engine: LazyBlocksEngine):
+        """Open the socket, serving the engine's game."""
+        self.width, self.height = engine.grid_width, engine.grid_height
+        self.publish(engine)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._listen(), self.loop).result()
+
+    async def _listen(self):
+        if self.address[0] == "tcp":
+            self.server = await asyncio.start_server(
+                self._serve_client, self.address[1], self.address[2]
+            )
+        else:
+            self.server = await asyncio.start_unix_server(
+                self._serve_client, self.address[1]
+            )
+
+    def close(self):
+        async def shutdown():
+            self.server.close()
+            for client in list(self.clients):
+                client.writer.close()
+
+        if self.thread.is_alive():
+            asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    # Game thread
+
+    def publish(self, engine: LazyBlocksEngine) -> bool:
+        """Hand the engine's state to the server if it changed."""
+        key = (
+            engine.grid_hash,
+            engine.shapes_cnt,
+            engine.score,
+            engine.current_position,
+            id(engine.current_shape),
+            engine.helper_piece_idx,
+            id(engine.helper_piece_shape),
+            engine.next_shape_idx,
+            engine.game_over,
+        )
+        if key == self.published:
+            return False
+        self.published = key
+        state = game_state(engine)
+        self.seq += 1
+        cells = bytes(engine.grid.shapes)
+        width = engine.grid_width
+        frame = Frame(
+            self.seq,
+            [cells[start : start + width] for start in range(0, len(cells), width)],
+            state,
+            frame_events(self.previous_state, state, self.seq),
+        )
+        self.previous_state = state
+        # Encoding and sending happen on the server thread
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self._receive_frame, frame)
+        else:
+            self._receive_frame(frame)
+        return True
+
+    def actions(self) -> list[int]:
+        """Take the actions of the controller, oldest first."""
+        actions = []
+        while self.pending_actions:
+            actions.append(self.pending_actions.popleft())
+        return actions
+
+    # Server thread
+
+    def _receive_frame(self, frame: Frame):
+        self.history[frame.seq] = frame
+        self.history.pop(frame.seq - HISTORY_FRAMES, None)
+        self.latest = frame
+        self.deltas = {}
+        for client in list(self.clients):
+            self._send_latest(client)
+
+    def _delta(self, base: int) -> bytes:
+        """Message of the latest frame for a client that acked frame `base`."""
+        frame = self.latest
+        base_frame = self.history.get(base)
+        if base_frame is None:
+            base, base_rows, events = 0, [], frame.events
+        else:
+            base_rows = base_frame.rows
+            events = [
+                event
+                for seq in range(base + 1, frame.seq + 1)
+                if seq in self.history
+                for event in self.history[seq].events
+            ]
+        rows = [
+            [y, row.translate(TO_DIGITS).decode()]
+            for y, row in enumerate(frame.rows)
+            if y >= len(base_rows) or row != base_rows[y]
+        ]
+        message = {
+            "type": "frame",
+            "seq": frame.seq,
+            "base": base,
+            "stored": len(frame.rows),
+            "rows": rows,
+            **frame.state,
+            "events": events,
+        }
+        return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+    def _send_latest(self, client: Client):
+        """Send the latest frame to a client, unless it is behind or has it."""
+        frame = self.latest
+        if frame is None or (client.sent and client.sent[-1] == frame.seq):
+            return
+        if client.acked == frame.seq:
+            return
+        transport = client.writer.transport
+        if (
+            len(client.sent) >= MAX_IN_FLIGHT
+            or transport.get_write_buffer_size() > HIGH_WATER
+        ):
+            now = time.monotonic()
+            if client.slow_since is None:
+                client.slow_since = now
+            elif now - client.slow_since > SLOW_CLIENT_TIMEOUT:
+                self.dropped += 1
+                self._remove(client)
+                transport.abort()
+            return
+        client.slow_since = None
+        if client.acked not in self.deltas:
+            self.deltas[client.acked] = self._delta(client.acked)
+        client.writer.write(self.deltas[client.acked])
+        client.sent.append(frame.seq)
+
+    def _remove(self, client: Client):
+        self.clients.discard(client)
+        if self.controller is client:
+            self.controller = None
+
+    async def _serve_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        client = Client(writer)
+        try:
+            hello = json.loads(await reader.readline())
+            if hello.get("hello") == "control":
+                # As bytes: compare_digest refuses strings that are not ASCII
+                token = str(hello.get("token", "")).encode()
+                client.control = self.controller is None and hmac.compare_digest(
+                    token, self.control_token.encode()
+                )
+                if client.control:
+                    self.controller = client
+            writer.write(
+                json.dumps(
+                    {
+                        "type": "hello",
+                        "width": self.width,
+                        "height": self.height,
+                        "control": client.control,
+                    }
+                ).encode()
+                + b"\n"
+            )
+            self.clients.add(client)
+            self._send_latest(client)
+            while line := await reader.readline():
+                message = json.loads(line)
+                if "ack" in message:
+                    seq = int(message["ack"])
+                    while client.sent and client.sent[0] <= seq:
+                        client.sent.popleft()
+                    if seq in self.history and seq > client.acked:
+                        client.acked = seq
+                    self._send_latest(client)
+                elif "action" in message and client.control:
+                    action = ACTIONS.get(message["action"])
+                    if action is not None:
+                        self.pending_actions.append(action)
+        except (ConnectionError, ValueError, TypeError, AttributeError):
+            pass  # Malformed messages close the connection
+        finally:
+            self._remove(client)
+            writer.close()
+
+
+class SpectatorClient:
+    """
+    Test client: keeps the board of the game up to date from the frames, as
+    a real viewer would.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay  # Seconds to wait before each ack, to act slow
+        self.states: dict[int, list[bytes]] = {0: []}  # Rows after each frame
+        self.seq = 0
+        self.state: dict = {}
+        self.events: list = []
+        self.frames = 0
+        self.bytes = 0
+        self.width = 0
+
+    @property
+    def rows(self) -> list[bytes]:
+        return self.states[self.seq]
+
+    def apply(self, message: dict):
+        base_rows = self.states[message["base"]]
+        stored = message["stored"]
+        rows = base_rows[:stored]
+        rows.extend([bytes(self.width)] * (stored - len(rows)))
+        for y, digits in message["rows"]:
+            rows[y] = digits.encode().translate(FROM_DIGITS)
+        # Keep the states frames may still be based on: the acked ones
+        for seq in [seq for seq in self.states if 0 < seq < message["base"]]:
+            del self.states[seq]
+        self.states[message["seq"]] = rows
+        self.events.extend(event for event in message["events"] if event[0] > self.seq)
+        self.seq = message["seq"]
+        self.state = message
+
+    async def run(
+        self,
+        address: str,
+        duration: float,
+        token: Optional[str] = None,
+        actions: tuple[str, ...] = (),
+    ):
+        kind, *where = parse_address(address)
+        if kind == "tcp":
+            reader, writer = await asyncio.open_connection(*where, limit=MAX_LINE)
+        else:
+            reader, writer = await asyncio.open_unix_connection(*where, limit=MAX_LINE)
+        hello = (
+            {"hello": "control", "token": token} if token else {"hello": "spectator"}
+        )
+        writer.write(json.dumps(hello).encode() + b"\n")
+        welcome = json.loads(await reader.readline())
+        self.width = welcome["width"]
+        deadline = time.monotonic() + duration
+        next_action = 0
+        try:
+            while (timeout := deadline - time.monotonic()) > 0:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not line:
+                    break
+                self.frames += 1
+                self.bytes += len(line)
+                self.apply(json.loads(line))
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(json.dumps({"ack": self.seq}).encode() + b"\n")
+                if welcome["control"] and actions:
+                    action = actions[next_action % len(actions)]
+                    writer.write(json.dumps({"action": action}).encode() + b"\n")
+                    next_action += 1
+        finally:
+            writer.close()
+
+
+async def watch(address: str, spectators: int, duration: float, slow: int = 0):
+    """Connect spectators (the `slow` first ones ack late) and report."""
+    clients = [
+        SpectatorClient(delay=1.0 if i < slow else 0.0) for i in range(spectators)
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(client.run(address, duration) for client in clients),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - start
+    frames = sum(client.frames for client in clients)
+    received = sum(client.bytes for client in clients)
+    print(
+        f"{spectators} spectators: {frames / elapsed:.0f} frames/s in total,"
+        f" {received / max(frames, 1):.0f} bytes per frame,"
+        f" latest frame {max(client.seq for client in clients)}"
+    )
+    return clients
+
+
+def serve_bot_game(
+    address: str, policy: str, seed: int, speed: float, duration: float
+) -> GameServer:
+    """Serve a headless bot game, playing `speed` pieces per second."""
+    engine = LazyBlocksEngine(seed=seed, rules=RuleSet())
+    player = make_policy(policy, seed)
+    server = GameServer(address)
+    server.start(engine)
+    print(f"Serving on {address}, control token {server.control_token}")
+    deadline = time.monotonic() + duration
+    next_piece = time.monotonic()
+    while time.monotonic() < deadline:
+        for action in server.actions():
+            apply_action(engine, action)
+        if time.monotonic() >= next_piece and not engine.game_over:
+            player.play_piece(engine)
+            next_piece += 1 / speed
+        server.publish(engine)
+        time.sleep(0.005)
+    server.close()
+    print(f"Score {engine.score}, {server.dropped} slow clients dropped")
+    return server
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Serve a bot game to spectators, or test a server."
+    )
+    parser.add_argument("mode", choices=["serve", "watch"])
+    parser.add_argument("--address", default="127.0.0.1:8765", help="host:port or path")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds")
+    parser.add_argument("--policy", choices=POLICIES, default="greedy")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--speed", type=float, default=10.0, help="Pieces per second")
+    parser.add_argument("--spectators", type=int, default=100)
+    parser.add_argument("--slow", type=int, default=0, help="Spectators acking late")
+    args = parser.parse_args(argv)
+    if args.mode == "serve":
+        serve_bot_game(args.address, args.policy, args.seed, args.speed, args.duration)
+    else:
+        asyncio.run(watch(args.address, args.spectators, args.duration, args.slow))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,658 @@
+"""
+Headless game host: thousands of concurrent sessions in one process, for
+hosted play and bot ladders.
+
+Each session is a game of the headless engine, played by one client over a
+local TCP port or a Unix socket. Sessions only cost CPU when something happens
+to them: the commands of a client are queued and played in one batch, and the
+timed parts of a game (auto-repeat of held keys, the optional gravity and lock
+delay, idle timeouts) are timers of a hashed timer wheel. No session is polled
+per tick, and a tick of the wheel costs one slot lookup whatever the number of
+sessions; with no timer pending, the host sleeps until a command comes.
+
+Protocol: one JSON object per line, both ways.
+    client  {"hello": "new", "seed": 3, "width": 10, "height": 20,
+             "gravity": 0.5}                            (all but hello optional)
+    client  {"hello": "resume", "session": 12, "token": "..."}
+    server  {"type": "hello", "session": 12, "token": "...", "width": 10,
+             "height": 20}
+    server  {"type": "frame", ...}   (as `LazyBlocks_server`, on the previous one)
+    client  {"press": "left"}, {"release": "left"}     (left, right and down
+                                                        repeat while held)
+    client  {"action": "drop"}       (see `LazyBlocks_server.ACTIONS`)
+
+Frames need no ack: each one applies to the previous one sent on the
+connection, and a full frame (`base` 0) starts every connection. A client too
+slow to read its frames is disconnected. A session outlives its connection
+for `IDLE_TIMEOUT` seconds, so the client can resume it (the game waits, its
+pieces do not fall meanwhile), and a session without a command for that long
+is closed.
+
+    python LazyBlocks_sessions.py serve --address 127.0.0.1:8770
+    python LazyBlocks_sessions.py load --address 127.0.0.1:8770 --sessions 2000
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import math
+import random
+import secrets
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from LazyBlocks_engine import LazyBlocksEngine, RuleSet
+from LazyBlocks_feed import DROP, MOVE_DOWN, MOVE_LEFT, MOVE_RIGHT, apply_action
+from LazyBlocks_server import (
+    ACTIONS,
+    HIGH_WATER,
+    TO_DIGITS,
+    SpectatorClient,
+    frame_events,
+    game_state,
+    parse_address,
+)
+
+TICK = 0.01  # Seconds per tick of the timer wheel
+WHEEL_SLOTS = 512  # Slots of the wheel: a revolution is ~5 s
+MAX_SESSIONS = 10000
+IDLE_TIMEOUT = 300.0  # Seconds without a command before a session is closed
+AUTO_REPEAT_DELAY = 0.17  # Seconds a key is held before it repeats
+AUTO_REPEAT_INTERVAL = 0.05
+LOCK_DELAY = 0.5  # Seconds a piece rests on the stack before gravity drops it
+MAX_QUEUED = 256  # Commands waiting in a session before the client is dropped
+MAX_COMMAND_LINE = 1024
+LISTEN_BACKLOG = 1024  # Connections waiting to be accepted, e.g. a ladder starting
+STATS_INTERVAL = 10.0
+REPEATABLE = {MOVE_LEFT, MOVE_RIGHT, MOVE_DOWN}
+
+
+class Timer:
+    __slots__ = ["deadline", "callback", "args", "cancelled"]
+
+    def __init__(self, deadline: int, callback: Callable, args: tuple):
+        self.deadline = deadline  # In ticks
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: the timers are in the slot of their deadline tick,
+    modulo the number of slots, so that scheduling, cancelling and advancing
+    by a tick are O(1). Timers more than a revolution away stay in their slot
+    until their own revolution. Cancelled timers are left in place and skipped.
+    """
+
+    def __init__(
+        self, tick: float = TICK, slots: int = WHEEL_SLOTS, clock=time.monotonic
+    ):
+        self.tick = tick
+        self.clock = clock
+        self.slots: list[list[Timer]] = [[] for _ in range(slots)]
+        self.current = int(clock() / tick)  # Last tick advanced over
+        self.count = 0  # Pending timers, the cancelled ones excluded
+        self.fired = 0
+
+    def schedule(self, delay: float, callback: Callable, *args) -> Timer:
+        """Call `callback(*args)` in `delay` seconds, rounded up to a tick."""
+        deadline = max(math.ceil((self.clock() + delay) / self.tick), self.current + 1)
+        timer = Timer(deadline, callback, args)
+        self.slots[deadline % len(self.slots)].append(timer)
+        self.count += 1
+        return timer
+
+    def cancel(self, timer: Timer):
+        if not timer.cancelled:
+            timer.cancelled = True
+            self.count -= 1
+
+    def next_deadline(self) -> float:
+        """Time of the next tick to advance over."""
+        return (self.current + 1) * self.tick
+
+    def advance(self, now: float) -> int:
+        """Fire the timers due by `now`, in deadline order. Return their number."""
+        target = int(now / self.tick)
+        if not self.count:
+            self.current = max(self.current, target)
+            return 0
+        slots = self.slots
+        fired = 0
+        if target - self.current >= len(slots):
+            # Late by more than a revolution: sort out every slot once
+            due = []
+            for slot in slots:
+                if slot:
+                    due.extend(timer for timer in slot if timer.deadline <= target)
+                    slot[:] = [timer for timer in slot if timer.deadline > target]
+            self.current = target
+            due.sort(key=lambda timer: timer.deadline)
+            for timer in due:
+                fired += self._fire(timer)
+            return fired
+        while self.current < target and self.count:
+            self.current += 1
+            slot = slots[self.current % len(slots)]
+            if not slot:
+                continue
+            due = [timer for timer in slot if timer.deadline <= self.current]
+            if len(due) < len(slot):
+                slot[:] = [timer for timer in slot if timer.deadline > self.current]
+            else:
+                slot.clear()
+            for timer in due:
+                fired += self._fire(timer)
+        self.current = max(self.current, target)
+        return fired
+
+    def _fire(self, timer: Timer) -> int:
+        if timer.cancelled:
+            return 0
+        timer.cancelled = True
+        self.count -= 1
+        self.fired += 1
+        timer.callback(*timer.args)
+        return 1
+
+
+class Session:
+    """A game, its queued commands and its timers."""
+
+    def __init__(
+        self,
+        host: "SessionHost",
+        session_id: int,
+        engine: LazyBlocksEngine,
+        gravity: Optional[float] = None,
+    ):
+        self.host = host
+        self.id = session_id
+        self.token = secrets.token_hex(8)
+        self.engine = engine
+        self.gravity = gravity  # Seconds per row, None: pieces only fall on demand
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.commands: deque = deque()
+        self.scheduled = False  # Playing the queued commands is scheduled
+        self.held: dict[int, Timer] = {}  # Auto-repeat timer of the held actions
+        self.gravity_timer: Optional[Timer] = None
+        self.lock_timer: Optional[Timer] = None
+        self.last_command = time.monotonic()
+        self.idle_timer = host.schedule(IDLE_TIMEOUT, self.check_idle)
+        if gravity:
+            self.gravity_timer = host.schedule(gravity, self.fall)
+        self.seq = 0
+        self.sent_rows: list[bytes] = []  # Rows of the last frame sent
+        self.sent = None  # Key of the state of the last frame sent
+        self.previous_state: Optional[dict] = None
+
+    # Commands
+
+    def submit(self, command: dict):
+        """Queue a command, played with the others queued in the same loop run."""
+        self.commands.append(command)
+        if not self.scheduled:
+            self.scheduled = True
+            self.host.loop.call_soon(self.play_commands)
+
+    def play_commands(self):
+        self.scheduled = False
+        if self.host.sessions.get(self.id) is not self:
+            return  # Closed meanwhile
+        self.last_command = time.monotonic()
+        while self.commands:
+            command = self.commands.popleft()
+            try:
+                self.execute(command)
+            except (KeyError, TypeError, ValueError, AttributeError):
+                pass  # Unknown commands are ignored
+        self.send_frame()
+
+    def execute(self, command: dict):
+        if "press" in command:
+            action = ACTIONS[command["press"]]
+            if action in REPEATABLE and action not in self.held:
+                self.held[action] = self.host.schedule(
+                    AUTO_REPEAT_DELAY, self.repeat, action
+                )
+            self.act(action)
+        elif "release" in command:
+            timer = self.held.pop(ACTIONS[command["release"]], None)
+            if timer is not None:
+                self.host.wheel.cancel(timer)
+        else:
+            self.act(ACTIONS[command["action"]])
+
+    def act(self, action: int):
+        if apply_action(self.engine, action):
+            self.host.actions += 1
+        if self.engine.game_over:
+            self.stop_timers()
+
+    # Timers
+
+    def repeat(self, action: int):
+        self.act(action)
+        if action in self.held:
+            self.held[action] = self.host.schedule(
+                AUTO_REPEAT_INTERVAL, self.repeat, action
+            )
+        self.send_frame()
+
+    def fall(self):
+        self.gravity_timer = None
+        engine = self.engine
+        if engine.game_over:
+            return
+        if engine.move_current_shape(0, -1):
+            self.send_frame()
+        elif self.lock_timer is None:
+            self.lock_timer = self.host.schedule(LOCK_DELAY, self.lock)
+        self.gravity_timer = self.host.schedule(self.gravity, self.fall)
+
+    def lock(self):
+        """End of the lock delay: drop the piece if it still rests on the stack."""
+        self.lock_timer = None
+        engine = self.engine
+        x, y = engine.current_position
+        if not engine.can_be_placed(engine.current_shape, [x, y - 1]):
+            self.act(DROP)
+            self.send_frame()
+
+    def check_idle(self):
+        idle = time.monotonic() - self.last_command
+        if idle >= IDLE_TIMEOUT:
+            self.host.close_session(self)
+        else:
+            self.idle_timer = self.host.schedule(IDLE_TIMEOUT - idle, self.check_idle)
+
+    def stop_timers(self):
+        for timer in [*self.held.values(), self.gravity_timer, self.lock_timer]:
+            if timer is not None:
+                self.host.wheel.cancel(timer)
+        self.held = {}
+        self.gravity_timer = self.lock_timer = None
+
+    # Frames
+
+    def attach(self, writer: asyncio.StreamWriter):
+        """Play the session on a new connection, starting with a full frame."""
+        if self.writer is not None:
+            self.writer.close()
+        self.writer = writer
+        self.sent_rows = []
+        self.sent = None
+        self.seq = 0
+        if self.gravity and self.gravity_timer is None and not self.engine.game_over:
+            self.gravity_timer = self.host.schedule(self.gravity, self.fall)
+
+    def detach(self):
+        """The client left: the game waits for it, only the idle timer runs."""
+        self.writer = None
+        self.stop_timers()
+
+    def send_frame(self):
+        """Send the rows and state that changed since the last frame, if any."""
+        writer = self.writer
+        if writer is None:
+            return
+        engine = self.engine
+        key = (
+            engine.grid_hash,
+            engine.shapes_cnt,
+            engine.score,
+            engine.current_position,
+            id(engine.current_shape),
+            engine.helper_piece_idx,
+            id(engine.helper_piece_shape),
+            engine.next_shape_idx,
+            engine.game_over,
+        )
+        if key == self.sent:
+            return
+        transport = writer.transport
+        if transport.get_write_buffer_size() > HIGH_WATER:
+            self.host.dropped += 1
+            self.detach()
+            transport.abort()
+            return
+        self.sent = key
+        state = game_state(engine)
+        base = self.seq
+        self.seq += 1
+        cells = bytes(engine.grid.shapes)
+        width = engine.grid_width
+        rows = [cells[start : start + width] for start in range(0, len(cells), width)]
+        sent_rows = self.sent_rows
+        message = {
+            "type": "frame",
+            "seq": self.seq,
+            "base": base,
+            "stored": len(rows),
+            "rows": [
+                [y, row.translate(TO_DIGITS).decode()]
+                for y, row in enumerate(rows)
+                if y >= len(sent_rows) or row != sent_rows[y]
+            ],
+            **state,
+            "events": frame_events(self.previous_state, state, self.seq),
+        }
+        self.sent_rows = rows
+        self.previous_state = state
+        writer.write(json.dumps(message, separators=(",", ":")).encode() + b"\n")
+        self.host.frames += 1
+
+
+class SessionHost:
+    """The sessions of a process, their timer wheel and their server."""
+
+    def __init__(
+        self,
+        address: str,
+        max_sessions: int = MAX_SESSIONS,
+        tick: float = TICK,
+        stats_interval: Optional[float] = STATS_INTERVAL,
+    ):
+        self.address = parse_address(address)
+        self.max_sessions = max_sessions
+        self.stats_interval = stats_interval
+        self.wheel = TimerWheel(tick)
+        self.sessions: dict[int, Session] = {}
+        self.next_id = 1
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.actions = 0
+        self.frames = 0
+        self.dropped = 0
+        self.closed = 0
+
+    def schedule(self, delay: float, callback: Callable, *args) -> Timer:
+        timer = self.wheel.schedule(delay, callback, *args)
+        if self.wakeup is not None and not self.wakeup.is_set():
+            self.wakeup.set()
+        return timer
+
+    def new_session(
+        self,
+        seed: Optional[int] = None,
+        rules: Optional[RuleSet] = None,
+        gravity: Optional[float] = None,
+    ) -> Session:
+        if len(self.sessions) >= self.max_sessions:
+            raise ValueError("Too many sessions")
+        session = Session(self, self.next_id, LazyBlocksEngine(seed, rules), gravity)
+        self.sessions[session.id] = session
+        self.next_id += 1
+        return session
+
+    def close_session(self, session: Session):
+        if self.sessions.pop(session.id, None) is None:
+            return
+        session.stop_timers()
+        self.wheel.cancel(session.idle_timer)
+        if session.writer is not None:
+            session.writer.close()
+            session.writer = None
+        self.closed += 1
+
+    def open_session(self, hello: dict) -> Session:
+        """The session a client asks for in its hello message."""
+        if hello.get("hello") == "resume":
+            session = self.sessions.get(int(hello["session"]))
+            if session is None or not hmac.compare_digest(
+                str(hello.get("token", "")), session.token
+            ):
+                raise ValueError("No such session")
+            return session
+        rules = RuleSet(
+            grid_width=int(hello.get("width", RuleSet.grid_width)),
+            grid_height=int(hello.get("height", RuleSet.grid_height)),
+        )
+        if not (4 <= rules.grid_width <= 64 and 4 <= rules.grid_height <= 256):
+            raise ValueError("Unsupported board size")
+        gravity = hello.get("gravity")
+        if gravity is not None and not 0.01 <= float(gravity) <= 60:
+            raise ValueError("Unsupported gravity")
+        seed = hello.get("seed")
+        return self.new_session(
+            None if seed is None else int(seed),
+            rules,
+            None if gravity is None else float(gravity),
+        )
+
+    async def serve(self, duration: Optional[float] = None):
+        """Serve the sessions, forever or for `duration` seconds."""
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        if self.address[0] == "tcp":
+            self.server = await asyncio.start_server(
+                self._serve_client,
+                self.address[1],
+                self.address[2],
+                limit=MAX_COMMAND_LINE,
+                backlog=LISTEN_BACKLOG,
+            )
+        else:
+            self.server = await asyncio.start_unix_server(
+                self._serve_client,
+                self.address[1],
+                limit=MAX_COMMAND_LINE,
+                backlog=LISTEN_BACKLOG,
+            )
+        tasks = [asyncio.create_task(self._run_wheel())]
+        if self.stats_interval:
+            tasks.append(asyncio.create_task(self._print_stats()))
+        try:
+            async with self.server:
+                await asyncio.wait_for(asyncio.Event().wait(), duration)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            for session in list(self.sessions.values()):
+                self.close_session(session)
+
+    async def _run_wheel(self):
+        wheel = self.wheel
+        while True:
+            if not wheel.count:
+                # Nothing timed: sleep until a timer is scheduled
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            await asyncio.sleep(max(0.0, wheel.next_deadline() - wheel.clock()))
+            wheel.advance(wheel.clock())
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "connected": sum(
+                session.writer is not None for session in self.sessions.values()
+            ),
+            "timers": self.wheel.count,
+            "timers_fired": self.wheel.fired,
+            "actions": self.actions,
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "closed": self.closed,
+            "cpu": time.process_time(),
+        }
+
+    async def _print_stats(self):
+        previous = self.stats()
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            stats = self.stats()
+            cpu = (stats["cpu"] - previous["cpu"]) / self.stats_interval
+            print(
+                f"{stats['sessions']} sessions ({stats['connected']} connected),"
+                f" {stats['timers']} timers,"
+                f" {(stats['actions'] - previous['actions']) / self.stats_interval:.0f}"
+                f" actions/s,"
+                f" {(stats['frames'] - previous['frames']) / self.stats_interval:.0f}"
+                f" frames/s, CPU {cpu:.0%}",
+                flush=True,
+            )
+            previous = stats
+
+    async def _serve_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        session = None
+        try:
+            session = self.open_session(json.loads(await reader.readline()))
+            session.attach(writer)
+            writer.write(
+                json.dumps(
+                    {
+                        "type": "hello",
+                        "session": session.id,
+                        "token": session.token,
+                        "width": session.engine.grid_width,
+                        "height": session.engine.grid_height,
+                    }
+                ).encode()
+                + b"\n"
+            )
+            session.send_frame()
+            while line := await reader.readline():
+                if session.writer is not writer:
+                    break  # Resumed on another connection, or closed
+                session.submit(json.loads(line))
+                if len(session.commands) > MAX_QUEUED:
+                    break
+        except (ConnectionError, ValueError, KeyError, TypeError, AttributeError):
+            pass  # Malformed messages close the connection
+        except asyncio.CancelledError:
+            pass  # The host is shutting down
+        finally:
+            if session is not None and session.writer is writer:
+                session.detach()
+            writer.close()
+
+
+async def play_session(
+    address: str,
+    seed: int,
+    duration: float,
+    interval: float,
+    gravity: Optional[float] = None,
+) -> SpectatorClient:
+    """Test client: a random player sending a command every `interval` s on average."""
+    where = parse_address(address)
+    if where[0] == "tcp":
+        reader, writer = await asyncio.open_connection(where[1], where[2])
+    else:
+        reader, writer = await asyncio.open_unix_connection(where[1])
+    hello = {"hello": "new", "seed": seed}
+    if gravity:
+        hello["gravity"] = gravity
+    writer.write(json.dumps(hello).encode() + b"\n")
+    client = SpectatorClient()
+    client.width = json.loads(await reader.readline())["width"]
+
+    async def read_frames():
+        while line := await reader.readline():
+            client.bytes += len(line)
+            client.frames += 1
+            client.apply(json.loads(line))
+
+    rng = random.Random(seed)
+    reading = asyncio.create_task(read_frames())
+    deadline = time.monotonic() + duration
+    try:
+        while time.monotonic() < deadline and not client.state.get("game_over"):
+            await asyncio.sleep(rng.expovariate(1 / interval))
+            name = rng.choice(["left", "right", "down", "rotate", "drop", "drop"])
+            if name in ("left", "right") and rng.random() < 0.2:
+                # Hold the key long enough to repeat
+                writer.write(json.dumps({"press": name}).encode() + b"\n")
+                await asyncio.sleep(AUTO_REPEAT_DELAY + 2 * AUTO_REPEAT_INTERVAL)
+                writer.write(json.dumps({"release": name}).encode() + b"\n")
+            else:
+                writer.write(json.dumps({"action": name}).encode() + b"\n")
+            await writer.drain()
+        await asyncio.sleep(0.2)  # Let the last frames arrive
+    finally:
+        reading.cancel()
+        writer.close()
+    return client
+
+
+async def load(
+    address: str,
+    sessions: int,
+    duration: float,
+    interval: float,
+    gravity: Optional[float] = None,
+):
+    """Play `sessions` random sessions at once against a host."""
+    started = time.perf_counter()
+    clients = await asyncio.gather(
+        *[
+            play_session(address, seed, duration, interval, gravity)
+            for seed in range(sessions)
+        ],
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - started
+    played = [client for client in clients if isinstance(client, SpectatorClient)]
+    frames = sum(client.frames for client in played)
+    print(
+        f"{len(played)}/{sessions} sessions played,"
+        f" {frames / elapsed:.0f} frames/s,"
+        f" {sum(client.bytes for client in played) / elapsed / 1e3:.0f} kB/s"
+    )
+
+
+def raise_open_files_limit():
+    """Thousands of sessions need as many sockets: lift the soft limit."""
+    try:
+        import resource
+    except ImportError:
+        return  # Not on Unix
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Host many headless game sessions, or load test a host."
+    )
+    parser.add_argument("mode", choices=["serve", "load"])
+    parser.add_argument("--address", default="127.0.0.1:8770", help="host:port or path")
+    parser.add_argument("--duration", type=float, help="Seconds, default: forever")
+    parser.add_argument("--max-sessions", type=int, default=MAX_SESSIONS)
+    parser.add_argument("--sessions", type=int, default=1000, help="Load: sessions")
+    parser.add_argument(
+        "--interval", type=float, default=1.0, help="Load: seconds between commands"
+    )
+    parser.add_argument("--gravity", type=float, help="Load: seconds per row")
+    args = parser.parse_args(argv)
+    raise_open_files_limit()
+    if args.mode == "serve":
+        host = SessionHost(args.address, args.max_sessions)
+        print(f"Hosting up to {args.max_sessions} sessions on {args.address}")
+        asyncio.run(host.serve(args.duration))
+    else:
+        asyncio.run(
+            load(
+                args.address,
+                args.sessions,
+                args.duration or 10.0,
+                args.interval,
+                args.gravity,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+Headless simulation farm: play many seeded LazyBlocks games with a bot policy,
+across all cores, and aggregate the results.
+
+Usage:
+    lazyblocks-sim --games 10000 --policy greedy --helper-probability 0.5
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import asdict, dataclass, replace
+from functools import lru_cache, partial
+from typing import Callable, Iterator, Optional
+
+from LazyBlocks_ai import (
+    FEATURE_HOLES,
+    AutoPlayer,
+    BoardState,
+    Placement,
+    apply_placement,
+    enumerate_placements,
+    play_choice,
+)
+from LazyBlocks_engine import GRID_HEIGHT, GRID_WIDTH, LazyBlocksEngine, RuleSet
+from LazyBlocks_feed import UNDO, apply_action
+from LazyBlocks_search import LookaheadPlanner
+from LazyBlocks_snapshot import Snapshot, load_snapshot_file
+
+
+class RandomPolicy:
+    """Plays a uniformly random legal placement of the current piece."""
+
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+
+    def choose(self, engine: LazyBlocksEngine) -> Optional[tuple[bool, Placement]]:
+        """Return (False, placement), or None if nothing fits."""
+        placements = enumerate_placements(
+            BoardState.from_engine(engine), engine.current_shape_idx
+        )
+        return (False, self.rng.choice(placements)) if placements else None
+
+    def play_piece(self, engine: LazyBlocksEngine) -> bool:
+        choice = self.choose(engine)
+        if choice is None:
+            engine.place_piece_on_grid()
+            engine.spawn_new_shape()
+        else:
+            apply_placement(engine, choice[1])
+        return not engine.game_over
+
+
+class UndoPlayer(AutoPlayer):
+    """
+    Greedy bot that takes back a placement which made new holes, while the rules
+    allow undos: the piece then spawns again, with a new helper piece to swap
+    with, and its second placement is kept.
+    """
+
+    def __init__(self):
+        super().__init__(use_helper=True)
+
+    def retry(
+        self, engine: LazyBlocksEngine, holes_before: int, placement: Placement
+    ) -> bool:
+        """Whether to undo the placement just played, which cleared no rows."""
+        return (
+            not engine.game_over
+            and not placement.lines
+            and engine.features[FEATURE_HOLES] > holes_before
+            and engine.can_undo()
+        )
+
+    def play_piece(
+        self,
+        engine: LazyBlocksEngine,
+        place: Optional[Callable[[Optional[tuple[bool, Placement]]], None]] = None,
+        undo: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        """
+        Place the current piece, and if it made new holes, undo it and place it
+        again. Return False if the game is (or becomes) over.
+
+        The moves go through `place(choice)`, with a choice of `choose` (None
+        to drop the piece where it is), and `undo()`, which play them on the
+        engine by default: they can be replaced to record or observe them too.
+        """
+        if engine.game_over:
+            return False
+        if place is None:
+            place = partial(play_choice, engine)
+        if undo is None:
+            undo = partial(apply_action, engine, UNDO)
+        holes = engine.features[FEATURE_HOLES]
+        choice = self.choose(engine)
+        place(choice)
+        if choice is not None and self.retry(engine, holes, choice[1]):
+            undo()
+            place(self.choose(engine))
+        return not engine.game_over
+
+
+def make_policy(name: str, seed: int, lookahead_depth: int = 2):
+    """Build a bot policy. All of them are deterministic for a given seed."""
+    if name == "greedy":
+        return AutoPlayer()
+    if name == "greedy-helper":
+        return AutoPlayer(use_helper=True)
+    if name == "greedy-undo":
+        return UndoPlayer()
+    if name == "lookahead":
+        # No time budget: the search depth must not depend on the machine load
+        return LookaheadPlanner(max_depth=lookahead_depth, time_budget=math.inf)
+    if name == "random":
+        return RandomPolicy(seed)
+    raise ValueError(f"Unknown policy: {name}")
+
+
+POLICIES = ["greedy", "greedy-helper", "greedy-undo", "lookahead", "random"]
+
+
+@dataclass
+class GameResult:
+    seed: int
+    score: int
+    pieces: int
+    lines: int
+    undos: int
+    swaps: int
+    game_over: bool
+    duration: float
+
+
+@dataclass
+class SimulationConfig:
+    policy: str = "greedy"
+    max_pieces: int = 1000
+    lookahead_depth: int = 2
+    helper_piece_probability: float = 1.0
+    max_undos: Optional[int] = None
+    grid_width: int = GRID_WIDTH
+    grid_height: int = GRID_HEIGHT
+    start: Optional[str] = None  # Snapshot file of the starting position
+
+
+@lru_cache(maxsize=1)
+def load_start(path: str) -> Snapshot:
+    """Starting position, read once per worker process."""
+    return load_snapshot_file(path)
+
+
+def new_game(seed: int, config: SimulationConfig) -> LazyBlocksEngine:
+    """Engine at the start of the game of a seed."""
+    rules = RuleSet(
+        helper_piece_probability=config.helper_piece_probability,
+        max_undos=config.max_undos,
+        grid_width=config.grid_width,
+        grid_height=config.grid_height,
+    )
+    if config.start is None:
+        engine = LazyBlocksEngine(seed=seed, rules=rules)
+    else:
+        # The saved board and pieces, with the config's rules, and this game's
+        # own pieces to come
+        engine = load_start(config.start).to_engine()
+        engine.rules = replace(
+            rules, grid_width=engine.grid_width, grid_height=engine.grid_height
+        )
+        engine.rng.seed(seed)
+    return engine
+
+
+def run_game(seed: int, config: SimulationConfig) -> GameResult:
+    """Play one headless game. The same seed and config always give the same game."""
+    start = time.perf_counter()
+    engine = new_game(seed, config)
+    # A starting snapshot has its own rows, undos and swaps: only count this game's
+    lines, undos, swaps = engine.cleared_rows, engine.undo_count, engine.swap_count
+    policy = make_policy(config.policy, seed, config.lookahead_depth)
+    pieces = 0
+    while not engine.game_over and pieces < config.max_pieces:
+        policy.play_piece(engine)
+        pieces += 1
+    return GameResult(
+        seed=seed,
+        score=engine.score,
+        pieces=pieces,
+        lines=engine.cleared_rows - lines,
+        undos=engine.undo_count - undos,
+        swaps=engine.swap_count - swaps,
+        game_over=engine.game_over,
+        duration=time.perf_counter() - start,
+    )
+
+
+def run_games(seeds: list[int], config: SimulationConfig) -> list[GameResult]:
+    """Worker task: play a batch of games."""
+    return [run_game(seed, config) for seed in seeds]
+
+
+class RunningStats:
+    """Mean and variance in constant memory (Welford's algorithm)."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def confidence_interval(self, z: float = 1.96) -> tuple[float, float]:
+        """Normal approximation of the confidence interval of the mean (95% default)."""
+        half_width = z * self.std / math.sqrt(self.count) if self.count else 0.0
+        return (self.mean - half_width, self.mean + half_width)
+
+
+def simulate(
+    num_games: int,
+    config: SimulationConfig,
+    base_seed: int = 0,
+    workers: Optional[int] = None,
+    batch_size: int = 1,
+) -> Iterator[GameResult]:
+    """
+    Play `num_games` games with the seeds `base_seed, base_seed + 1, ...` on a
+    process pool, yielding each result as soon as its batch finishes. Only a few
+    batches per worker are in flight at any time, so memory stays bounded for
+    millions of games.
+    """
+    workers = workers or os.cpu_count() or 1
+    seeds = iter(range(base_seed, base_seed + num_games))
+
+    def next_batch():
+        return [seed for _, seed in zip(range(batch_size), seeds)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        while True:
+            while len(pending) < workers * 4:
+                batch = next_batch()
+                if not batch:
+                    break
+                pending.add(executor.submit(run_games, batch, config))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="lazyblocks-sim", description="Run seeded headless LazyBlocks games."
+    )
+    parser.add_argument("--games", type=int, default=100, help="Number of games")
+    parser.add_argument("--policy", choices=POLICIES, default="greedy")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first game")
+    parser.add_argument("--workers", type=int, default=None, help="Default: all cores")
+    parser.add_argument("--batch-size", type=int, default=1, help="Games per task")
+    parser.add_argument("--max-pieces", type=int, default=1000)
+    parser.add_argument("--lookahead-depth", type=int, default=2)
+    parser.add_argument("--helper-probability", type=float, default=1.0)
+    parser.add_argument("--max-undos", type=int, default=None)
+    parser.add_argument("--board-width", type=int, default=GRID_WIDTH)
+    parser.add_argument("--board-height", type=int, default=GRID_HEIGHT)
+    parser.add_argument(
+        "--start", default=None, help="Snapshot or autosave file to start from"
+    )
+    parser.add_argument(
+        "--output",
+        default="-",
+        help="JSON lines file for per-game results (- for stdout)",
+    )
+    args = parser.parse_args(argv)
+
+    config = SimulationConfig(
+        policy=args.policy,
+        max_pieces=args.max_pieces,
+        lookahead_depth=args.lookahead_depth,
+        helper_piece_probability=args.helper_probability,
+        max_undos=args.max_undos,
+        grid_width=args.board_width,
+        grid_height=args.board_height,
+        start=args.start,
+    )
+    metrics = ["score", "pieces", "lines", "undos", "swaps"]
+    stats = {metric: RunningStats() for metric in metrics}
+    games_over = 0
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    start = time.perf_counter()
+    try:
+        for result in simulate(
+            args.games, config, args.seed, args.workers, args.batch_size
+        ):
+            output.write(json.dumps(asdict(result)) + "\n")
+            for metric in metrics:
+                stats[metric].add(getattr(result, metric))
+            games_over += result.game_over
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "config": asdict(config),
+        "games": stats["score"].count,
+        "games_over": games_over,
+        "elapsed": elapsed,
+    }
+    for metric, stat in stats.items():
+        low, high = stat.confidence_interval()
+        summary[metric] = {"mean": stat.mean, "std": stat.std, "ci95": [low, high]}
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
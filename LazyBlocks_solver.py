@@ -0,0 +1,242 @@
+"""
+Board-clear solver: can every filled row be cleared within K placements?
+
+Used to generate puzzle challenges, and to check that boards left by lazy play
+can still be recovered. Run this module to time the solver on seeded boards:
+    python LazyBlocks_solver.py
+"""
+
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from LazyBlocks_ai import BoardState, Placement, apply_placement, enumerate_placements
+from LazyBlocks_engine import SHAPES, LazyBlocksEngine, row_hash
+from LazyBlocks_search import TranspositionTable
+
+# Cells of a piece. Every shape has as many, which makes the parity pruning exact.
+PIECE_CELLS = sum(map(sum, SHAPES[0]))
+assert all(sum(map(sum, shape)) == PIECE_CELLS for shape in SHAPES)
+
+
+class SolverLimit(Exception):
+    """Raised inside the solver when its node budget is exhausted."""
+
+
+@dataclass
+class SolverMove:
+    swap: bool  # Place the helper piece instead of the current one
+    placement: Placement
+
+
+@dataclass
+class SolverResult:
+    solved: Optional[bool]  # None if the node budget ran out before an answer
+    moves: list[SolverMove] = field(default_factory=list)
+    nodes: int = 0
+    elapsed: float = 0.0
+
+
+def area_left(board: BoardState) -> tuple[int, int]:
+    """(filled cells, empty cells of the non-empty rows) of a board."""
+    cells = sum(board.row_counts)
+    missing = sum(board.width - count for count in board.row_counts if count)
+    return cells, missing
+
+
+def area_after(
+    board: BoardState, placement: Placement, cells: int, missing: int
+) -> tuple[int, int]:
+    """`area_left` of the board after a placement, from the one before."""
+    width = board.width
+    for r, piece_cells in enumerate(placement.profile.row_cells):
+        before = board.row_counts[placement.base + r]
+        after = before + piece_cells
+        missing -= width - before if before else 0
+        missing += width - after if after < width else 0
+    return cells + PIECE_CELLS - width * placement.lines, missing
+
+
+def can_finish(cells: int, missing: int, width: int, placements: int) -> bool:
+    """
+    Whether the area left to fill allows an empty board within `placements`.
+
+    Every non-empty row has to be completed, which takes at least its empty
+    cells. And as a clear removes `width` cells, the filled cells plus those
+    of the placed pieces must add up to a multiple of the width.
+    """
+    for count in range(-(-missing // PIECE_CELLS), placements + 1):
+        if (cells + count * PIECE_CELLS) % width == 0:
+            return True
+    return False
+
+
+def placement_hash(engine: LazyBlocksEngine, placement: Placement) -> int:
+    """Change of the engine's `grid_hash` made by writing a placement."""
+    row_bits: dict[int, int] = {}
+    for c, bits in enumerate(placement.profile.column_bits):
+        y = placement.base
+        while bits:
+            if bits & 1:
+                row_bits[y] = row_bits.get(y, 0) | 1 << (placement.x + c)
+            bits >>= 1
+            y += 1
+    row_masks = engine.board_features.row_masks
+    h = 0
+    for y, bits in row_bits.items():
+        before = row_masks[y] if y < len(row_masks) else 0
+        h ^= row_hash(y, before) ^ row_hash(y, before | bits)
+    return h
+
+
+class BoardClearSolver:
+    """
+    Iterative deepening search for the shortest sequence of placements that
+    empties the board, with the pieces of a known queue.
+
+    At each step the current or the helper piece of the queue can be placed
+    (the helper is drawn again at every spawn, so a swap only lasts for one
+    placement). Placements are explored with `make_placement` /
+    `unmake_placement` on the engine itself. Positions that cannot be emptied
+    in time are remembered by their `grid_hash` and queue step, and
+    positions whose area or cell parity rule out an empty board are pruned
+    without a search.
+    """
+
+    def __init__(
+        self,
+        max_nodes: Optional[int] = None,
+        table: Optional[TranspositionTable] = None,
+    ):
+        self.max_nodes = max_nodes
+        self.table = TranspositionTable(capacity=1_000_000) if table is None else table
+        self.pieces: list[tuple[int, Optional[int]]] = []
+        self.nodes = 0
+
+    def solve(
+        self,
+        engine: LazyBlocksEngine,
+        max_placements: int,
+        pieces: Optional[list[tuple[int, Optional[int]]]] = None,
+    ) -> SolverResult:
+        """
+        Shortest way to empty the board within `max_placements`. `pieces` are
+        the (current, helper) shapes of each placement, by default the ones the
+        engine will draw. The engine is left as it was.
+        """
+        start = time.perf_counter()
+        self.pieces = (
+            engine.preview_pieces(max_placements) if pieces is None else pieces
+        )
+        assert len(self.pieces) >= max_placements, "Not enough pieces in the queue"
+        # Dead ends depend on the queue, so they are only valid for one solve
+        self.table.clear()
+        self.nodes = 0
+        result = SolverResult(solved=False)
+        moves: list[SolverMove] = []
+        try:
+            for placements in range(max_placements + 1):
+                if self._search(engine, 0, placements, moves):
+                    result = SolverResult(solved=True, moves=moves)
+                    break
+        except SolverLimit:
+            result = SolverResult(solved=None)
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def _search(
+        self,
+        engine: LazyBlocksEngine,
+        step: int,
+        placements: int,
+        moves: list[SolverMove],
+    ) -> bool:
+        """Whether the board can be emptied within `placements`, from queue `step`."""
+        board = BoardState.from_engine(engine)
+        cells, missing = area_left(board)
+        if not cells:
+            return True
+        if not placements or not can_finish(cells, missing, board.width, placements):
+            return False
+        key = (engine.grid_hash, step)
+        failed = self.table.get(key)
+        if failed is not None and failed >= placements:
+            return False
+
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise SolverLimit()
+        current_idx, helper_idx = self.pieces[step]
+        next_idx = self.pieces[step + 1][0] if step + 1 < len(self.pieces) else None
+        candidates = [(False, current_idx)]
+        if helper_idx not in (None, current_idx):
+            candidates.append((True, helper_idx))
+        for swap, shape_idx in candidates:
+            # Try the placements completing rows first, then the low ones
+            for placement in sorted(
+                enumerate_placements(board, shape_idx),
+                key=lambda p: (-p.lines, p.base),
+            ):
+                # Prune before writing the piece, the cheap tests first
+                after = area_after(board, placement, cells, missing)
+                if after[0] and not can_finish(*after, board.width, placements - 1):
+                    continue
+                if not placement.lines:
+                    failed = self.table.get(
+                        (engine.grid_hash ^ placement_hash(engine, placement), step + 1)
+                    )
+                    if failed is not None and failed >= placements - 1:
+                        continue
+
+                undo = engine.make_placement(
+                    placement.profile.shape, placement.position, shape_idx
+                )
+                try:
+                    if next_idx is not None and not engine.can_be_placed(
+                        SHAPES[next_idx], engine.spawn_position(SHAPES[next_idx])
+                    ):
+                        continue  # Game over at the next spawn
+                    moves.append(SolverMove(swap, placement))
+                    if self._search(engine, step + 1, placements - 1, moves):
+                        return True
+                    moves.pop()
+                finally:
+                    engine.unmake_placement(undo)
+        self.table.put(key, placements, placements)
+        return False
+
+
+def play_solution(engine: LazyBlocksEngine, result: SolverResult):
+    """Play the moves of a solution found for the engine's own piece queue."""
+    for move in result.moves:
+        if move.swap:
+            engine.swap_current_and_helper()
+        apply_placement(engine, move.placement)
+
+
+def random_board(seed: int, placements: int) -> LazyBlocksEngine:
+    """Engine after random placements of its pieces, e.g. as a puzzle start."""
+    rng = random.Random(seed)
+    engine = LazyBlocksEngine(seed=seed)
+    for _ in range(placements):
+        options = enumerate_placements(
+            BoardState.from_engine(engine), engine.current_shape_idx
+        )
+        apply_placement(engine, rng.choice(options))
+    return engine
+
+
+if __name__ == "__main__":
+    solver = BoardClearSolver()
+    for seed in range(10):
+        engine = random_board(seed, placements=3)
+        result = solver.solve(engine, max_placements=10)
+        if result.solved:
+            play_solution(engine, result)
+            assert not any(engine.board_features.row_masks)
+        print(
+            f"seed {seed}: solved={result.solved} in {len(result.moves)} placements,"
+            f" {result.nodes} nodes, {result.elapsed:.2f} s"
+        )
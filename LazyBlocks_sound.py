@@ -0,0 +1,115 @@
+"""Pooled, rate-limited sound playback for LazyBlocks."""
+
+import math
+import time
+from dataclasses import dataclass, field
+
+import arcade
+from pyglet import media
+
+
+@dataclass
+class SoundEffect:
+    """A loaded sound with a fixed pool of reusable players."""
+
+    sound: arcade.Sound
+    voices: int = 1
+    min_interval: float = 0.0  # Minimum time (seconds) between two playbacks
+    volume: float = 1.0
+    players: list[media.Player] = field(default_factory=list)
+    next_voice: int = 0
+    last_played: float = -math.inf
+
+
+class SoundEngine:
+    """
+    Play sound effects through a bounded pool of players.
+
+    Requests made with `play` are coalesced until `flush` is called, so the
+    same effect requested several times within one tick (e.g. one request per
+    cleared row) is played only once. Each effect owns at most `voices` pyglet
+    players that are reused between playbacks; when all of them are busy the
+    oldest one is restarted (voice stealing). Playbacks closer together than
+    `min_interval` are dropped.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.effects: dict[str, SoundEffect] = {}
+        self.pending: dict[str, None] = {}  # Ordered set of effects to play
+        self.clock = clock
+        self.enabled = True
+        self.listener = None  # Called with the name of every effect started
+
+    def register(
+        self,
+        name: str,
+        file_name: str,
+        voices: int = 1,
+        min_interval: float = 0.0,
+        volume: float = 1.0,
+    ):
+        """Load a sound file and register it under the given effect name."""
+        assert voices > 0
+        self.effects[name] = SoundEffect(
+            sound=arcade.load_sound(file_name),
+            voices=voices,
+            min_interval=min_interval,
+            volume=volume,
+        )
+
+    def play(self, name: str):
+        """Request an effect; it is started on the next `flush`."""
+        if name not in self.effects:
+            raise KeyError(f"Unknown sound effect: {name}")
+        self.pending[name] = None
+
+    def flush(self):
+        """Start every effect requested since the last flush, once each."""
+        if not self.pending:
+            return
+        now = self.clock()
+        for name in self.pending:
+            effect = self.effects[name]
+            if not self.enabled or now - effect.last_played < effect.min_interval:
+                continue
+            effect.last_played = now
+            self._start_voice(effect)
+            if self.listener is not None:
+                self.listener(name)
+        self.pending.clear()
+
+    def _start_voice(self, effect: SoundEffect):
+        """Start the effect on an idle player, or steal the oldest one."""
+        player = None
+        for candidate in effect.players:
+            if not candidate.playing:
+                player = candidate
+                break
+
+        if player is None and len(effect.players) < effect.voices:
+            player = media.Player()
+            player.volume = effect.volume
+            effect.players.append(player)
+
+        if player is None:
+            # All voices are busy: restart the one that was started first
+            player = effect.players[effect.next_voice]
+            effect.next_voice = (effect.next_voice + 1) % effect.voices
+
+        if player.source is None:
+            # The source is dropped from the player once it reaches its end
+            player.queue(effect.sound.source)
+        else:
+            player.seek(0.0)
+        player.play()
+
+    def active_players(self) -> int:
+        """Number of players currently allocated across all effects."""
+        return sum(len(effect.players) for effect in self.effects.values())
+
+    def stop_all(self):
+        """Pause every player and drop pending requests."""
+        self.pending.clear()
+        for effect in self.effects.values():
+            for player in effect.players:
+                player.pause()
@@ -0,0 +1,326 @@
+"""
+Spectator wall: many concurrent games side by side, e.g. bot games or a
+tournament.
+
+Every cell of every board is a sprite of one `SpriteList`, so a frame draws
+all the boards with a single instanced draw call (and the labels with a single
+text batch), instead of the hundreds of immediate draws per board of
+`LazyBlocks.on_draw`. Only the cells whose color changed since the previous
+frame are written to the sprite buffers.
+
+Usage:
+    lazyblocks-spectate --boards 64 --policy greedy-helper
+"""
+
+import argparse
+import math
+import time
+from typing import Optional
+
+import arcade
+import pyglet
+from PIL import Image, ImageDraw
+
+from LazyBlocks_camera import BoardCamera
+from LazyBlocks_engine import (
+    EMPTY_CELL_COLOR,
+    GRID_HEIGHT,
+    GRID_SIZE,
+    GRID_WIDTH,
+    LazyBlocksEngine,
+    RuleSet,
+)
+from LazyBlocks_sim import POLICIES, make_policy
+
+SCREEN_WIDTH = 1280
+SCREEN_HEIGHT = 800
+SCREEN_TITLE = "LazyBlocks Spectator"
+
+BACKGROUND_COLOR = arcade.color.DARK_BLUE_GRAY
+LABEL_COLOR = arcade.color.WHITE
+GAME_OVER_COLOR = arcade.color.RED
+LABEL_HEIGHT = 14  # Pixels above each board for its score
+STATUS_BAR_HEIGHT = 24
+TILE_GAP = 8  # Pixels between boards
+# Laying out a text is slow: when many scores change at once, the labels are
+# updated over the next frames rather than all in one
+LABEL_UPDATES_PER_FRAME = 4
+LABEL_GLYPHS = "0123456789 Game over: boards, playing, FPS"
+
+# Cell texture: white, with a darker border, tinted by the sprite color
+CELL_TEXTURE_SIZE = 16
+
+
+def cell_texture() -> arcade.Texture:
+    image = Image.new("RGBA", (CELL_TEXTURE_SIZE, CELL_TEXTURE_SIZE), "white")
+    ImageDraw.Draw(image).rectangle(
+        (0, 0, CELL_TEXTURE_SIZE - 1, CELL_TEXTURE_SIZE - 1), outline=(96, 96, 96)
+    )
+    return arcade.Texture(image, hash="lazyblocks-spectator-cell")
+
+
+def board_colors(engine: LazyBlocksEngine, camera: BoardCamera) -> list[tuple]:
+    """
+    Colors of the cells on screen, row by row from the bottom, with the
+    current piece drawn over the grid.
+    """
+    cells = engine.grid.cells(camera.bottom, camera.bottom + camera.visible_rows)
+    colors = list(map(engine.palette.__getitem__, cells))
+    if engine.current_shape and not engine.game_over:
+        width = engine.grid_width
+        left, top = engine.current_position
+        for y, row in enumerate(engine.current_shape):
+            if camera.is_visible(top - y):
+                start = (top - y - camera.bottom) * width + left
+                for x, cell in enumerate(row):
+                    if cell:
+                        colors[start + x] = engine.current_shape_color
+    return colors
+
+
+def wall_layout(
+    boards: int, columns: int, rows: int, width: int, height: int
+) -> tuple[int, int]:
+    """
+    (tiles per line, cell size in pixels) showing the most of every board:
+    `boards` boards of `columns` x `rows` cells in a `width` x `height` area.
+    """
+    best = (1, 0)
+    for per_line in range(1, boards + 1):
+        lines = math.ceil(boards / per_line)
+        cell_size = min(
+            (width - TILE_GAP * (per_line + 1)) // (per_line * columns),
+            (height - (TILE_GAP + LABEL_HEIGHT) * lines) // (lines * rows),
+        )
+        if cell_size > best[1]:
+            best = (per_line, cell_size)
+    # No larger than the cells of the game view
+    return best[0], min(best[1], GRID_SIZE)
+
+
+class SpectatorBoard:
+    """One board of the wall: its engine, player, camera and sprites."""
+
+    def __init__(
+        self,
+        engine: LazyBlocksEngine,
+        player,
+        camera: BoardCamera,
+        sprites: list[arcade.BasicSprite],
+        label: arcade.Text,
+    ):
+        self.engine = engine
+        self.player = player  # None for boards played elsewhere
+        self.camera = camera
+        self.sprites = sprites
+        self.label = label
+        self.colors: list[Optional[tuple]] = [None] * len(sprites)
+        self.state = None
+        self.label_state = None
+
+    def refresh(self):
+        """Write the cells that changed since the last frame to the sprites."""
+        engine = self.engine
+        # Boards that did not change since the last frame cost nothing
+        state = (
+            engine.grid_hash,
+            engine.shapes_cnt,
+            engine.current_position,
+            id(engine.current_shape),
+            engine.score,
+            engine.game_over,
+        )
+        if state == self.state:
+            return
+        self.state = state
+
+        if engine.current_shape and not engine.game_over:
+            top = engine.current_position[1]
+            self.camera.follow(
+                top - len(engine.current_shape) + 1, top, engine.stack_height
+            )
+        else:
+            self.camera.follow(0, engine.stack_height)
+        colors = board_colors(engine, self.camera)
+        previous = self.colors
+        for i, color in enumerate(colors):
+            if color != previous[i]:
+                self.sprites[i].color = color
+        self.colors = colors
+
+    def refresh_label(self) -> bool:
+        """Update the score label if it changed. Return True if it did."""
+        engine = self.engine
+        label = (engine.score, engine.game_over)
+        if label == self.label_state:
+            return False
+        self.label_state = label
+        self.label.text = (
+            f"Game over: {engine.score}" if engine.game_over else f"{engine.score}"
+        )
+        self.label.color = GAME_OVER_COLOR if engine.game_over else LABEL_COLOR
+        return True
+
+
+class SpectatorView(arcade.View):
+    """
+    Wall of boards. With players, the view plays `pieces_per_second` pieces
+    per board; without, it only shows engines updated by someone else.
+    """
+
+    def __init__(
+        self,
+        engines: list[LazyBlocksEngine],
+        players: Optional[list] = None,
+        pieces_per_second: float = 10.0,
+    ):
+        super().__init__()
+        assert engines, "Nothing to watch"
+        self.players = players or [None] * len(engines)
+        assert len(self.players) == len(engines)
+        self.pieces_per_second = pieces_per_second
+        self.pending_pieces = 0.0
+        self.next_board = 0  # Next board to play a piece on
+        self.next_label = 0  # Next board to update the label of
+
+        columns = engines[0].grid_width
+        rows = min(engines[0].grid_height, GRID_HEIGHT)
+        assert all(
+            (e.grid_width, e.grid_height) == (columns, engines[0].grid_height)
+            for e in engines
+        ), "Mixed board sizes"
+        per_line, cell_size = wall_layout(
+            len(engines),
+            columns,
+            rows,
+            SCREEN_WIDTH,
+            SCREEN_HEIGHT - STATUS_BAR_HEIGHT,
+        )
+        assert cell_size > 0, "Too many boards for the window"
+
+        texture = cell_texture()
+        scale = cell_size / CELL_TEXTURE_SIZE
+        self.cells = arcade.SpriteList(capacity=len(engines) * columns * rows)
+        self.text_batch = pyglet.graphics.Batch()
+        self.boards = []
+        tile_width = columns * cell_size + TILE_GAP
+        tile_height = rows * cell_size + TILE_GAP + LABEL_HEIGHT
+        top = SCREEN_HEIGHT - STATUS_BAR_HEIGHT
+        for i, (engine, player) in enumerate(zip(engines, self.players)):
+            left = TILE_GAP + (i % per_line) * tile_width
+            bottom = top - (i // per_line + 1) * tile_height
+            camera = BoardCamera(
+                columns,
+                engine.grid_height,
+                view_width=columns * cell_size,
+                view_height=rows * cell_size,
+            )
+            sprites = []
+            for y in range(rows):
+                for x in range(columns):
+                    sprite = arcade.BasicSprite(
+                        texture,
+                        scale=scale,
+                        center_x=left + (x + 0.5) * cell_size,
+                        center_y=bottom + (y + 0.5) * cell_size,
+                    )
+                    sprite.color = EMPTY_CELL_COLOR
+                    sprites.append(sprite)
+            self.cells.extend(sprites)
+            label = arcade.Text(
+                "",
+                x=left,
+                y=bottom + rows * cell_size + 2,
+                color=LABEL_COLOR,
+                font_size=LABEL_HEIGHT * 0.6,
+                batch=self.text_batch,
+            )
+            self.boards.append(SpectatorBoard(engine, player, camera, sprites, label))
+
+        self.status_text = arcade.Text(
+            "",
+            x=TILE_GAP,
+            y=SCREEN_HEIGHT - STATUS_BAR_HEIGHT + 6,
+            color=LABEL_COLOR,
+            font_size=12,
+            batch=self.text_batch,
+        )
+        # Render the glyphs of the texts once, instead of in the middle of the
+        # game the first time a digit shows up
+        for text in (self.boards[0].label, self.status_text):
+            text.text = LABEL_GLYPHS
+            text.text = ""
+        self.frames = 0
+        self.frames_start = time.perf_counter()
+
+    def on_show_view(self):
+        arcade.set_background_color(BACKGROUND_COLOR)
+
+    def on_update(self, delta_time: float):
+        """
+        Play the pieces due since the last frame. The boards take turns, so
+        that the work is spread evenly over the frames.
+        """
+        self.pending_pieces += delta_time * self.pieces_per_second * len(self.boards)
+        for _ in range(int(self.pending_pieces)):
+            self.pending_pieces -= 1
+            board = self.boards[self.next_board]
+            self.next_board = (self.next_board + 1) % len(self.boards)
+            if board.player is not None and not board.engine.game_over:
+                board.player.play_piece(board.engine)
+
+    def on_draw(self):
+        self.clear()
+        for board in self.boards:
+            board.refresh()
+        updates = 0
+        for _ in range(len(self.boards)):
+            board = self.boards[self.next_label]
+            self.next_label = (self.next_label + 1) % len(self.boards)
+            updates += board.refresh_label()
+            if updates == LABEL_UPDATES_PER_FRAME:
+                break
+        self.cells.draw(pixelated=True)
+        self.text_batch.draw()
+
+        self.frames += 1
+        elapsed = time.perf_counter() - self.frames_start
+        if elapsed >= 1.0:
+            playing = sum(not board.engine.game_over for board in self.boards)
+            self.status_text.text = (
+                f"{len(self.boards)} boards, {playing} playing,"
+                f" {self.frames / elapsed:.0f} FPS"
+            )
+            self.frames = 0
+            self.frames_start = time.perf_counter()
+
+    def on_key_press(self, key, modifiers):
+        if key == arcade.key.ESCAPE:
+            arcade.close_window()
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="lazyblocks-spectate", description="Watch bot games side by side."
+    )
+    parser.add_argument("--boards", type=int, default=16)
+    parser.add_argument("--policy", choices=POLICIES, default="greedy-helper")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first game")
+    parser.add_argument("--speed", type=float, default=10.0, help="Pieces per second")
+    parser.add_argument("--board-width", type=int, default=GRID_WIDTH)
+    parser.add_argument("--board-height", type=int, default=GRID_HEIGHT)
+    args = parser.parse_args(argv)
+
+    rules = RuleSet(grid_width=args.board_width, grid_height=args.board_height)
+    seeds = range(args.seed, args.seed + args.boards)
+    engines = [LazyBlocksEngine(seed=seed, rules=rules) for seed in seeds]
+    players = [make_policy(args.policy, seed) for seed in seeds]
+
+    window = arcade.Window(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE, vsync=True)
+    window.set_update_rate(1 / 60)
+    window.show_view(SpectatorView(engines, players, pieces_per_second=args.speed))
+    arcade.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import random
+
+import numpy as np
+import pytest
+
+import LazyBlocks_ai
+import LazyBlocks_batch
+from LazyBlocks_ai import BoardState, HeuristicEvaluator, enumerate_placements
+from LazyBlocks_batch import BatchEvaluator, pack_placements
+from LazyBlocks_engine import SHAPES
+
+
+def random_board(width: int, height: int, stack: int, seed: int) -> BoardState:
+    """A stack of rows with one or two gaps each, some rows almost full."""
+    rng = random.Random(seed)
+    masks = [0] * width
+    for y in range(stack):
+        gaps = rng.sample(range(width), rng.choice([1, 1, 2]))
+        for x in range(width):
+            if x not in gaps:
+                masks[x] |= 1 << y
+    row_counts = [sum(mask >> y & 1 for mask in masks) for y in range(height)]
+    heights = [mask.bit_length() for mask in masks]
+    holes = sum(h - mask.bit_count() for h, mask in zip(heights, masks))
+    return BoardState(heights, masks, row_counts, holes, width, height)
+
+
+BOARDS = [
+    (10, 20, 6),
+    (10, 600, 302),  # Stack above the float64 masks
+    (300, 40, 12),  # x beyond a byte
+    (300, 600, 290),
+]
+
+
+@pytest.fixture(params=[True, False], ids=["kernels", "numpy"])
+def kernels(request, monkeypatch):
+    if not request.param:
+        monkeypatch.setattr(LazyBlocks_ai, "KERNELS", None)
+        monkeypatch.setattr(LazyBlocks_batch, "KERNELS", None)
+
+
+@pytest.mark.parametrize("width, height, stack", BOARDS)
+def test_batch_matches_scalar(kernels, width, height, stack):
+    board = random_board(width, height, stack, seed=width + stack)
+    placements = []
+    for shape_idx in range(len(SHAPES)):
+        placements += enumerate_placements(board, shape_idx)
+    assert any(p.lines for p in placements)
+    scalar = HeuristicEvaluator()
+    expected = [scalar.features(board, p) for p in placements]
+    batch = BatchEvaluator()
+    assert batch.features(board, placements).tolist() == [list(f) for f in expected]
+    assert batch.evaluate_all(board, placements) == [
+        scalar.evaluate(board, p) for p in placements
+    ]
+
+
+def board_from_rows(rows: list[str], height: int = 20) -> BoardState:
+    """A board from rows of "#" and ".", bottom row first."""
+    width = len(rows[0])
+    masks = [0] * width
+    for y, row in enumerate(rows):
+        for x, cell in enumerate(row):
+            if cell == "#":
+                masks[x] |= 1 << y
+    row_counts = [sum(mask >> y & 1 for mask in masks) for y in range(height)]
+    heights = [mask.bit_length() for mask in masks]
+    holes = sum(h - mask.bit_count() for h, mask in zip(heights, masks))
+    return BoardState(heights, masks, row_counts, holes, width, height)
+
+
+@pytest.mark.parametrize(
+    "rows",
+    [
+        ["##########", "###.######"],
+        ["##########", "##.#######", "##########", "#######.##"],
+        [".#########", "##########", "##.##.####", "#########."],
+    ],
+)
+def test_batch_matches_scalar_with_uncleared_full_rows(kernels, rows):
+    # Full rows the player has not cleared yet, under rows a piece can complete
+    board = board_from_rows(rows)
+    scalar = HeuristicEvaluator()
+    batch = BatchEvaluator()
+    completing = 0
+    for shape_idx in range(len(SHAPES)):
+        placements = enumerate_placements(board, shape_idx)
+        completing += sum(p.lines > 0 for p in placements)
+        expected = [list(scalar.features(board, p)) for p in placements]
+        assert batch.features(board, placements).tolist() == expected
+        assert batch.evaluate_all(board, placements) == [
+            scalar.evaluate(board, p) for p in placements
+        ]
+    assert completing
+
+
+def test_pack_placements_keeps_wide_fields():
+    board = random_board(300, 600, 290, seed=1)
+    placements = enumerate_placements(board, 0)
+    packed = pack_placements(placements)
+    assert packed[:, 2].tolist() == [p.base for p in placements]
+    assert packed[:, 3].tolist() == [p.x for p in placements]
+    assert packed[:, 1].tolist() == [p.lines for p in placements]
+    assert packed.dtype == np.int64 and packed.shape == (len(placements), 4)
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+
+from LazyBlocks_camera import BoardCamera
+from LazyBlocks_engine import LazyBlocksEngine, RuleSet
+from LazyBlocks_feed import MOVE_DOWN, apply_action
+from LazyBlocks_sim import RandomPolicy
+
+try:
+    from LazyBlocks_spectator import SpectatorBoard
+except ImportError:  # No arcade
+    SpectatorBoard = None
+
+
+@pytest.mark.parametrize("width, height", [(10, 10_000), (6, 3_000), (10, 20)])
+def test_piece_and_stack_top_stay_on_screen(width, height):
+    engine = LazyBlocksEngine(
+        seed=1, rules=RuleSet(grid_width=width, grid_height=height)
+    )
+    camera = BoardCamera(width, height)
+    policy = RandomPolicy(1)
+    for _ in range(400):
+        if engine.game_over:
+            break
+        # The spawn, then the piece falling
+        for _ in range(3):
+            top = engine.current_position[1]
+            low = top - len(engine.current_shape) + 1
+            camera.follow(low, top, engine.stack_height)
+            assert camera.is_visible(low) and camera.is_visible(top)
+            assert camera.is_visible(max(engine.stack_height - 1, 0))
+            apply_action(engine, MOVE_DOWN)
+        policy.play_piece(engine)
+    if height > 20:
+        assert engine.stack_height > 2 * camera.visible_rows
+
+
+@pytest.mark.skipif(SpectatorBoard is None, reason="arcade is not installed")
+def test_spectator_tile_keeps_the_stack_top_on_screen():
+    engine = LazyBlocksEngine(seed=2, rules=RuleSet(grid_width=10, grid_height=5_000))
+    # A tile of the wall, smaller than the game view
+    camera = BoardCamera(10, 5_000, view_width=80, view_height=96)
+    sprites = [SimpleNamespace(color=None) for _ in range(10 * camera.visible_rows)]
+    board = SpectatorBoard(engine, RandomPolicy(2), camera, sprites, label=None)
+    for _ in range(300):
+        board.refresh()
+        stack_top = max(engine.stack_height - 1, 0)
+        assert camera.is_visible(stack_top)
+        # The spawn is further above the stack than the tile's rows
+        top = engine.current_position[1]
+        assert camera.is_visible(top) == (top - stack_top < camera.visible_rows)
+        board.player.play_piece(engine)
+    assert engine.stack_height > 2 * camera.visible_rows
+
+
+def test_default_board_spawns_at_the_top():
+    engine = LazyBlocksEngine(seed=0)
+    assert engine.current_position[1] == engine.grid_height - 1
+    camera = BoardCamera(engine.grid_width, engine.grid_height)
+    camera.follow(0, 19, 20)
+    assert camera.rows == range(0, 20)
+
+
+def test_follow_scrolls_the_least_needed():
+    camera = BoardCamera(10, 1_000)
+    camera.follow(500, 503)
+    assert camera.rows == range(488, 508)
+    camera.follow(498, 501)
+    assert camera.rows == range(488, 508)
+    camera.follow(480, 483, 470)
+    assert camera.rows == range(467, 487)
@@ -0,0 +1,126 @@
+from dataclasses import replace
+
+import pytest
+
+from LazyBlocks_ai import AutoPlayer, BoardState, apply_placement, enumerate_placements
+from LazyBlocks_engine import LazyBlocksEngine, RuleSet
+from LazyBlocks_snapshot import decode_snapshot, encode_snapshot
+
+
+def greedy_engines(seed: int, pieces: int, width: int = 10, height: int = 20):
+    """The engine of a greedy game, yielded before each piece."""
+    rules = RuleSet(grid_width=width, grid_height=height)
+    engine = LazyBlocksEngine(seed=seed, rules=rules)
+    player = AutoPlayer(use_helper=True)
+    for _ in range(pieces):
+        if engine.game_over:
+            return
+        yield engine
+        player.play_piece(engine)
+
+
+def rebuilt(engine: LazyBlocksEngine) -> LazyBlocksEngine:
+    """Copy of an engine with its hashes and features computed from the cells."""
+    return decode_snapshot(encode_snapshot(engine)).to_engine()
+
+
+def state_of(engine: LazyBlocksEngine):
+    """
+    Decoded snapshot of an engine, with all the cells of the grid instead of its
+    stored rows: a placement may leave empty rows stored above the stack.
+    """
+    snapshot = decode_snapshot(encode_snapshot(engine))
+    return replace(snapshot, rows=engine.grid.cells(0, engine.grid_height))
+
+
+def placements_of(engine: LazyBlocksEngine) -> list:
+    board = BoardState.from_engine(engine)
+    shapes = [engine.current_shape_idx, engine.helper_piece_idx]
+    return [
+        (shape_idx, placement)
+        for shape_idx in shapes
+        if shape_idx is not None
+        for placement in enumerate_placements(board, shape_idx)
+    ]
+
+
+def current_placements(engine: LazyBlocksEngine) -> list:
+    board = BoardState.from_engine(engine)
+    placements = enumerate_placements(board, engine.current_shape_idx)
+    return [(engine.current_shape_idx, placement) for placement in placements[::3]]
+
+
+@pytest.mark.parametrize("seed, width, height", [(0, 10, 20), (1, 6, 30), (2, 14, 12)])
+def test_make_unmake_restores_the_state(seed, width, height):
+    cleared = 0
+    for engine in greedy_engines(seed, 120, width, height):
+        state = state_of(engine)
+        position_hash = engine.position_hash
+        features = list(engine.features)
+        for shape_idx, placement in placements_of(engine):
+            undo = engine.make_placement(
+                placement.profile.shape, placement.position, shape_idx
+            )
+            copy = rebuilt(engine)
+            assert engine.grid_hash == copy.grid_hash
+            assert list(engine.features) == list(copy.features)
+            assert engine.cleared_rows - undo.cleared_rows == placement.lines
+            cleared += placement.lines > 0
+            engine.unmake_placement(undo)
+            assert state_of(engine) == state
+            assert engine.position_hash == position_hash
+            assert list(engine.features) == features
+    assert cleared
+
+
+def test_nested_make_unmake():
+    for engine in greedy_engines(3, 60):
+        state = state_of(engine)
+        for first_idx, first in placements_of(engine)[::5]:
+            outer = engine.make_placement(
+                first.profile.shape, first.position, first_idx
+            )
+            inner_state = state_of(engine)
+            for second_idx, second in placements_of(engine)[::7]:
+                inner = engine.make_placement(
+                    second.profile.shape, second.position, second_idx
+                )
+                assert engine.grid_hash == rebuilt(engine).grid_hash
+                engine.unmake_placement(inner)
+                assert state_of(engine) == inner_state
+            engine.unmake_placement(outer)
+            assert state_of(engine) == state
+
+
+def test_make_placement_matches_the_played_placement():
+    for engine in greedy_engines(4, 80):
+        for shape_idx, placement in current_placements(engine):
+            played = rebuilt(engine)
+            apply_placement(played, placement)
+            undo = engine.make_placement(
+                placement.profile.shape, placement.position, shape_idx
+            )
+            assert engine.grid_hash == played.grid_hash
+            assert engine.score == played.score
+            height = engine.grid_height
+            assert engine.grid.cells(0, height) == played.grid.cells(0, height)
+            engine.unmake_placement(undo)
+
+
+def test_undo_prev_move_takes_back_a_placement():
+    undone = 0
+    for engine in greedy_engines(5, 100):
+        for _, placement in current_placements(engine):
+            if placement.lines:
+                continue
+            copy = rebuilt(engine)
+            before = (copy.grid_hash, list(copy.features), copy.shapes_cnt)
+            apply_placement(copy, placement)
+            if copy.game_over:
+                continue
+            copy.undo_prev_move()
+            assert (copy.grid_hash, list(copy.features), copy.shapes_cnt) == before
+            assert copy.next_shape_idx == engine.current_shape_idx
+            assert copy.undo_count == engine.undo_count + 1
+            undone += 1
+    assert undone
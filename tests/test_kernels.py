@@ -0,0 +1,92 @@
+import pytest
+
+import LazyBlocks_ai
+from LazyBlocks_ai import (
+    AutoPlayer,
+    BoardState,
+    HeuristicEvaluator,
+    apply_placement,
+    enumerate_placements,
+)
+from LazyBlocks_engine import SHAPES, LazyBlocksEngine, RuleSet
+
+KERNELS = LazyBlocks_ai.KERNELS
+
+pytestmark = pytest.mark.skipif(KERNELS is None, reason="Numba is not installed")
+
+
+def game_boards(seed: int, width: int, height: int, pieces: int = 150):
+    """Boards of a game played with random placements, then greedy ones."""
+    engine = LazyBlocksEngine(
+        seed=seed, rules=RuleSet(grid_width=width, grid_height=height)
+    )
+    player = AutoPlayer()
+    for piece in range(pieces):
+        if engine.game_over:
+            return
+        board = BoardState.from_engine(engine)
+        yield board
+        placements = enumerate_placements(board, engine.current_shape_idx)
+        if piece % 3 or not placements:
+            player.play_piece(engine)
+        else:
+            apply_placement(engine, placements[seed * piece % len(placements)])
+
+
+def python_placements(board: BoardState, shape_idx: int, monkeypatch) -> list:
+    with monkeypatch.context() as patch:
+        patch.setattr(LazyBlocks_ai, "KERNELS", None)
+        return enumerate_placements(board, shape_idx)
+
+
+SIZES = [(10, 20), (6, 40), (40, 16)]
+
+
+@pytest.mark.parametrize("width, height", SIZES)
+def test_kernel_placements_match_python(monkeypatch, width, height):
+    for board in game_boards(width, width, height):
+        assert KERNELS.usable(board)
+        for shape_idx in range(len(SHAPES)):
+            expected = python_placements(board, shape_idx, monkeypatch)
+            assert enumerate_placements(board, shape_idx) == expected
+
+
+@pytest.mark.parametrize("width, height", SIZES)
+def test_kernel_features_match_python(monkeypatch, width, height):
+    evaluator = HeuristicEvaluator()
+    for board in game_boards(width + 1, width, height):
+        placements = []
+        for shape_idx in range(len(SHAPES)):
+            placements += python_placements(board, shape_idx, monkeypatch)
+        features = KERNELS.features(board, KERNELS.table(placements))
+        assert features.tolist() == [
+            list(evaluator.features(board, p)) for p in placements
+        ]
+        assert KERNELS.scores(features, evaluator.weights).tolist() == [
+            evaluator.evaluate(board, p) for p in placements
+        ]
+
+
+@pytest.mark.parametrize("use_helper", [False, True])
+def test_games_are_the_same_without_kernels(monkeypatch, use_helper):
+    def play(seed: int) -> LazyBlocksEngine:
+        engine = LazyBlocksEngine(
+            seed=seed, rules=RuleSet(helper_piece_probability=0.5)
+        )
+        player = AutoPlayer(use_helper=use_helper)
+        for _ in range(300):
+            if not player.play_piece(engine):
+                break
+        return engine
+
+    for seed in range(3):
+        compiled = play(seed)
+        with monkeypatch.context() as patch:
+            patch.setattr(LazyBlocks_ai, "KERNELS", None)
+            python = play(seed)
+        assert compiled.grid.cells(0, 20) == python.grid.cells(0, 20)
+        assert (compiled.score, compiled.swap_count) == (
+            python.score,
+            python.swap_count,
+        )
+        assert compiled.rng.getstate() == python.rng.getstate()
@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import LazyBlocks_raster
+from LazyBlocks_raster import (
+    STATUS_BAR_HEIGHT,
+    FfmpegWriter,
+    GifWriter,
+    PngSequenceWriter,
+    game_frames,
+    open_writer,
+    write_frames,
+)
+from LazyBlocks_sim import SimulationConfig
+
+
+def test_gif_keeps_the_colors_of_every_frame(tmp_path):
+    frames = list(game_frames(1, SimulationConfig(max_pieces=20), scale=2))
+    path = tmp_path / "game.gif"
+    assert write_frames(iter(frames), GifWriter(str(path), fps=10)) == len(frames)
+    gif = Image.open(path)
+    assert gif.n_frames == len(frames)
+    for i, frame in enumerate(frames):
+        gif.seek(i)
+        decoded = np.asarray(gif.convert("RGB")).astype(int)
+        error = np.abs(decoded - frame)
+        # Exact below the status bar; only the anti-aliased score text is rounded
+        assert not error[STATUS_BAR_HEIGHT // 2 :].any()
+        assert error.max() <= 8
+
+
+@pytest.mark.parametrize("ffmpeg", [None, "/usr/bin/ffmpeg"], ids=["none", "ffmpeg"])
+def test_writer_of_each_format(tmp_path, monkeypatch, ffmpeg):
+    monkeypatch.setattr(LazyBlocks_raster.shutil, "which", lambda name: ffmpeg)
+    commands = []
+
+    def popen(command, **kwargs):
+        commands.append(command)
+        return SimpleNamespace(stdin=None)
+
+    monkeypatch.setattr(LazyBlocks_raster.subprocess, "Popen", popen)
+    writer = open_writer(str(tmp_path / "game.gif"), 10, 100, 100)
+    assert type(writer) is GifWriter
+    writer.file.close()
+    for name in ["last.png", "frames"]:
+        writer = open_writer(str(tmp_path / name), 10, 100, 100)
+        assert type(writer) is PngSequenceWriter
+    if ffmpeg is None:
+        with pytest.raises(RuntimeError):
+            open_writer(str(tmp_path / "game.mp4"), 10, 100, 100)
+        assert not commands
+    else:
+        writer = open_writer(str(tmp_path / "game.mp4"), 10, 100, 100)
+        assert type(writer) is FfmpegWriter
+        assert commands[0][0] == ffmpeg and commands[0][-1].endswith("game.mp4")
@@ -0,0 +1,143 @@
+import random
+from dataclasses import replace
+
+import pytest
+
+from LazyBlocks_ai import AutoPlayer
+from LazyBlocks_engine import LazyBlocksEngine, RuleSet
+from LazyBlocks_feed import (
+    DROP,
+    MOVE_DOWN,
+    MOVE_LEFT,
+    MOVE_RIGHT,
+    ROTATE,
+    SWAP,
+    UNDO,
+)
+from LazyBlocks_replay import (
+    ArchiveWriter,
+    Replay,
+    ReplayArchive,
+    ReplayError,
+    ReplayRecorder,
+    record_game,
+)
+from LazyBlocks_sim import SimulationConfig, make_policy, new_game
+from LazyBlocks_snapshot import decode_snapshot, encode_snapshot
+
+
+def state_of(engine: LazyBlocksEngine):
+    """Decoded full snapshot, with all the cells instead of the stored rows."""
+    snapshot = decode_snapshot(encode_snapshot(engine))
+    return replace(snapshot, rows=engine.grid.cells(0, engine.grid_height))
+
+
+def recorded_game(seed: int, seeded: bool, steps: int, keyframe_interval: int):
+    """
+    A replay of keyboard actions and bot placements, and the state of the game
+    after each step.
+    """
+    rules = RuleSet(helper_piece_probability=0.5, max_undos=20)
+    engine = LazyBlocksEngine(seed=seed, rules=rules)
+    rng = random.Random(seed)
+    player = AutoPlayer(use_helper=True)
+    if not seeded:
+        for _ in range(20):
+            player.play_piece(engine)
+    recorder = ReplayRecorder(
+        engine, f"game{seed}", keyframe_interval, seed if seeded else None
+    )
+    states = [state_of(engine)]
+    while recorder.step_count < steps and not engine.game_over:
+        if rng.random() < 0.3:
+            choice = player.choose(engine)
+            if choice is None:
+                break
+            swap, placement = choice
+            recorder.place(placement, swap)
+            if swap:
+                states.append(None)  # The swap is a step of its own
+        else:
+            action = rng.choice([MOVE_LEFT, MOVE_RIGHT, MOVE_DOWN, ROTATE, SWAP, UNDO])
+            if not recorder.action(DROP if rng.random() < 0.05 else action):
+                continue
+        states.append(state_of(engine))
+    return Replay(recorder.finish()), states
+
+
+@pytest.mark.parametrize("seeded", [True, False], ids=["seeded", "unseeded"])
+@pytest.mark.parametrize("keyframe_interval", [1, 7, 64])
+def test_engine_at_matches_the_game(seeded, keyframe_interval):
+    replay, states = recorded_game(3, seeded, 400, keyframe_interval)
+    assert replay.game_id == "game3"
+    assert replay.step_count == len(states) - 1
+    assert (replay.seed is not None) == seeded
+    for step, state in enumerate(states):
+        if state is not None:
+            assert state_of(replay.engine_at(step)) == state
+    assert state_of(replay.play()) == states[-1]
+    with pytest.raises(IndexError):
+        replay.engine_at(len(states))
+
+
+@pytest.mark.parametrize("policy", ["greedy", "greedy-undo", "random"])
+def test_record_game_plays_the_simulated_game(policy):
+    config = SimulationConfig(policy=policy, max_pieces=150, max_undos=5)
+    for seed in range(3):
+        engine = new_game(seed, config)
+        player = make_policy(policy, seed)
+        for _ in range(config.max_pieces):
+            if not player.play_piece(engine):
+                break
+        replay = Replay(record_game(seed, config))
+        assert state_of(replay.play()) == state_of(engine)
+        assert state_of(replay.engine_at(replay.step_count)) == state_of(engine)
+
+
+def test_archive_finds_every_game(tmp_path):
+    path = str(tmp_path / "games.lzba")
+    replays = {}
+    with ArchiveWriter(path) as archive:
+        for i in range(40):
+            game_id = f"game-{i * 7919 % 1000}"
+            replay, _ = recorded_game(i, True, 30, 8)
+            replays[game_id] = bytes(replay.data)
+            archive.add(game_id, replays[game_id])
+        with pytest.raises(ReplayError):
+            archive.add("game-0", replays["game-0"])
+
+    archive = ReplayArchive(path)
+    try:
+        assert len(archive) == len(replays)
+        assert list(archive) == list(replays)
+        for game_id, data in replays.items():
+            assert game_id in archive
+            assert bytes(archive.replay(game_id).data) == data
+        assert "game-1" not in archive
+        with pytest.raises(KeyError):
+            archive.replay("missing")
+        engine = archive.engine_at("game-0", 10)
+        assert state_of(engine) == state_of(Replay(replays["game-0"]).engine_at(10))
+    finally:
+        archive.close()
+
+
+def test_archive_is_not_written_on_error(tmp_path):
+    path = tmp_path / "games.lzba"
+    with pytest.raises(RuntimeError):
+        with ArchiveWriter(str(path)) as archive:
+            archive.add("a", b"replay")
+            raise RuntimeError
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_invalid_data(tmp_path):
+    replay, _ = recorded_game(1, True, 20, 8)
+    data = bytes(replay.data)
+    for bad in [b"", data[:10], data[:-1], b"X" + data[1:]]:
+        with pytest.raises(ReplayError):
+            Replay(bad)
+    path = tmp_path / "empty.lzba"
+    path.write_bytes(b"")
+    with pytest.raises(ReplayError):
+        ReplayArchive(str(path))
@@ -0,0 +1,173 @@
+import csv
+import os
+import random
+
+import pytest
+
+import LazyBlocks_scores
+from LazyBlocks_scores import (
+    LEADERBOARD_FILE,
+    MERGED_FILE,
+    SCORE_COLUMNS,
+    load_leaderboard,
+    merge_shards,
+    shard_path,
+    store_score,
+)
+
+
+class Shards:
+    """Shards written line by line, and the latest line of each game."""
+
+    def __init__(self, directory, count: int, seed: int = 0):
+        self.paths = [shard_path(str(directory), f"host{i}") for i in range(count)]
+        self.rng = random.Random(seed)
+        self.clock = 0
+        self.latest = {}
+
+    def append(self, lines: int, games: int = 50):
+        for _ in range(lines):
+            path = self.rng.choice(self.paths)
+            game_id = f"game{self.rng.randrange(games):04d}"
+            player = self.rng.choice(["Ann", "Bob", "Ann, Jr."])
+            score = self.rng.randrange(1000)
+            # Distinct dates: the latest line of a game is the one with the last date
+            self.clock += 1
+            date = f"2024-01-01 {self.clock // 3600:02d}:{self.clock // 60 % 60:02d}:"
+            date += f"{self.clock % 60:02d}"
+            self.write(path, [date, player, game_id, str(score)])
+            self.latest[game_id] = [date, player, game_id, str(score)]
+
+    def write(self, path: str, row: list):
+        header = not os.path.exists(path)
+        with open(path, "a", newline="") as shard:
+            writer = csv.writer(shard)
+            if header:
+                writer.writerow(SCORE_COLUMNS)
+            writer.writerow(row)
+
+    def merged(self) -> list:
+        return [self.latest[game_id] for game_id in sorted(self.latest)]
+
+    def leaderboard(self, top: int) -> list:
+        rows = sorted(
+            self.latest.values(),
+            key=lambda row: (int(row[3]), row[0], row[2], row[1]),
+            reverse=True,
+        )
+        return rows[:top]
+
+
+def read_rows(path: str) -> list:
+    with open(path, newline="") as file:
+        reader = csv.reader(file)
+        assert next(reader) == SCORE_COLUMNS
+        return list(reader)
+
+
+def check_output(output, shards: Shards, top: int):
+    assert read_rows(os.path.join(output, MERGED_FILE)) == shards.merged()
+    leaderboard = read_rows(os.path.join(output, LEADERBOARD_FILE))
+    assert leaderboard == shards.leaderboard(top)
+
+
+def test_merge_matches_reference(tmp_path, monkeypatch):
+    # Small runs, merged in several passes
+    monkeypatch.setattr(LazyBlocks_scores, "MERGE_FAN_IN", 3)
+    shards = Shards(tmp_path / "shards", 4)
+    os.makedirs(tmp_path / "shards")
+    shards.append(500)
+    output = str(tmp_path / "merged")
+    result = merge_shards(shards.paths, output, top=10, run_rows=7)
+    assert result.rebuilt and result.shards == 4
+    assert result.games == len(shards.latest)
+    check_output(output, shards, top=10)
+
+
+def test_incremental_merge_reads_new_lines_only(tmp_path):
+    shards = Shards(tmp_path / "shards", 3, seed=1)
+    os.makedirs(tmp_path / "shards")
+    output = str(tmp_path / "merged")
+    shards.append(200)
+    merge_shards(shards.paths, output, top=5, run_rows=16)
+    sizes = [os.path.getsize(path) for path in shards.paths]
+
+    result = merge_shards(shards.paths, output, top=5)
+    assert (result.shards, result.read, result.rebuilt) == (0, 0, False)
+
+    shards.append(100)
+    result = merge_shards(shards.paths, output, top=5, run_rows=16)
+    new_bytes = sum(os.path.getsize(p) - s for p, s in zip(shards.paths, sizes))
+    assert not result.rebuilt
+    assert result.read == new_bytes
+    assert result.games == len(shards.latest)
+    check_output(output, shards, top=5)
+
+
+def test_torn_last_line_waits_for_the_next_merge(tmp_path):
+    shards = Shards(tmp_path / "shards", 1, seed=2)
+    os.makedirs(tmp_path / "shards")
+    output = str(tmp_path / "merged")
+    shards.append(20)
+    path = shards.paths[0]
+    with open(path, "a", newline="") as shard:
+        shard.write("2099-01-01 00:00:00,Eve,game9999,")
+    merge_shards(shards.paths, output)
+    check_output(output, shards, top=100)
+
+    with open(path, "a", newline="") as shard:
+        shard.write("5\r\n")
+    shards.latest["game9999"] = ["2099-01-01 00:00:00", "Eve", "game9999", "5"]
+    result = merge_shards(shards.paths, output)
+    assert not result.rebuilt
+    check_output(output, shards, top=100)
+
+
+@pytest.mark.parametrize("rewrite", ["truncated", "same size"])
+def test_rewritten_shard_rebuilds(tmp_path, rewrite):
+    shards = Shards(tmp_path / "shards", 2, seed=3)
+    os.makedirs(tmp_path / "shards")
+    output = str(tmp_path / "merged")
+    shards.append(100)
+    merge_shards(shards.paths, output)
+
+    # Another history for the first shard
+    path = shards.paths[0]
+    with open(path, newline="") as shard:
+        rows = list(csv.reader(shard))[1:]
+    if rewrite == "truncated":
+        rows = rows[: len(rows) // 2]
+    else:
+        names = {"Ann": "Amy", "Bob": "Ben", "Ann, Jr.": "Amy, Jr."}
+        rows = [
+            [date, names[player], game_id, score]
+            for date, player, game_id, score in rows
+        ]
+    os.remove(path)
+    for row in rows:
+        shards.write(path, row)
+    shards.latest = {}
+    for shard_file in shards.paths:
+        for row in read_rows(shard_file):
+            if row[2] not in shards.latest or row[0] > shards.latest[row[2]][0]:
+                shards.latest[row[2]] = row
+
+    result = merge_shards(shards.paths, output)
+    assert result.rebuilt
+    check_output(output, shards, top=100)
+
+
+def test_store_score_appends_to_the_shard(tmp_path):
+    path = shard_path(str(tmp_path), "host")
+    store_score("a", 10, "Ann", scores_file=path)
+    store_score("b", 30, "Bob\nSmith", scores_file=path)
+    store_score("a", 20, "Ann", scores_file=path)
+    rows = read_rows(path)
+    assert [row[1:] for row in rows] == [
+        ["Ann", "a", "10"],
+        ["Bob Smith", "b", "30"],
+        ["Ann", "a", "20"],
+    ]
+    leaderboard = load_leaderboard(path)
+    assert leaderboard["gameid"].tolist() == ["b", "a"]
+    assert leaderboard["score"].tolist() == [30, 20]
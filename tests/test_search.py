@@ -0,0 +1,21 @@
+import math
+
+from LazyBlocks_engine import LazyBlocksEngine
+from LazyBlocks_search import LookaheadPlanner, TranspositionTable
+
+
+def test_eviction_modes_play_the_same_game():
+    games = []
+    for depth_preferred in [False, True]:
+        table = TranspositionTable(capacity=50, depth_preferred=depth_preferred)
+        planner = LookaheadPlanner(max_depth=2, time_budget=math.inf, table=table)
+        engine = LazyBlocksEngine(seed=0)
+        plans = []
+        for _ in range(20):
+            plan = planner.plan(engine)
+            assert plan.table == table.stats()
+            plans.append((plan.swap, plan.placement.position, plan.value))
+            planner.play_piece(engine)
+        assert len(table) == 50 and table.evictions > 0
+        games.append((plans, engine.grid_hash))
+    assert games[0] == games[1]
@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+from LazyBlocks_engine import LazyBlocksEngine
+from LazyBlocks_server import GameServer
+
+
+async def exchange(path: str, *messages) -> list:
+    """Send the messages, then return the server's messages until it closes."""
+    reader, writer = await asyncio.open_unix_connection(path)
+    for message in messages:
+        writer.write(json.dumps(message).encode() + b"\n")
+    received = []
+    try:
+        while line := await asyncio.wait_for(reader.readline(), 1.0):
+            received.append(json.loads(line))
+    except asyncio.TimeoutError:
+        pass  # Still connected
+    finally:
+        writer.close()
+    return received
+
+
+def test_malformed_messages_close_the_connection(tmp_path):
+    path = str(tmp_path / "game.sock")
+    server = GameServer(path, control_token="secret")
+    errors = []
+    server.loop.set_exception_handler(lambda loop, context: errors.append(context))
+    server.start(LazyBlocksEngine(seed=0))
+    try:
+        # A token that is not ASCII is a wrong token
+        bad_token = asyncio.run(exchange(path, {"hello": "control", "token": "é"}))
+        assert bad_token[0]["type"] == "hello" and not bad_token[0]["control"]
+        assert [message["type"] for message in bad_token[1:]] == ["frame"]
+
+        for ack in [None, [1], "one"]:
+            bad_ack = asyncio.run(exchange(path, {"hello": "spectator"}, {"ack": ack}))
+            assert [message["type"] for message in bad_ack] == ["hello", "frame"]
+
+        control = asyncio.run(exchange(path, {"hello": "control", "token": "secret"}))
+        assert control[0]["control"]
+    finally:
+        server.close()
+    assert errors == []
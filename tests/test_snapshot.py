@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+from LazyBlocks_engine import LazyBlocksEngine, RuleSet
+from LazyBlocks_feed import apply_action
+from LazyBlocks_snapshot import (
+    Autosaver,
+    SnapshotError,
+    SnapshotEncoder,
+    decode_snapshot,
+    encode_snapshot,
+    load_snapshot_file,
+)
+
+
+def played_engine(seed: int, actions: int) -> LazyBlocksEngine:
+    engine = LazyBlocksEngine(seed=seed, rules=RuleSet(helper_piece_probability=0.5))
+    rng = random.Random(seed)
+    for _ in range(actions):
+        apply_action(engine, rng.choice([1, 2, 3, 4, 5, 5, 6, 7, 8]))
+    return engine
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_snapshot_round_trip(seed):
+    engine = played_engine(seed, 300)
+    data = encode_snapshot(engine, b"game")
+    snapshot = decode_snapshot(data)
+    assert snapshot.extra == b"game"
+    restored = snapshot.to_engine()
+    assert encode_snapshot(restored, b"game") == data
+    assert restored.grid_hash == engine.grid_hash
+    assert list(restored.features) == list(engine.features)
+    # Same game from there on: the random generator was restored too
+    for _ in range(50):
+        apply_action(engine, 5)
+        apply_action(restored, 5)
+    assert encode_snapshot(restored) == encode_snapshot(engine)
+
+
+def test_snapshot_without_generator_keeps_the_engines():
+    engine = played_engine(1, 100)
+    data = SnapshotEncoder().encode(engine, generator=False)
+    assert len(data) < len(encode_snapshot(engine)) - 2000
+    target = LazyBlocksEngine(seed=7)
+    state = target.rng.getstate()
+    decode_snapshot(data).restore(target)
+    assert target.rng.getstate() == state
+    assert target.grid_hash == engine.grid_hash
+
+
+def test_journal_replays_the_deltas(tmp_path):
+    path = str(tmp_path / "autosave.lzb")
+    saver = Autosaver(path, max_deltas=5)
+    engine = played_engine(2, 0)
+    rng = random.Random(2)
+    for _ in range(40):
+        for _ in range(10):
+            apply_action(engine, rng.choice([1, 2, 4, 5]))
+        saver.save(engine, b"id")
+        assert encode_snapshot(load_snapshot_file(path).to_engine(), b"id") == (
+            encode_snapshot(engine, b"id")
+        )
+
+
+def test_journal_with_a_torn_append_keeps_the_last_complete_record(tmp_path):
+    path = tmp_path / "autosave.lzb"
+    saver = Autosaver(str(path))
+    engine = played_engine(3, 0)
+    saver.save(engine)
+    apply_action(engine, 5)
+    saver.save(engine)
+    previous = encode_snapshot(engine)
+    size = path.stat().st_size
+    apply_action(engine, 5)
+    assert saver.save(engine)
+    data = path.read_bytes()
+    for end in range(size, len(data)):
+        assert encode_snapshot(decode_snapshot(data[:end]).to_engine()) == previous
+    assert encode_snapshot(decode_snapshot(data).to_engine()) == (
+        encode_snapshot(engine)
+    )
+
+
+def test_invalid_data_raises_snapshot_error():
+    data = encode_snapshot(played_engine(4, 50))
+    with pytest.raises(SnapshotError):
+        decode_snapshot(b"XXXX" + data[4:])
+    with pytest.raises(SnapshotError):
+        decode_snapshot(data[: len(data) // 2])
+    with pytest.raises(SnapshotError):
+        decode_snapshot(b"LZBJ")
@@ -0,0 +1,32 @@
+import pytest
+
+from LazyBlocks_solver import BoardClearSolver, play_solution, random_board
+
+
+def test_solution_empties_the_board():
+    engine = random_board(1, placements=3)
+    assert any(engine.board_features.row_masks)
+    grid_hash = engine.grid_hash
+    result = BoardClearSolver().solve(engine, max_placements=10)
+    assert result.solved and 0 < len(result.moves) <= 10
+    assert engine.grid_hash == grid_hash
+    play_solution(engine, result)
+    assert not engine.game_over
+    assert not any(engine.board_features.row_masks)
+
+
+def test_no_solution_within_fewer_placements():
+    engine = random_board(1, placements=3)
+    solver = BoardClearSolver()
+    shortest = len(solver.solve(engine, max_placements=10).moves)
+    result = solver.solve(engine, max_placements=shortest - 1)
+    assert result.solved is False and result.moves == []
+    assert BoardClearSolver(max_nodes=10).solve(engine, 10).solved is None
+
+
+@pytest.mark.parametrize("seed", [5, 9])
+def test_ten_placements_take_seconds(seed):
+    result = BoardClearSolver().solve(random_board(seed, 3), max_placements=10)
+    assert result.solved is False
+    assert result.nodes > 1_000
+    assert result.elapsed < 10